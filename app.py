@@ -1,47 +1,176 @@
-from flask import Flask, jsonify, request
+# torch, pretty_midi and the audio modules take seconds to import, so the
+# endpoints import them on first use and the server starts at once
+from flask import Flask, Response, jsonify, request, send_file, abort, stream_with_context
 from flask_cors import CORS
+import io
 import os
-import torch
+import tempfile
+import threading
+import time
+import functools
 import numpy as np
-from model.model import DeepRagaModel
-from model.data_processor import DataProcessor
+from data.swara_codec import note_to_midi, to_midi
+from model.registry import DEFAULT_REGISTRY_DIR, ModelBundle, ModelRegistry
+from model.raga_index import RagaIndex, midi_file_pitches
+from render_cache import RenderCache
+from observability import (BATCH_SIZE, CACHE_REQUESTS, DECODE_SECONDS, MODEL_LOAD_SECONDS,
+                           MODEL_STEP_SECONDS, QUEUE_SECONDS, TOKENS_GENERATED, current_profile, current_trace,
+                           install)
 
 app = Flask(__name__)
 CORS(app)
+# Largest request body, e.g. a WAV upload to /api/classify (413 beyond it)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('DEEPRAAGA_MAX_UPLOAD_BYTES', 128 * 1024 * 1024))
+# Trace IDs, structured request logs, /metrics and sampled torch profiles
+logger = install(app)
 
-# Global variables to hold model and processor
-model = None
-processor = None
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# Versioned models are served from the registry; requests pick a bundle once,
+# so swapping versions never disturbs generations already in flight. The device
+# (CUDA when available) is picked on the first load
+registry = ModelRegistry(os.environ.get('DEEPRAAGA_MODEL_REGISTRY', DEFAULT_REGISTRY_DIR), device=None,
+                         on_load=lambda version, seconds: observe_model_load(version, seconds))
+# Seconds between registry polls for CURRENT/traffic.json changes; 0 disables the watcher
+REGISTRY_WATCH_SECONDS = float(os.environ.get('DEEPRAAGA_REGISTRY_WATCH', 0))
+
+@functools.lru_cache(maxsize=None)
+def decoding_precision():
+    """Decoding precision: DEEPRAAGA_PRECISION=auto (bf16 on CPUs with bf16 units), bf16 or fp32"""
+    from model.precision import precision_from_env
+    return precision_from_env(registry.device)
+
+@functools.lru_cache(maxsize=None)
+def raga_index():
+    """Scales, arohanams and avarohanams of every known raga, built on first use"""
+    return RagaIndex.from_sources()
+
+# Bearer token for /admin; without one the admin endpoints are refused, unless
+# DEEPRAAGA_ADMIN_LOCAL=1 opts in to answering local requests unauthenticated
+ADMIN_TOKEN = os.environ.get('DEEPRAAGA_ADMIN_TOKEN')
+ADMIN_LOCAL = os.environ.get('DEEPRAAGA_ADMIN_LOCAL') == '1'
+
+# Rendered MIDI files are cached on disk by a hash of their inputs
+RENDER_VERSION = 1  # Bump when rendering output changes to invalidate old entries
+MAX_RENDER_NOTES = 4096
+render_cache = RenderCache(
+    os.environ.get('DEEPRAAGA_RENDER_CACHE', os.path.join('data', 'processed', 'render_cache')),
+    max_bytes=int(os.environ.get('DEEPRAAGA_RENDER_CACHE_BYTES', 256 * 1024 * 1024))
+)
+CACHE_REQUESTS.function = lambda: {('render', 'hit'): render_cache.hits, ('render', 'miss'): render_cache.misses}
+
+# LSTM states after seed prefixes (arohanam, pakad, client prompts), per model version
+PREFIX_CACHE_BYTES = int(os.environ.get('DEEPRAAGA_PREFIX_CACHE_BYTES', 64 * 1024 * 1024))
+MAX_PREFIX_NOTES = 512
+
+# Loading state reported by /ready: loading, ready, simulated (no trained model) or failed
+model_state = {'status': 'loading', 'load_seconds': None, 'error': None}
+model_ready = threading.Event()
+
+def observe_model_load(version, seconds):
+    MODEL_LOAD_SECONDS.set(seconds, model=f'deepraaga:{version}')
+    logger.info('model loaded', extra={'fields': {'version': version, 'load_seconds': seconds}})
 
 def load_model():
-    global model, processor
+    start = time.perf_counter()
     try:
-        processor = DataProcessor()
+        decoding_precision()
         vocab_path = os.path.join('data', 'processed', 'vocab.pkl')
         model_path = os.path.join('model', 'trained_model.pth')
-        
-        if os.path.exists(vocab_path) and os.path.exists(model_path):
-            processor.load_vocab(vocab_path)
-            vocab_size = len(processor.note_to_int)
-            
-            # Hyperparameters must match training
-            embedding_dim = 64
-            hidden_size = 256
-            num_layers = 2
-            
-            model = DeepRagaModel(vocab_size, embedding_dim, hidden_size, num_layers).to(device)
-            model.load_state_dict(torch.load(model_path, map_location=device))
-            model.eval()
-            print("Model and vocabulary loaded successfully.")
+
+        if registry.versions():
+            registry.sync()
+        elif os.path.exists(vocab_path) and os.path.exists(model_path):
+            # A checkpoint that was never published is served as version "legacy"
+            registry.add(ModelBundle.from_files('legacy', model_path, vocab_path, device=registry.device))
+            observe_model_load('legacy', time.perf_counter() - start)
+        if registry.default_version is not None:
+            model_state['status'] = 'ready'
         else:
-            print("Model or vocabulary not found. Generation will be simulated.")
+            model_state['status'] = 'simulated'
+            logger.warning('model or vocabulary not found; generation will be simulated')
     except Exception as e:
-        print(f"Error loading model: {str(e)}")
+        model_state.update(status='failed', error=str(e))
+        logger.exception(f'error loading model: {str(e)}')
+    model_state['load_seconds'] = time.perf_counter() - start
+    model_ready.set()
+    # Off the request path too, so the first identify or prefixed generation is fast
+    raga_index()
+    if REGISTRY_WATCH_SECONDS > 0:
+        registry.watch(REGISTRY_WATCH_SECONDS)
+
+# Load and warm the model in the background so the server accepts traffic at once
+threading.Thread(target=load_model, name='model-loader', daemon=True).start()
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the model is warm (or generation is simulated), else 503"""
+    status = 200 if model_state['status'] in ('ready', 'simulated') else 503
+    return jsonify({**model_state, 'default_version': registry.default_version,
+                    'loaded_versions': registry.loaded_versions(),
+                    'precision': decoding_precision() if model_ready.is_set() else None}), status
+
+def observe_generation_step(batch_size, seconds, queue_seconds):
+    MODEL_STEP_SECONDS.observe(seconds, endpoint='/api/generate')
+    BATCH_SIZE.observe(batch_size, model='deepraaga')
+    for queued in queue_seconds:
+        QUEUE_SECONDS.observe(queued, endpoint='/api/generate')
+
+def admin_allowed():
+    if ADMIN_TOKEN:
+        return request.headers.get('Authorization') == f'Bearer {ADMIN_TOKEN}'
+    return ADMIN_LOCAL and request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/admin/models', methods=['GET'])
+def list_models():
+    if not admin_allowed():
+        abort(403)
+    return jsonify(registry.describe())
+
+@app.route('/admin/models/<version>/load', methods=['POST'])
+def load_model_version(version):
+    """Load a registry version in the background; {"activate": true} routes traffic to it once warm"""
+    if not admin_allowed():
+        abort(403)
+    if version not in registry.versions():
+        return jsonify({'error': f'No version {version} in the registry'}), 404
+    data = request.get_json(silent=True) or {}
+    registry.load_async(version, activate=bool(data.get('activate')))
+    return jsonify({'version': version, 'status': 'loading'}), 202
+
+@app.route('/admin/models/<version>/activate', methods=['POST'])
+def activate_model_version(version):
+    if not admin_allowed():
+        abort(403)
+    try:
+        registry.activate(version)
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 409
+    return jsonify(registry.describe())
+
+@app.route('/admin/models/<version>', methods=['DELETE'])
+def unload_model_version(version):
+    if not admin_allowed():
+        abort(403)
+    try:
+        registry.unload(version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(registry.describe())
 
-# Load model on startup
-# Load model on startup
-load_model()
+@app.route('/admin/models/traffic', methods=['PUT'])
+def set_model_traffic():
+    """Split traffic between loaded versions for A/B tests, e.g. {"v1": 0.9, "v2": 0.1}"""
+    if not admin_allowed():
+        abort(403)
+    shares = request.get_json(silent=True)
+    if not isinstance(shares, dict):
+        return jsonify({'error': 'Expected an object of version: share'}), 400
+    try:
+        registry.set_traffic({version: float(share) for version, share in shares.items()})
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(registry.describe())
 
 @app.route('/', methods=['GET'])
 def index():
@@ -57,51 +186,273 @@ def generate_audio():
     duration = data.get('duration', 30) # duration in notes, roughly
     temperature = float(data.get('temperature', 1.0))
     
-    if model is None or processor is None:
+    if model_state['status'] in ('loading', 'failed'):
+        response = jsonify({'error': f"Model is {model_state['status']}"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    
+    try:
+        # Pinned by header or body, else the A/B split (sticky per client ID), else the default
+        bundle = registry.select(request.headers.get('X-Model-Version') or data.get('model_version'),
+                                 key=request.headers.get('X-Client-ID'))
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 404
+
+    if bundle is None:
         # Fallback for when model is not trained yet
         return jsonify({
             'notes': ['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4', 'C5'],
             'message': 'Model not trained yet. Returning scale.'
         })
-        
+
+    # Optional seed phrase: note tokens, or the raga's arohanam/avarohanam
     try:
-        # Seed sequence (could be random or specific to raga if we had raga conditioning)
-        # For now, pick a random start sequence from vocab
-        start_seq = [np.random.randint(0, len(processor.note_to_int))]
-        
-        generated_indices = start_seq[:]
-        input_seq = torch.LongTensor([start_seq]).to(device)
-        hidden = None
-        
-        # Generate notes
-        num_notes = int(duration) # Treat duration as number of notes for now
-        
-        with torch.no_grad():
-            for _ in range(num_notes):
-                output, hidden = model(input_seq, hidden)
-                
-                # Apply temperature
-                logits = output / temperature
-                probs = torch.softmax(logits, dim=1)
-                
-                # Sample next note
-                next_note_idx = torch.multinomial(probs, 1).item()
-                generated_indices.append(next_note_idx)
-                
-                # Prepare input for next step
-                input_seq = torch.LongTensor([[next_note_idx]]).to(device)
+        prefix = seed_prefix(bundle, raga, data.get('prefix'))
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': e.args[0]}), 400
         
-        # Convert indices back to note names
-        generated_notes = [processor.int_to_note[idx] for idx in generated_indices]
+    try:
+        # Seed with the prefix or a random vocabulary entry and treat duration
+        # as the number of notes to generate. Requests share decoding steps
+        # through the bundle's batcher, whatever their raga or temperature
+        trace = current_trace()
+        endpoint = '/api/generate'
+        raga_id = bundle.raga_id(raga)
+        state = None
+        if prefix:
+            # All but the last prefix note are encoded once and cached; the last
+            # one is the first input of the decoding steps
+            with trace.span('prefill'):
+                state = bundle.prefix_cache(max_bytes=PREFIX_CACHE_BYTES, on_lookup=observe_prefix_lookup) \
+                    .state(prefix[:-1], raga_id)
+            start_index = prefix[-1]
+        else:
+            start_index = np.random.randint(0, len(bundle.int_to_note))
+        batcher = bundle.batcher(on_step=observe_generation_step, precision=decoding_precision())
+        profile = current_profile()
+        if profile is not None:
+            # The model steps run on the batcher thread, which records them itself
+            profile.stop()
+        with trace.span('model'):
+            generated_indices = batcher.submit(start_index, int(duration), temperature, raga_id,
+                                               state=state, profile=profile).result()
+        TOKENS_GENERATED.inc(len(generated_indices) - 1)
+        generated_indices = prefix[:-1] + generated_indices
         
-        return jsonify({
-            'notes': generated_notes,
-            'raga': raga
-        })
+        with trace.span('decode', DECODE_SECONDS, endpoint=endpoint):
+            response = jsonify({
+                'notes': [bundle.int_to_note[idx] for idx in generated_indices],
+                'raga': raga
+            })
+        response.headers['X-Model-Version'] = bundle.version
+        return response
         
     except Exception as e:
-        print(f"Generation error: {str(e)}")
+        logger.exception(f'generation error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+def observe_prefix_lookup(result):
+    CACHE_REQUESTS.inc(cache='prefix', result=result)
+
+def seed_prefix(bundle, raga, prefix):
+    """Vocabulary indices of a request's seed phrase: a list of notes, or 'arohanam'/'avarohanam' of the raga"""
+    if not prefix:
+        return []
+    if prefix in ('arohanam', 'avarohanam'):
+        index = raga_index()
+        position = index.position(raga) if raga else None
+        if position is None:
+            raise ValueError(f'An {prefix} prefix needs a known raga, got {raga!r}')
+        swaras = index.arohanams[position] if prefix == 'arohanam' else index.avarohanams[position]
+        prefix = to_midi(swaras).tolist()
+    if not isinstance(prefix, list) or len(prefix) > MAX_PREFIX_NOTES:
+        raise ValueError(f'prefix must be a list of at most {MAX_PREFIX_NOTES} notes, or arohanam/avarohanam')
+    return bundle.note_indices(prefix)
+
+def render_midi(pitches, tempo, style, gamaka, seed):
+    """Render MIDI pitches with the voice or piano builder and return the file bytes"""
+    import pretty_midi
+    from data.raw.process_raga_audio import create_midi_sequence
+    from data.raw.generate_melakarta_ragas import create_raga_sequence
+    if style == 'piano':
+        names = [pretty_midi.note_number_to_name(p) for p in pitches]
+        midi_data = create_raga_sequence(names, tempo=tempo, mirror=False)
+    else:
+        midi_data = create_midi_sequence(pitches, duration=60.0 / tempo, gamaka=gamaka,
+                                         rng=np.random.default_rng(seed))
+    buffer = io.BytesIO()
+    midi_data.write(buffer)
+    return buffer.getvalue()
+
+def send_render(key, cache_status):
+    response = send_file(render_cache.path_for(key), mimetype='audio/midi',
+                         download_name=f'deepraaga-{key[:12]}.mid', etag=key,
+                         conditional=True, max_age=31536000)
+    response.headers['X-Render-Cache'] = cache_status
+    response.headers['X-Render-URL'] = f'/api/render/{key}'
+    return response
+
+@app.route('/api/render', methods=['POST'])
+def render():
+    from data.raw.process_raga_audio import GAMAKA_CONTOURS
+    data = request.get_json(silent=True) or {}
+    notes = data.get('notes') or []
+    style = data.get('style', 'voice')
+    gamaka = data.get('gamaka')
+    try:
+        tempo = float(data.get('tempo', 120))
+        pitches = [note_to_midi(n) for n in notes]
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid notes or tempo: {str(e)}'}), 400
+    if not pitches or len(pitches) > MAX_RENDER_NOTES:
+        return jsonify({'error': f'Expected 1 to {MAX_RENDER_NOTES} notes'}), 400
+    if not 20 <= tempo <= 400 or style not in ('voice', 'piano'):
+        return jsonify({'error': 'tempo must be 20-400 and style voice or piano'}), 400
+    if gamaka is not None and (not isinstance(gamaka, str) or gamaka not in GAMAKA_CONTOURS):
+        return jsonify({'error': f"gamaka must be one of {', '.join(GAMAKA_CONTOURS)}"}), 400
+    if not all(0 <= p <= 127 for p in pitches):
+        return jsonify({'error': 'Notes must be MIDI pitches 0-127'}), 400
+
+    key = RenderCache.key_for({
+        'version': RENDER_VERSION, 'pitches': pitches, 'tempo': tempo, 'style': style, 'gamaka': gamaka,
+    })
+    if render_cache.get(key) is not None:
+        return send_render(key, 'hit')
+
+    try:
+        with current_trace().span('render'):
+            midi_bytes = render_midi(pitches, tempo, style, gamaka, seed=int(key[:16], 16))
+    except Exception as e:
+        logger.exception(f'render error: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+    render_cache.put(key, midi_bytes)
+    return send_render(key, 'miss')
+
+@app.route('/api/render/<key>', methods=['GET'])
+def get_render(key):
+    # Rendered files are immutable, so conditional GETs can be answered from the ETag alone
+    if len(key) != 64 or render_cache.get(key) is None:
+        abort(404)
+    return send_render(key, 'hit')
+
+@app.route('/api/identify', methods=['POST'])
+def identify():
+    """Rank candidate ragas for a note list (JSON) or an uploaded MIDI file"""
+    upload = request.files.get('file')
+    try:
+        if upload is not None:
+            data = request.form
+            with tempfile.NamedTemporaryFile(suffix='.mid') as f:
+                upload.save(f.name)
+                pitches = midi_file_pitches(f.name)
+        else:
+            data = request.get_json(silent=True) or {}
+            pitches = [note_to_midi(n) for n in data.get('notes') or []]
+        tonic = int(data.get('tonic', 60))
+        top_k = int(data.get('top_k', 5))
+    except Exception as e:
+        return jsonify({'error': f'Could not read notes: {str(e)}'}), 400
+    if not pitches:
+        return jsonify({'error': 'No notes to identify'}), 400
+    with current_trace().span('identify'):
+        candidates = raga_index().identify(pitches, tonic=tonic, top_k=top_k)
+    return jsonify({'candidates': candidates})
+
+# The audio raga classifier is loaded at startup; fit it beforehand with
+# `python -m model.raga_classifier`. Classifiers whose held-out accuracy
+# does not beat chance are not served
+classifier_batcher = None
+classifier_error = 'Raga classifier is loading'
+# Longest clip /api/classify pitch-tracks, in seconds
+MAX_CLASSIFY_SECONDS = float(os.environ.get('DEEPRAAGA_MAX_CLASSIFY_SECONDS', 600))
+
+def observe_classifier_batch(batch_size, queue_seconds):
+    BATCH_SIZE.observe(batch_size, model='raga_classifier')
+    for seconds in queue_seconds:
+        QUEUE_SECONDS.observe(seconds, endpoint='/api/classify')
+
+def load_classifier():
+    global classifier_batcher, classifier_error
+    from model.raga_classifier import DEFAULT_MODEL_PATH, MicroBatcher, RagaClassifier
+    if not os.path.exists(DEFAULT_MODEL_PATH):
+        classifier_error = 'Raga classifier is not trained; run python -m model.raga_classifier'
+        logger.warning(classifier_error)
+        return
+    start = time.perf_counter()
+    try:
+        classifier = RagaClassifier.load(DEFAULT_MODEL_PATH)
+    except Exception as e:
+        classifier_error = f'Could not load the raga classifier: {str(e)}'
+        logger.exception(classifier_error)
+        return
+    if not classifier.validated:
+        classifier_error = ('Raga classifier has no held-out accuracy above chance; '
+                            'retrain it with python -m model.raga_classifier')
+        logger.warning(classifier_error)
+        return
+    MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model='raga_classifier')
+    classifier_batcher = MicroBatcher(classifier, on_batch=observe_classifier_batch)
+
+threading.Thread(target=load_classifier, name='classifier-loader', daemon=True).start()
+
+@app.route('/api/classify', methods=['POST'])
+def classify():
+    """Classify the raga of a WAV clip (WAV only), pitch-tracking it while the upload streams in"""
+    from model.raga_classifier import AudioTooLong, StreamingWavFeatures
+    batcher = classifier_batcher
+    if batcher is None:
+        return jsonify({'error': classifier_error}), 503
+    trace = current_trace()
+    features = StreamingWavFeatures(max_seconds=MAX_CLASSIFY_SECONDS)
+    try:
+        with trace.span('features'):
+            while True:
+                chunk = request.stream.read(65536)
+                if not chunk:
+                    break
+                features.feed(chunk)
+            vector = features.finish()
+    except AudioTooLong as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if vector is None:
+        return jsonify({'error': 'No pitched audio found'}), 422
+    with trace.span('classify'):
+        probs = batcher.submit(vector).result()
+    top_k = int(request.args.get('top_k', 5))
+    return jsonify({'candidates': batcher.classifier.top_k(probs, top_k)})
+
+MAX_SYNTH_SECONDS = 600
+
+@app.route('/api/synthesize', methods=['POST'])
+def synthesize():
+    """Stream a generated melody over a tanpura drone as a 16-bit mono WAV"""
+    from model.synthesis import Synthesizer, stream_wav, swaras_to_midi
+    data = request.get_json(silent=True) or {}
+    try:
+        tempo = float(data.get('tempo', 120))
+        tonic = int(data.get('tonic', 60))
+        if data.get('swaras'):
+            pitches = swaras_to_midi(data['swaras'], tonic_midi=tonic)
+        else:
+            pitches = [note_to_midi(n) for n in data.get('notes') or []]
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid notes, tempo or tonic: {str(e)}'}), 400
+    if not pitches or not 20 <= tempo <= 400:
+        return jsonify({'error': 'Expected notes or swaras and a tempo of 20-400'}), 400
+
+    try:
+        synthesizer = Synthesizer(pitches, note_duration=60.0 / tempo, tonic_midi=tonic,
+                                  gamaka=data.get('gamaka'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if synthesizer.duration > MAX_SYNTH_SECONDS:
+        return jsonify({'error': f'Audio longer than {MAX_SYNTH_SECONDS} seconds'}), 400
+
+    response = Response(stream_with_context(stream_wav(synthesizer)), mimetype='audio/wav')
+    response.headers['Content-Length'] = str(44 + 2 * synthesizer.num_samples)
+    return response
+
 if __name__ == '__main__':
     app.run(port=8000, debug=True)
\ No newline at end of file
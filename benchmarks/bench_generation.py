@@ -0,0 +1,306 @@
+"""Latency and throughput benchmark of note generation, in-process and over HTTP.
+
+Sweeps concurrency, duration (notes per request) and temperature against a
+randomly initialised DeepRagaModel, so no trained checkpoint is needed, and
+reports p50/p95/p99 latency, time to first note, tokens/sec and memory.
+In-process requests go through a GenerationBatcher, as /api/generate does,
+so concurrent requests share decoding steps.
+Each temperature also gets a grammar case: a batch of generated phrases
+scored by model.grammar against random Melakarta targets, so a speed-up that
+changes what gets sampled shows up as a grammar regression. Prefill cases time
+encoding a seed prefix step by step, in one pass (a PrefixCache miss) and
+from the cache.
+
+    python -m benchmarks.bench_generation --output bench.json
+    python -m benchmarks.bench_generation --compare bench.json --threshold 0.1
+
+HTTP runs start the Flask app on a local port unless --url points at an
+already running server (whose memory is then not measured).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import platform
+import threading
+import resource
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from data.melakarta_init import MELAKARTA_INDEX
+from data.swara_codec import melakarta_scale, to_midi
+from model.generation import MODEL_CONFIG, GenerationBatcher, PrefixCache, build_model, generate_batch
+from model.grammar import GrammarScorer, pitch_table
+from model.raga_index import RagaIndex
+from model.registry import ModelBundle
+from benchmarks.regression import compare
+
+# Lower is better for latencies, higher for throughput
+GATED_METRICS = {'latency_p95_ms': 'lower', 'ttfn_p50_ms': 'lower', 'tokens_per_sec': 'higher',
+                 'out_of_scale_rate': 'lower', 'direction_violation_rate': 'lower'}
+
+
+def rss_mb():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        scale = 1 if platform.system() == 'Darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+class PeakMemory:
+    """Sample RSS on a background thread while a benchmark case runs"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def synthetic_vocab(vocab_size):
+    """Note names standing in for a trained vocabulary"""
+    names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    return {i: f'{names[i % 12]}{2 + i // 12}' for i in range(vocab_size)}
+
+
+def inprocess_request(batcher, vocab_size, duration, temperature):
+    """Submit one request to the batcher; returns (latency, time to first note, tokens).
+
+    A request's notes all arrive together, so its first note comes with the
+    last, as in the /api/generate response.
+    """
+    start = time.perf_counter()
+    notes = batcher.submit(np.random.randint(vocab_size), duration, temperature).result()
+    latency = time.perf_counter() - start
+    return latency, latency, len(notes) - 1
+
+
+def http_request(url, duration, temperature):
+    """POST /api/generate; time to first note is time to the first response byte"""
+    body = json.dumps({'raga': 'Mayamalavagowla', 'duration': duration,
+                       'temperature': temperature}).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req) as response:
+        head = response.read(1)
+        first = time.perf_counter() - start
+        result = json.loads(head + response.read())
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return time.perf_counter() - start, first, len(result['notes']) - 1
+
+
+def start_local_server(model, int_to_note):
+    """Serve app.py on a free local port with the given model and vocabulary"""
+    from werkzeug.serving import make_server
+    import app as server
+    server.model_ready.wait()
+    # No per-request access logs from werkzeug or the app's structured logger
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('deepraaga').setLevel(logging.WARNING)
+    note_to_int = {note: i for i, note in int_to_note.items()}
+    server.registry.add(ModelBundle('benchmark', model, note_to_int, int_to_note,
+                                    {'version': 'benchmark', 'vocab_size': len(int_to_note)}), activate=True)
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f'http://127.0.0.1:{httpd.server_port}/api/generate'
+
+
+def run_case(request_fn, concurrency, num_requests, measure_memory):
+    """Issue `num_requests` calls from `concurrency` threads and summarise them"""
+    request_fn()  # warm-up
+    with PeakMemory() as memory, ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda _: request_fn(), range(num_requests)))
+        wall = time.perf_counter() - start
+    latencies = np.array([r[0] for r in results]) * 1000
+    firsts = np.array([r[1] for r in results]) * 1000
+    tokens = sum(r[2] for r in results)
+    summary = {
+        'requests': num_requests,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p95_ms': float(np.percentile(latencies, 95)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'ttfn_p50_ms': float(np.percentile(firsts, 50)),
+        'ttfn_p95_ms': float(np.percentile(firsts, 95)),
+        'tokens_per_sec': tokens / wall,
+        'requests_per_sec': num_requests / wall,
+    }
+    if measure_memory:
+        summary['peak_rss_mb'] = memory.peak
+    return summary
+
+
+def grammar_case(model, int_to_note, num_sequences, num_notes, temperature, seed):
+    """Generate a batch of phrases and score them against random Melakarta ragas.
+
+    The novelty index holds stepwise walks over the same scales, standing in
+    for a training corpus.
+    """
+    scorer = GrammarScorer.from_raga_index(RagaIndex.from_sources())
+    rng = np.random.default_rng(seed)
+    numbers = rng.integers(1, 73, size=num_sequences)
+    walks = []
+    for number in np.unique(numbers):
+        scale = to_midi(melakarta_scale(number))[:7]
+        position = np.clip(7 + np.cumsum(rng.integers(-1, 2, size=(16, num_notes)), axis=1), 0, 20)
+        walks.extend(np.concatenate([scale - 12, scale, scale + 12])[position])
+    scorer.index_ngrams(walks)
+
+    generator = torch.Generator().manual_seed(seed)
+    start = time.perf_counter()
+    sequences = generate_batch(model, rng.integers(0, len(int_to_note), size=num_sequences), num_notes,
+                               temperature, generator=generator)
+    generate_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    metrics = scorer.score(pitch_table(int_to_note)[sequences], [MELAKARTA_INDEX[n] for n in numbers])
+    return {**metrics, 'generate_seconds': generate_seconds, 'score_ms': (time.perf_counter() - start) * 1000}
+
+
+def prefill_case(model, vocab_size, prefix_length, repeats=20):
+    """Milliseconds to reach the LSTM state after a random prefix: stepwise, one pass and cached"""
+    prefix = torch.randint(vocab_size, (prefix_length,)).tolist()
+    timings = {'stepwise': [], 'miss': [], 'hit': []}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        hidden = None
+        with torch.no_grad():
+            for index in prefix:
+                _, hidden = model(torch.tensor([[index]]), hidden)
+        timings['stepwise'].append(time.perf_counter() - start)
+        cache = PrefixCache(model)
+        for result in ('miss', 'hit'):
+            start = time.perf_counter()
+            cache.state(prefix)
+            timings[result].append(time.perf_counter() - start)
+    return {f'prefill_{name}_ms': float(np.median(values) * 1000) for name, values in timings.items()}
+
+
+def case_key(case):
+    return f"{case['mode']}/c{case['concurrency']}/n{case['duration']}/t{case['temperature']}"
+
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['inprocess', 'http', 'both'], default='both')
+    parser.add_argument('--url', help='Benchmark a running server instead of starting one')
+    parser.add_argument('--concurrency', default='1,4', help='Comma-separated client thread counts')
+    parser.add_argument('--durations', default='32,128', help='Comma-separated notes per request')
+    parser.add_argument('--temperatures', default='1.0', help='Comma-separated sampling temperatures')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per case')
+    parser.add_argument('--vocab-size', type=int, default=128)
+    parser.add_argument('--grammar-samples', type=int, default=512,
+                        help='Phrases per grammar case (0 skips the grammar cases)')
+    parser.add_argument('--prefix-lengths', default='16,128',
+                        help='Comma-separated seed prefix lengths for the prefill cases (empty skips them)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON to gate against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed relative regression before failing (default 10%%)')
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    int_to_note = synthetic_vocab(args.vocab_size)
+    model = build_model(args.vocab_size)
+
+    modes = ['inprocess', 'http'] if args.mode == 'both' else [args.mode]
+    server = url = None
+    if 'http' in modes:
+        if args.url:
+            url = args.url
+        else:
+            server, url = start_local_server(model, int_to_note)
+
+    results = {
+        'config': {**vars(args), 'model': MODEL_CONFIG, 'torch_threads': torch.get_num_threads()},
+        'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'cases': [],
+    }
+    for mode in modes:
+        for concurrency in parse_list(args.concurrency, int):
+            for duration in parse_list(args.durations, int):
+                for temperature in parse_list(args.temperatures, float):
+                    batch_sizes = []
+                    if mode == 'inprocess':
+                        # A fresh batcher per case, so its batch sizes are the case's own
+                        batcher = GenerationBatcher(model, on_step=lambda size, *_: batch_sizes.append(size))
+                        request_fn = lambda: inprocess_request(batcher, args.vocab_size, duration, temperature)
+                    else:
+                        request_fn = lambda: http_request(url, duration, temperature)
+                    summary = run_case(request_fn, concurrency, args.requests,
+                                       measure_memory=mode == 'inprocess' or server is not None)
+                    if mode == 'inprocess':
+                        batcher.close()
+                        summary['mean_batch_size'] = float(np.mean(batch_sizes))
+                    case = {'mode': mode, 'concurrency': concurrency, 'duration': duration,
+                            'temperature': temperature, **summary}
+                    results['cases'].append(case)
+                    print(f"{case_key(case):32s} p50 {case['latency_p50_ms']:8.1f} ms  "
+                          f"p95 {case['latency_p95_ms']:8.1f} ms  p99 {case['latency_p99_ms']:8.1f} ms  "
+                          f"ttfn {case['ttfn_p50_ms']:6.1f} ms  {case['tokens_per_sec']:8.0f} tok/s  "
+                          f"rss {case.get('peak_rss_mb', float('nan')):6.0f} MB")
+    if server is not None:
+        server.shutdown()
+
+    if args.grammar_samples > 0:
+        num_notes = max(parse_list(args.durations, int))
+        for temperature in parse_list(args.temperatures, float):
+            case = {'mode': 'grammar', 'concurrency': args.grammar_samples, 'duration': num_notes,
+                    'temperature': temperature,
+                    **grammar_case(model, int_to_note, args.grammar_samples, num_notes, temperature, args.seed)}
+            results['cases'].append(case)
+            print(f"{case_key(case):32s} out-of-scale {case['out_of_scale_rate']:6.1%}  "
+                  f"direction {case['direction_violation_rate']:6.1%}  novelty {case['ngram_novelty']:6.1%}  "
+                  f"range {case['pitch_range_mean']:5.1f}  scored in {case['score_ms']:.1f} ms")
+
+    for prefix_length in parse_list(args.prefix_lengths, int) if args.prefix_lengths else []:
+        case = {'mode': 'prefill', 'concurrency': 1, 'duration': prefix_length, 'temperature': 1.0,
+                **prefill_case(model, args.vocab_size, prefix_length)}
+        results['cases'].append(case)
+        print(f"{case_key(case):32s} stepwise {case['prefill_stepwise_ms']:8.2f} ms  "
+              f"one pass {case['prefill_miss_ms']:8.2f} ms  cached {case['prefill_hit_ms']:8.3f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results['cases'], baseline['cases'], case_key, GATED_METRICS, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
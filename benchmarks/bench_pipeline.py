@@ -0,0 +1,267 @@
+"""Stage-by-stage throughput benchmark of the offline preprocessing and training pipeline.
+
+Writes a synthetic MIDI corpus of random phrases in random Melakarta ragas
+(through generate_melakarta_ragas.create_raga_sequence), then times each
+stage on its own: music21 parsing (cold and from its cache), vocabulary
+build, windowing, saving, dataset loading, the grammar check over the
+windows, on-the-fly augmentation and training steps (plain and augmented).
+Parsing is timed per process count and training per DataLoader worker
+count; the existing single-process DataProcessor.process_dataset is timed
+end to end for reference.
+
+    python -m benchmarks.bench_pipeline --sizes 50,200 --output pipeline.json
+    python -m benchmarks.bench_pipeline --compare pipeline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from data.raw.generate_melakarta_ragas import create_raga_sequence, melakarta_names
+from data.swara_codec import melakarta_scale, midi_to_note_names, to_midi
+from model.data_processor import DataProcessor
+from model.generation import build_model
+from model.raga_index import RagaIndex
+from model.augment import TokenAugmenter
+from benchmarks.regression import compare
+
+# model/train.py imports its siblings as top-level modules
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model'))
+from model.train import GrammarCheck, RagaDataset
+
+GATED_METRICS = {'items_per_sec': 'higher'}
+
+
+def synthesize_corpus(output_dir, num_files, notes_per_file=300, seed=0):
+    """Write `num_files` MIDI files of random-walk phrases over Melakarta scales.
+
+    Files go to numbered raga folders (e.g. 15_Mayamalavagowla/) so the
+    catalog labels them like the real dataset.
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(num_files):
+        number = int(rng.integers(1, 73))
+        scale = to_midi(melakarta_scale(number))[:7]
+        # Three octaves of the scale, walked in steps of up to two swaras
+        degrees = np.concatenate([scale - 12, scale, scale + 12])
+        steps = rng.integers(-2, 3, size=notes_per_file)
+        position = np.clip(len(scale) + np.cumsum(steps), 0, len(degrees) - 1)
+        names = midi_to_note_names(degrees[position])
+        tempo = int(rng.integers(80, 161))
+        raga_dir = os.path.join(output_dir, f'{number:02d}_{melakarta_names[number]}')
+        os.makedirs(raga_dir, exist_ok=True)
+        path = os.path.join(raga_dir, f'synthetic_{i:05d}.mid')
+        create_raga_sequence(names, tempo=tempo, mirror=False).write(path)
+        paths.append(path)
+    return paths
+
+
+def _parse_notes(path, force_source=True):
+    return DataProcessor().parse_notes(path, force_source=force_source)
+
+
+def stage(name, corpus_size, workers, seconds, items, unit):
+    return {'stage': name, 'corpus_size': corpus_size, 'workers': workers, 'seconds': seconds,
+            'items': items, 'unit': unit, 'items_per_sec': items / seconds if seconds else 0.0}
+
+
+def case_key(case):
+    return f"{case['stage']}/n{case['corpus_size']}/w{case['workers']}"
+
+
+def train_steps(dataset, vocab_size, num_workers, batch_size, num_steps, collate_fn=None):
+    """Time `num_steps` optimizer steps fed by a DataLoader with `num_workers` workers"""
+    model = build_model(vocab_size)
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters())
+    criterion = nn.CrossEntropyLoss()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                        persistent_workers=num_workers > 0, collate_fn=collate_fn)
+    steps = 0
+    start = None
+    while steps < num_steps + 1:
+        for batch in loader:
+            optimizer.zero_grad()
+            outputs, _ = model(batch['sequence'])
+            loss = criterion(outputs, batch['target'])
+            loss.backward()
+            optimizer.step()
+            steps += 1
+            if start is None:
+                # The first step pays for worker start-up and is not timed
+                start = time.perf_counter()
+            if steps == num_steps + 1:
+                break
+    return time.perf_counter() - start
+
+
+def run_corpus(corpus_size, args, work_dir):
+    cases = []
+    corpus_dir = os.path.join(work_dir, 'raw')
+    start = time.perf_counter()
+    paths = synthesize_corpus(corpus_dir, corpus_size, args.notes_per_file, args.seed)
+    cases.append(stage('generate', corpus_size, 1, time.perf_counter() - start, len(paths), 'files'))
+
+    # music21 builds its caches on the first parse; keep that out of the timings
+    _parse_notes(paths[0])
+    for workers in args.workers:
+        start = time.perf_counter()
+        if workers == 1:
+            parsed = [_parse_notes(p) for p in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = list(executor.map(_parse_notes, paths, chunksize=max(1, len(paths) // (4 * workers))))
+        cases.append(stage('parse', corpus_size, workers, time.perf_counter() - start, len(paths), 'files'))
+
+    # Later passes over the same files are served from music21's pickle cache,
+    # which the first default parse writes
+    for path in paths:
+        _parse_notes(path, force_source=False)
+    start = time.perf_counter()
+    for path in paths:
+        _parse_notes(path, force_source=False)
+    cases.append(stage('parse_cached', corpus_size, 1, time.perf_counter() - start, len(paths), 'files'))
+
+    processor = DataProcessor(sequence_length=args.sequence_length)
+    start = time.perf_counter()
+    for notes in parsed:
+        processor.update_vocab(notes)
+    num_notes = sum(len(notes) for notes in parsed)
+    cases.append(stage('vocab', corpus_size, 1, time.perf_counter() - start, num_notes, 'notes'))
+
+    start = time.perf_counter()
+    windows = [processor.make_windows(notes) for notes in parsed]
+    X = np.concatenate([w[0] for w in windows if len(w[0])])
+    y = np.concatenate([w[1] for w in windows if len(w[1])])
+    # Raga ID of each window: the Melakarta number of its file's folder
+    ragas = np.concatenate([np.full(len(w[0]), int(os.path.basename(os.path.dirname(path)).split('_')[0]),
+                                    dtype=np.int16) for w, path in zip(windows, paths)])
+    cases.append(stage('windowing', corpus_size, 1, time.perf_counter() - start, len(X), 'windows'))
+
+    processed_dir = os.path.join(work_dir, 'processed')
+    os.makedirs(processed_dir, exist_ok=True)
+    start = time.perf_counter()
+    np.save(os.path.join(processed_dir, 'X.npy'), X)
+    np.save(os.path.join(processed_dir, 'y.npy'), y)
+    np.save(os.path.join(processed_dir, 'ragas.npy'), ragas)
+    processor.save_vocab(os.path.join(processed_dir, 'vocab.pkl'))
+    cases.append(stage('save', corpus_size, 1, time.perf_counter() - start, len(X), 'windows'))
+
+    start = time.perf_counter()
+    dataset = RagaDataset(work_dir, split='train')
+    cases.append(stage('load', corpus_size, 1, time.perf_counter() - start, len(dataset), 'windows'))
+
+    # What train.py's grammar check does: index the training n-grams once, then
+    # score every window's next note each epoch (the targets stand in for predictions)
+    start = time.perf_counter()
+    grammar_check = GrammarCheck.build(processor, dataset)
+    cases.append(stage('grammar_index', corpus_size, 1, time.perf_counter() - start, len(dataset), 'windows'))
+    start = time.perf_counter()
+    for offset in range(0, len(dataset), args.batch_size):
+        end = offset + args.batch_size
+        grammar_check(dataset.X[offset:end], dataset.y[offset:end], dataset.ragas[offset:end])
+    cases.append(stage('grammar', corpus_size, 1, time.perf_counter() - start, len(dataset), 'windows'))
+
+    # Augmenting every training window once, in loader-sized batches
+    augmenter = TokenAugmenter.build(processor.int_to_note, processor.raga_to_int, RagaIndex.from_sources())
+    rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+    for offset in range(0, len(dataset), args.batch_size):
+        end = offset + args.batch_size
+        augmenter(dataset.X[offset:end], dataset.y[offset:end], dataset.ragas[offset:end], rng)
+    cases.append(stage('augment', corpus_size, 1, time.perf_counter() - start, len(dataset), 'windows'))
+
+    for workers in args.loader_workers:
+        seconds = train_steps(dataset, len(processor.note_to_int), workers, args.batch_size, args.train_steps)
+        cases.append(stage('train', corpus_size, workers, seconds, args.train_steps, 'steps'))
+        seconds = train_steps(dataset, len(processor.note_to_int), workers, args.batch_size, args.train_steps,
+                              collate_fn=augmenter.collate)
+        cases.append(stage('train_augmented', corpus_size, workers, seconds, args.train_steps, 'steps'))
+
+    reference_dir = os.path.join(work_dir, 'reference')
+    os.makedirs(reference_dir, exist_ok=True)
+    start = time.perf_counter()
+    DataProcessor(sequence_length=args.sequence_length).process_dataset(corpus_dir, reference_dir)
+    cases.append(stage('process_dataset', corpus_size, 1, time.perf_counter() - start, len(paths), 'files'))
+    return cases
+
+
+def parse_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=parse_list, default=[50], help='Comma-separated corpus sizes (files)')
+    parser.add_argument('--notes-per-file', type=int, default=300)
+    parser.add_argument('--sequence-length', type=int, default=100)
+    parser.add_argument('--workers', type=parse_list, default=[1, 2], help='Process counts for parsing')
+    parser.add_argument('--loader-workers', type=parse_list, default=[0, 2], help='DataLoader worker counts')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--train-steps', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', help='Build the corpora under this directory and keep them')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON to gate against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Allowed relative throughput drop before failing (default 15%%)')
+    args = parser.parse_args()
+    if args.notes_per_file <= args.sequence_length:
+        parser.error('--notes-per-file must be larger than --sequence-length to produce any windows')
+    if min(args.sizes) < 1:
+        parser.error('--sizes must all be at least 1')
+
+    torch.manual_seed(args.seed)
+    results = {
+        'config': vars(args),
+        'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'cases': [],
+    }
+    for corpus_size in args.sizes:
+        work_dir = os.path.join(args.keep, f'corpus_{corpus_size}') if args.keep else tempfile.mkdtemp()
+        try:
+            cases = run_corpus(corpus_size, args, work_dir)
+        finally:
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        results['cases'].extend(cases)
+
+        # Share of the pipeline time, taking each stage at its best worker count
+        best = {}
+        for case in cases:
+            if case['stage'] != 'process_dataset':
+                best[case['stage']] = min(best.get(case['stage'], np.inf), case['seconds'])
+        total = sum(best.values())
+        print(f"\nCorpus of {corpus_size} files")
+        for case in cases:
+            share = f"{case['seconds'] / total:6.1%}" if case['stage'] in best else '   ref'
+            print(f"  {case['stage']:16s} w={case['workers']:<3d} {case['seconds']:8.3f} s  {share}  "
+                  f"{case['items_per_sec']:10.1f} {case['unit']}/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results['cases'], baseline['cases'], case_key, GATED_METRICS, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stages slowed down by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Throughput and parity of bf16 autocast against fp32 for training and generation.
+
+Trains a DeepRagaModel briefly on synthetic scale walks in each precision
+and times the optimizer steps, times batched generation per batch size, and
+then compares the two precisions on held-out windows of the trained model:
+validation loss, next-note KL divergence, total variation and top-1
+agreement. bf16 is measured even on CPUs that only emulate it, which shows
+why 'auto' leaves them on fp32.
+
+    python -m benchmarks.bench_precision --output precision.json
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import torch
+import torch.nn as nn
+from model.generation import MODEL_CONFIG, build_model, generate_batch
+from model.precision import autocast, bf16_supported, compare_precisions, resolve_precision
+
+
+def synthetic_windows(num_windows, window, vocab_size, num_ragas, rng):
+    """Batches of random walks with raga-dependent step sizes, so the model has something to learn"""
+    ragas = rng.integers(1, num_ragas, size=num_windows)
+    steps = rng.integers(-2, 3, size=(num_windows, window + 1)) + (ragas % 3)[:, None] - 1
+    notes = (rng.integers(0, vocab_size, size=(num_windows, 1)) + np.cumsum(steps, axis=1)) % vocab_size
+    return torch.as_tensor(notes[:, :-1]), torch.as_tensor(notes[:, -1]), torch.as_tensor(ragas)
+
+
+def batches(data, batch_size):
+    sequences, targets, ragas = data
+    return [{'sequence': sequences[i:i + batch_size], 'target': targets[i:i + batch_size],
+             'raga': ragas[i:i + batch_size]} for i in range(0, len(targets), batch_size)]
+
+
+def train(model, train_batches, precision, num_steps):
+    """Samples per second over `num_steps` optimizer steps (after two warm-up steps)"""
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters())
+    model.train()
+    samples = 0
+    for step in range(num_steps + 2):
+        if step == 2:
+            start = time.perf_counter()
+            samples = 0
+        batch = train_batches[step % len(train_batches)]
+        optimizer.zero_grad()
+        with autocast(precision):
+            outputs, _ = model(batch['sequence'], raga=batch['raga'])
+        loss = criterion(outputs.float(), batch['target'])
+        loss.backward()
+        optimizer.step()
+        samples += len(batch['target'])
+    model.eval()
+    return samples / (time.perf_counter() - start)
+
+
+def generation_tokens_per_sec(model, batch_size, num_notes, precision):
+    generate_batch(model, torch.zeros(batch_size, dtype=torch.long), 2, precision=precision)
+    start = time.perf_counter()
+    generate_batch(model, torch.randint(model.fc2.out_features, (batch_size,)), num_notes, precision=precision)
+    return batch_size * num_notes / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--train-steps', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=32, help='Training batch size')
+    parser.add_argument('--window', type=int, default=100, help='Notes per training window')
+    parser.add_argument('--generation-batches', default='1,16,64', help='Comma-separated generation batch sizes')
+    parser.add_argument('--notes', type=int, default=64, help='Notes generated per sequence')
+    parser.add_argument('--vocab-size', type=int, default=128)
+    parser.add_argument('--num-ragas', type=int, default=80)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    train_batches = batches(synthetic_windows(args.batch_size * 16, args.window, args.vocab_size,
+                                              args.num_ragas, rng), args.batch_size)
+    val_batches = batches(synthetic_windows(512, args.window, args.vocab_size, args.num_ragas, rng), 64)
+    results = {'config': {**vars(args), 'model': MODEL_CONFIG, 'torch_threads': torch.get_num_threads()},
+               'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                               'machine': platform.machine(), 'cpus': os.cpu_count(),
+                               'native_bf16': bf16_supported(native=True), 'auto': resolve_precision('auto')},
+               'cases': []}
+    print(f"Native bf16: {results['environment']['native_bf16']}; auto resolves to {results['environment']['auto']}")
+    if not bf16_supported(native=False):
+        print("bf16 kernels are not available on this CPU")
+        return
+
+    models = {}
+    for precision in ('fp32', 'bf16'):
+        torch.manual_seed(args.seed)
+        model = build_model(args.vocab_size, num_ragas=args.num_ragas)
+        case = {'precision': precision,
+                'train_samples_per_sec': train(model, train_batches, precision, args.train_steps)}
+        for batch_size in (int(b) for b in args.generation_batches.split(',')):
+            case[f'generate_b{batch_size}_tokens_per_sec'] = generation_tokens_per_sec(
+                model, batch_size, args.notes, precision)
+        models[precision] = model
+        results['cases'].append(case)
+        print(f"{precision}: train {case['train_samples_per_sec']:8.0f} samples/s  " + '  '.join(
+            f"{key[len('generate_'):-len('_tokens_per_sec')]} {value:7.0f} tok/s"
+            for key, value in case.items() if key.startswith('generate_')))
+    fp32, bf16 = results['cases']
+    speedups = {key: bf16[key] / fp32[key] for key in fp32 if key != 'precision'}
+    print('bf16 speed-up: ' + ', '.join(f"{key.replace('_per_sec', '')} {value:.2f}x"
+                                         for key, value in speedups.items()))
+
+    # Parity of the fp32-trained weights evaluated both ways
+    parity = compare_precisions(models['fp32'], val_batches)
+    results['speedup'] = speedups
+    results['parity'] = parity
+    print(f"Parity: val loss fp32 {parity['fp32_loss']:.4f}, bf16 {parity['bf16_loss']:.4f}; "
+          f"next-note KL {parity['kl']:.5f}, TV {parity['tv']:.4f}, top-1 agreement {parity['top1_agreement']:.2%}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Per-token cost of sliding-window generation, rerun windows vs incremental steppers.
+
+For each window length, times generating notes the naive way (run the model
+over the whole window, then shift it with a concatenation, as
+test/test_kanada_generation.py used to) against model.incremental's ring
+buffer steppers, whose one-off cost of priming with the window is reported
+separately. A randomly initialised DeepRagaModel is always measured;
+the Keras BasicRaagaModel only when TensorFlow is installed.
+
+    python -m benchmarks.bench_sliding_window --windows 16,64,256,1024 --output window.json
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import torch
+from model.generation import MODEL_CONFIG, build_model
+from model.incremental import DeepRagaStepper, KerasLSTMStepper
+
+
+def rerun_deepraga(model, prompt, num_tokens):
+    """Greedy generation rerunning DeepRagaModel over the full window for every note"""
+    window = torch.as_tensor(prompt, dtype=torch.long).view(1, -1)
+    with torch.no_grad():
+        for _ in range(num_tokens):
+            output, _ = model(window)
+            window = torch.cat([window[:, 1:], output.argmax(dim=1, keepdim=True)], dim=1)
+
+
+def rerun_keras(model, prompt, num_tokens):
+    """Generation rerunning BasicRaagaModel over the full window of frames for every frame"""
+    window = np.asarray(prompt, dtype=np.float32)[None]
+    for _ in range(num_tokens):
+        output = model.model(window, training=False).numpy()
+        window = np.concatenate([window[:, 1:], output[:, -1:]], axis=1)
+
+
+def ms_per_token(fn, num_tokens, repeats):
+    """Best of `repeats` runs, in milliseconds per generated token"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best / num_tokens * 1000
+
+
+def incremental_timings(stepper, prompt, num_tokens, repeats, choose):
+    """Best priming time and per-token step time of a stepper, in milliseconds"""
+    prime = step = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = stepper.prime(prompt)
+        primed = time.perf_counter()
+        for _ in range(num_tokens):
+            output = stepper.step(choose(output))
+        prime, step = min(prime, primed - start), min(step, time.perf_counter() - primed)
+    return {'prime_ms': prime * 1000, 'incremental_ms_per_token': step / num_tokens * 1000}
+
+
+def deepraga_cases(windows, num_tokens, repeats, vocab_size):
+    model = build_model(vocab_size)
+    greedy = lambda logits: int(logits.argmax())
+    cases = []
+    for window in windows:
+        prompt = torch.randint(vocab_size, (window,)).tolist()
+        stepper = DeepRagaStepper(model, window)
+        cases.append({
+            'model': 'deepraga', 'window': window,
+            'rerun_ms_per_token': ms_per_token(lambda: rerun_deepraga(model, prompt, num_tokens),
+                                               num_tokens, repeats),
+            **incremental_timings(stepper, prompt, num_tokens, repeats, greedy),
+        })
+    return cases
+
+
+def keras_cases(windows, num_tokens, repeats):
+    from model.basic_model import BasicRaagaModel
+    config = {'num_layers': 2, 'units_per_layer': 256, 'dropout_rate': 0.2, 'input_dim': 128, 'output_dim': 128}
+    model = BasicRaagaModel(config)
+    model.build()
+    cases = []
+    for window in windows:
+        prompt = np.random.rand(window, config['input_dim']).astype(np.float32)
+        stepper = KerasLSTMStepper(model, window)
+        cases.append({
+            'model': 'keras_basic', 'window': window,
+            'rerun_ms_per_token': ms_per_token(lambda: rerun_keras(model, prompt, num_tokens),
+                                               num_tokens, repeats),
+            **incremental_timings(stepper, prompt, num_tokens, repeats, lambda frame: frame),
+        })
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--windows', default='16,64,256,1024', help='Comma-separated window lengths')
+    parser.add_argument('--tokens', type=int, default=64, help='Notes generated per run')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--vocab-size', type=int, default=128)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    windows = [int(w) for w in args.windows.split(',')]
+    cases = deepraga_cases(windows, args.tokens, args.repeats, args.vocab_size)
+    try:
+        cases.extend(keras_cases(windows, args.tokens, args.repeats))
+    except ImportError:
+        print("TensorFlow is not installed; skipping BasicRaagaModel")
+
+    for case in cases:
+        print(f"{case['model']:12s} window {case['window']:5d}  rerun {case['rerun_ms_per_token']:8.2f} ms/token  "
+              f"incremental {case['incremental_ms_per_token']:6.2f} ms/token "
+              f"({case['rerun_ms_per_token'] / case['incremental_ms_per_token']:4.1f}x)  "
+              f"prime {case['prime_ms']:7.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': {**vars(args), 'model': MODEL_CONFIG, 'torch_threads': torch.get_num_threads()},
+                       'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                                       'machine': platform.machine(), 'cpus': os.cpu_count()},
+                       'cases': cases}, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
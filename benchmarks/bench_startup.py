@@ -0,0 +1,107 @@
+"""Cold-start profile of the API server.
+
+Reports the import time of app.py broken down by top-level package (from
+python -X importtime), then starts the server in a fresh process and times
+how long it takes to accept a request and to report ready on /ready.
+
+    python -m benchmarks.bench_startup --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+SERVE_SCRIPT = """
+import sys
+from werkzeug.serving import make_server
+import app
+server = make_server('127.0.0.1', int(sys.argv[1]), app.app, threaded=True)
+server.serve_forever()
+"""
+
+
+def import_profile(module='app'):
+    """Self and cumulative import microseconds per module, as reported by -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def top_packages(modules):
+    """Self import time summed per top-level package, in seconds"""
+    totals = defaultdict(float)
+    for name, (self_us, _) in modules.items():
+        totals[name.split('.')[0]] += self_us / 1e6
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_to_serve(timeout=120):
+    """Seconds from process start until GET / answers and until /ready returns 200"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', SERVE_SCRIPT, str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_response = ready = None
+    try:
+        while time.perf_counter() - start < timeout and ready is None:
+            try:
+                if first_response is None:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+                    first_response = time.perf_counter() - start
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=1) as response:
+                    state = json.load(response)
+                ready = time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait()
+    return first_response, ready, state if ready is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=10, help='Packages to list')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    modules = import_profile()
+    packages = top_packages(modules)
+    import_seconds = modules['app'][1] / 1e6 if 'app' in modules else None
+    print(f"import app: {import_seconds:.2f} s")
+    for name, seconds in list(packages.items())[:args.top]:
+        print(f"  {name:24s} {seconds:6.2f} s")
+    heavy = [name for name in ('music21', 'librosa', 'tensorflow', 'scipy', 'sklearn') if name in packages]
+    print(f"Heavy optional packages imported: {', '.join(heavy) or 'none'}")
+
+    first_response, ready, state = time_to_serve()
+    print(f"First response after {first_response:.2f} s; ready after {ready:.2f} s ({state})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'import_seconds': import_seconds, 'packages': packages, 'heavy_imports': heavy,
+                       'first_response_seconds': first_response, 'ready_seconds': ready,
+                       'ready_state': state}, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Comparison of benchmark results against a stored baseline."""
+import math
+
+
+def compare(cases, baseline_cases, key, gated_metrics, threshold):
+    """Print metric changes per case and return the ones that regressed.
+
+    Args:
+        cases, baseline_cases: Lists of result dictionaries
+        key: Function giving the name that matches a case to its baseline
+        gated_metrics: {metric: 'lower' or 'higher'}, which direction is better
+        threshold: Allowed relative change in the worse direction
+
+    Any move away from a zero baseline counts as an infinite relative change,
+    and metrics that are None on either side (nothing measured) are skipped.
+
+    Returns:
+        List of (case name, metric, relative change) for every regression.
+    """
+    previous = {key(c): c for c in baseline_cases}
+    regressions = []
+    for case in cases:
+        old = previous.get(key(case))
+        if old is None:
+            continue
+        for metric, better in gated_metrics.items():
+            if case.get(metric) is None or old.get(metric) is None:
+                continue
+            if old[metric]:
+                change = (case[metric] - old[metric]) / abs(old[metric])
+            else:
+                change = math.copysign(math.inf, case[metric]) if case[metric] else 0.0
+            worse = change > threshold if better == 'lower' else change < -threshold
+            flag = '  REGRESSION' if worse else ''
+            print(f"{key(case):32s} {metric:16s} {old[metric]:10.2f} -> {case[metric]:10.2f} "
+                  f"({change:+.1%}){flag}")
+            if worse:
+                regressions.append((key(case), metric, change))
+    return regressions
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from data.melakarta_init import MELAKARTA_INDEX
+
+CATALOG_FILENAME = 'catalog.json'
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+# One catalog for every scanned root under data/, keyed by the root's path
+# relative to data/; roots elsewhere keep their own catalog.json
+CATALOG_PATH = os.path.join(DATA_DIR, 'processed', CATALOG_FILENAME)
+# Pipeline outputs and dataset metadata, never annotations
+GENERATED_FILES = {CATALOG_FILENAME, 'duplicates.json', 'index.json', 'manifest.json',
+                   'split_manifest.json', 'pitch_index.json', 'raga-swaras.json'}
+CATALOG_VERSION = 2
+
+FORMATS = {
+    '.mid': 'midi', '.midi': 'midi',
+    '.xml': 'musicxml', '.mxl': 'musicxml', '.musicxml': 'musicxml',
+    '.mp3': 'audio', '.wav': 'audio', '.flac': 'audio', '.ogg': 'audio',
+    '.csv': 'annotation', '.txt': 'annotation', '.json': 'annotation',
+}
+
+# Folder or file names such as "15_Mayamalavagowla" carry the Melakarta number
+_NUMBERED = re.compile(r'^(\d{1,2})_')
+_RAGA_IDS = {name.lower(): number for number, name in MELAKARTA_INDEX.items()}
+
+
+def _raga_of(relpath):
+    """Infer (raga_id, raga_name) from the path: numbered folders first, then the file name"""
+    parts = relpath.replace('\\', '/').split('/')
+    for part in reversed(parts):
+        match = _NUMBERED.match(part)
+        if match and 1 <= int(match.group(1)) <= 72:
+            number = int(match.group(1))
+            return number, MELAKARTA_INDEX[number]
+    stem = os.path.splitext(parts[-1])[0].lower()
+    # e.g. "kalyani_basic.mid" or "raga-kapi-arohanam_avarohanam.mp3"
+    tokens = [t for t in re.split(r'[-_ ]+', stem) if t and t != 'raga']
+    name = tokens[0] if tokens else stem
+    return _RAGA_IDS.get(name), name.capitalize()
+
+
+def _in_data_dir(root):
+    return os.path.commonpath([os.path.abspath(root), DATA_DIR]) == DATA_DIR
+
+
+def generated_path(root, filename):
+    """Where pipeline output about `root` goes: data/processed/ for roots under data/, else the root"""
+    return os.path.join(DATA_DIR, 'processed', filename) if _in_data_dir(root) else os.path.join(root, filename)
+
+
+def root_key(root):
+    """Key of `root` in the shared files of generated_path: relative to data/, else absolute"""
+    if not _in_data_dir(root):
+        return os.path.abspath(root).replace(os.sep, '/')
+    return os.path.relpath(os.path.abspath(root), DATA_DIR).replace(os.sep, '/')
+
+
+def _read_catalog(catalog_path):
+    if os.path.exists(catalog_path):
+        with open(catalog_path, 'r') as f:
+            data = json.load(f)
+        if data.get('version') == CATALOG_VERSION:
+            return data
+    return {'version': CATALOG_VERSION, 'roots': {}}
+
+
+def _content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _probe(job):
+    """Hash a file and read its note count and duration (runs in a worker)"""
+    path, fmt = job
+    entry = {'sha1': _content_hash(path), 'note_count': None, 'duration': None}
+    try:
+        if fmt == 'midi':
+            import pretty_midi
+            midi_data = pretty_midi.PrettyMIDI(path)
+            entry['note_count'] = sum(len(i.notes) for i in midi_data.instruments if not i.is_drum)
+            entry['duration'] = float(midi_data.get_end_time())
+        elif fmt == 'musicxml':
+            from music21 import converter
+            score = converter.parse(path)
+            entry['note_count'] = len(score.flatten().notes)
+            entry['duration'] = float(score.seconds) if score.seconds else None
+        elif fmt == 'audio':
+            import soundfile as sf
+            entry['duration'] = float(sf.info(path).duration)
+    except Exception as e:
+        entry['error'] = str(e)
+    return entry
+
+
+class Catalog:
+    """Index of every dataset file under a root directory.
+
+    `build` walks the tree once and only re-probes files whose size or mtime
+    changed since the stored catalog. Each entry records the raga, format,
+    size, content hash, note count and duration, and `query` answers loader
+    requests from the index instead of the filesystem. All roots under data/
+    share the single catalog file data/processed/catalog.json; roots outside
+    the repository's data/ (e.g. temporary corpora) keep a catalog.json of
+    their own.
+    """
+
+    def __init__(self, root, entries, catalog_path=None):
+        self.root = root
+        self.entries = entries
+        self.catalog_path = catalog_path or generated_path(root, CATALOG_FILENAME)
+
+    @classmethod
+    def load(cls, root, catalog_path=None):
+        catalog_path = catalog_path or generated_path(root, CATALOG_FILENAME)
+        data = _read_catalog(catalog_path)
+        return cls(root, data['roots'].get(root_key(root), {}), catalog_path)
+
+    def save(self):
+        """Store this root's entries, dropping roots that no longer exist"""
+        data = _read_catalog(self.catalog_path)
+        data['roots'][root_key(self.root)] = self.entries
+        data['roots'] = {key: files for key, files in data['roots'].items()
+                         if os.path.isdir(os.path.join(DATA_DIR, key))}
+        os.makedirs(os.path.dirname(self.catalog_path), exist_ok=True)
+        tmp_path = f'{self.catalog_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.catalog_path)
+
+    @classmethod
+    def build(cls, root, num_workers=None, save=True, catalog_path=None, mp_context=None):
+        """Load the stored catalog for `root` and bring it up to date with the tree.
+
+        `mp_context` is passed to the probing ProcessPoolExecutor, e.g. a spawn
+        context for callers that must not fork.
+        """
+        catalog = cls.load(root, catalog_path)
+        previous = catalog.entries
+        entries = {}
+        stale = []
+        for dirpath, dirnames, files in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for file in files:
+                fmt = FORMATS.get(os.path.splitext(file)[1].lower())
+                if fmt is None or file in GENERATED_FILES:
+                    continue
+                path = os.path.join(dirpath, file)
+                relpath = os.path.relpath(path, root).replace(os.sep, '/')
+                stat = os.stat(path)
+                old = previous.get(relpath)
+                if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+                    entries[relpath] = old
+                    continue
+                raga_id, raga_name = _raga_of(relpath)
+                entries[relpath] = {'format': fmt, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                                    'raga_id': raga_id, 'raga_name': raga_name}
+                stale.append(relpath)
+
+        if stale:
+            jobs = [(os.path.join(root, relpath), entries[relpath]['format']) for relpath in stale]
+            if len(jobs) > 1 and num_workers != 1:
+                with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context) as executor:
+                    probes = list(executor.map(_probe, jobs, chunksize=8))
+            else:
+                probes = [_probe(job) for job in jobs]
+            for relpath, probe in zip(stale, probes):
+                entries[relpath].update(probe)
+
+        changed = bool(stale) or len(entries) != len(previous)
+        catalog.entries = entries
+        if save and changed:
+            catalog.save()
+        print(f"Catalog of {root}: {len(entries)} files, {len(stale)} (re)indexed")
+        return catalog
+
+    def query(self, raga_id=None, raga_name=None, fmt=None, min_duration=None, max_duration=None,
+              min_notes=None, max_notes=None, unique=False):
+        """Return (relpath, entry) pairs matching every given filter, sorted by path.
+
+        `fmt` may be a single format or a tuple of formats. With `unique`, only
+        the first file of each content hash is returned.
+        """
+        formats = (fmt,) if isinstance(fmt, str) else fmt
+        results = []
+        seen = set()
+        for relpath in sorted(self.entries):
+            entry = self.entries[relpath]
+            if formats and entry['format'] not in formats:
+                continue
+            if raga_id is not None and entry['raga_id'] != raga_id:
+                continue
+            if raga_name is not None and entry['raga_name'].lower() != raga_name.lower():
+                continue
+            duration = entry.get('duration')
+            if min_duration is not None and (duration is None or duration < min_duration):
+                continue
+            if max_duration is not None and (duration is None or duration > max_duration):
+                continue
+            notes = entry.get('note_count')
+            if min_notes is not None and (notes is None or notes < min_notes):
+                continue
+            if max_notes is not None and (notes is None or notes > max_notes):
+                continue
+            if unique:
+                if entry['sha1'] in seen:
+                    continue
+                seen.add(entry['sha1'])
+            results.append((relpath, entry))
+        return results
+
+    def paths(self, **filters):
+        """Absolute paths of the files matching `query(**filters)`"""
+        return [os.path.join(self.root, relpath) for relpath, _ in self.query(**filters)]
+
+
+if __name__ == '__main__':
+    for root in (os.path.join(DATA_DIR, 'DeepRaaga-Dataset'), os.path.join(DATA_DIR, 'raw')):
+        if os.path.isdir(root):
+            Catalog.build(root)
@@ -1,99 +1,169 @@
 import os
+import json
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import tensorflow as tf
 from magenta.music import midi_io
 from magenta.music import musicxml_reader
-from magenta.music import note_sequence_io
 from magenta.music import sequences_lib
+from .catalog import Catalog
 
-def convert_files_to_note_sequences(input_dir, output_dir):
-    """Convert MIDI and MusicXML files to NoteSequence protos.
+MIDI_EXTENSIONS = (".mid", ".midi")
+MUSICXML_EXTENSIONS = (".xml", ".mxl")
+INDEX_FILENAME = "index.json"
 
-    Args:
-        input_dir: Directory containing input files (.mid, .midi, .xml, .mxl)
-        output_dir: Output directory for NoteSequence files
-    """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
 
-    for root, _, files in os.walk(input_dir):
-        for file in files:
-            input_path = os.path.join(root, file)
-            filename, ext = os.path.splitext(file)
-            output_path = os.path.join(output_dir, f"{filename}.tfrecord")
+def collect_input_files(input_dirs):
+    """Return (path, size, content hash) for the MIDI and MusicXML files catalogued under the input directories."""
+    files = []
+    for input_dir in input_dirs:
+        if not os.path.isdir(input_dir):
+            continue
+        # Spawned like the shard writers: this module has already imported TensorFlow
+        catalog = Catalog.build(input_dir, mp_context=multiprocessing.get_context("spawn"))
+        for relpath, entry in catalog.query(fmt=("midi", "musicxml")):
+            files.append((os.path.join(input_dir, relpath), entry["size"], entry["sha1"]))
+    return files
+
 
-            # Skip if output already exists
-            if os.path.exists(output_path):
-                print(f"Skipping {file} - output already exists")
-                continue
+def assign_shards(files, num_shards):
+    """Distribute (path, size) pairs over shards so their total sizes stay balanced.
 
+    Uses the longest-processing-time heuristic: the largest remaining file is
+    always placed on the currently lightest shard.
+    """
+    num_shards = max(1, min(num_shards, len(files)))
+    heap = [(0, shard_id) for shard_id in range(num_shards)]
+    shards = [[] for _ in range(num_shards)]
+    for path, size in sorted(files, key=lambda item: item[1], reverse=True):
+        total, shard_id = heapq.heappop(heap)
+        shards[shard_id].append(path)
+        heapq.heappush(heap, (total + size, shard_id))
+    return shards
+
+
+def read_note_sequence(input_path):
+    """Parse a MIDI or MusicXML file into a NoteSequence with sustain applied."""
+    ext = os.path.splitext(input_path)[1].lower()
+    if ext in MIDI_EXTENSIONS:
+        sequence = midi_io.midi_file_to_note_sequence(input_path)
+    else:
+        sequence = musicxml_reader.musicxml_file_to_sequence_proto(input_path)
+    if sequence.notes:
+        sequence = sequences_lib.apply_sustain_control_changes(sequence)
+    return sequence
+
+
+def _write_shard(job):
+    """Convert every file of one shard and write the records (runs in a worker)."""
+    shard_path, inputs, compression = job
+    options = tf.io.TFRecordOptions(compression_type=compression or "")
+    num_records = 0
+    content_hashes = []
+    with tf.io.TFRecordWriter(shard_path, options=options) as writer:
+        for input_path, content_hash in inputs:
             try:
-                # Convert MIDI files
-                if ext.lower() in [".mid", ".midi"]:
-                    sequence = midi_io.midi_file_to_note_sequence(input_path)
-                # Convert MusicXML files
-                elif ext.lower() in [".xml", ".mxl"]:
-                    sequence = musicxml_reader.musicxml_file_to_sequence_proto(input_path)
-                else:
-                    print(f"Skipping {file} - unsupported format")
+                sequence = read_note_sequence(input_path)
+                if not sequence.notes:
+                    print(f"Skipping {input_path} - no notes found")
                     continue
-
-                # Validate and clean up the sequence
-                if sequence.notes:
-                    sequence = sequences_lib.apply_sustain_control_changes(sequence)
-                    note_sequence_io.write_sequence_to_file(sequence, output_path)
-                    print(f"Converted {file} to NoteSequence")
-                else:
-                    print(f"Skipping {file} - no notes found")
-
+                writer.write(sequence.SerializeToString())
+                num_records += 1
+                content_hashes.append(content_hash)
             except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
-
-def create_tfrecord_dataset(note_sequences_dir, output_path):
-    """Create TFRecord dataset from NoteSequence files.
+                print(f"Error processing {input_path}: {str(e)}")
+    return {
+        "path": os.path.basename(shard_path),
+        "num_records": num_records,
+        "content_hashes": content_hashes,
+    }
+
+
+def load_index(output_dir):
+    """Load the shard index written by a previous run, if any."""
+    index_path = os.path.join(output_dir, INDEX_FILENAME)
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            return json.load(f)
+    return {"generation": 0, "total_records": 0, "shards": []}
+
+
+def convert_to_sharded_tfrecords(input_dirs, output_dir, num_shards=8,
+                                 compression="GZIP", num_workers=None):
+    """Convert MIDI and MusicXML files straight into balanced TFRecord shards.
+
+    Inputs and their content hashes come from the dataset catalog; content
+    already present in the shard index (or duplicated within this run) is
+    skipped, so renamed or copied files are not converted twice. The
+    remaining files are spread over ``num_shards`` shards of similar total
+    input size and every shard is written by its own worker process. The
+    index records the record count and content hashes per shard.
 
     Args:
-        note_sequences_dir: Directory containing NoteSequence files
-        output_path: Path for output TFRecord file
+        input_dirs: Directories containing input files (.mid, .midi, .xml, .mxl)
+        output_dir: Output directory for the shards and index file
+        num_shards: Number of shards to write for this run
+        compression: TFRecord compression type ("GZIP", "ZLIB" or None)
+        num_workers: Worker processes (defaults to the CPU count)
+
+    Returns:
+        The updated index dictionary.
     """
-    writer = tf.io.TFRecordWriter(output_path)
-
-    for root, _, files in os.walk(note_sequences_dir):
-        for file in files:
-            if not file.endswith(".tfrecord"):
-                continue
-
-            input_path = os.path.join(root, file)
-            try:
-                sequence = note_sequence_io.read_sequence_from_file(input_path)
-                if sequence.notes:
-                    writer.write(sequence.SerializeToString())
-                    print(f"Added {file} to TFRecord dataset")
-            except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
+    os.makedirs(output_dir, exist_ok=True)
+    index = load_index(output_dir)
+    known_hashes = {h for shard in index["shards"] for h in shard["content_hashes"]}
+
+    pending = []
+    hash_of = {}
+    for path, size, content_hash in collect_input_files(input_dirs):
+        if content_hash in known_hashes:
+            print(f"Skipping {os.path.basename(path)} - content already converted")
+            continue
+        known_hashes.add(content_hash)
+        hash_of[path] = content_hash
+        pending.append((path, size))
+
+    if not pending:
+        print("No new files to convert")
+        return index
+
+    generation = index["generation"] + 1
+    shard_files = assign_shards(pending, num_shards)
+    suffix = {"GZIP": ".tfrecord.gz", "ZLIB": ".tfrecord.zlib"}.get(compression, ".tfrecord")
+    jobs = []
+    for shard_id, paths in enumerate(shard_files):
+        name = f"notesequences-{generation:03d}-{shard_id:05d}-of-{len(shard_files):05d}{suffix}"
+        inputs = [(path, hash_of[path]) for path in paths]
+        jobs.append((os.path.join(output_dir, name), inputs, compression))
+
+    # Spawned workers avoid forking a process that has already initialised TensorFlow
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+        for shard in executor.map(_write_shard, jobs):
+            shard["compression"] = compression
+            index["shards"].append(shard)
+            print(f"Wrote {shard['num_records']} records to {shard['path']}")
+
+    index["generation"] = generation
+    index["total_records"] = sum(shard["num_records"] for shard in index["shards"])
+    with open(os.path.join(output_dir, INDEX_FILENAME), "w") as f:
+        json.dump(index, f, indent=2)
+    print(f"Index now lists {index['total_records']} records in {len(index['shards'])} shards")
+    return index
 
-    writer.close()
-    print(f"Created TFRecord dataset at {output_path}")
 
 def main():
     # Directory paths
     base_dir = os.path.dirname(os.path.abspath(__file__))
     midi_dir = os.path.join(base_dir, "raw", "midi")
     musicxml_dir = os.path.join(base_dir, "raw", "musicxml")
-    note_sequences_dir = os.path.join(base_dir, "processed", "note_sequences")
     tfrecord_dir = os.path.join(base_dir, "processed", "tfrecord")
 
-    # Convert MIDI files
-    print("\nProcessing MIDI files...")
-    convert_files_to_note_sequences(midi_dir, note_sequences_dir)
-
-    # Convert MusicXML files
-    print("\nProcessing MusicXML files...")
-    convert_files_to_note_sequences(musicxml_dir, note_sequences_dir)
+    # Convert MIDI and MusicXML files into sharded TFRecords in one pass
+    print("\nConverting MIDI and MusicXML files...")
+    convert_to_sharded_tfrecords([midi_dir, musicxml_dir], tfrecord_dir)
 
-    # Create TFRecord dataset
-    print("\nCreating TFRecord dataset...")
-    tfrecord_path = os.path.join(tfrecord_dir, "training_data.tfrecord")
-    create_tfrecord_dataset(note_sequences_dir, tfrecord_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
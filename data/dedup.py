@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+from collections import defaultdict
+import numpy as np
+from data.catalog import DATA_DIR, Catalog, generated_path, root_key
+
+NGRAM_SIZE = 4
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16              # 16 bands x 4 rows: pairs above ~0.6 Jaccard almost always collide
+NEAR_DUPLICATE_THRESHOLD = 0.9
+DUPLICATES_FILENAME = 'duplicates.json'
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _midi_pitches(path):
+    import pretty_midi
+    midi_data = pretty_midi.PrettyMIDI(path)
+    notes = [n for inst in midi_data.instruments if not inst.is_drum for n in inst.notes]
+    notes.sort(key=lambda n: (n.start, n.pitch))
+    return np.array([n.pitch for n in notes], dtype=np.uint64)
+
+
+def ngram_hashes(pitches, n=NGRAM_SIZE):
+    """Set of 64-bit hashes of the pitch n-grams of a sequence"""
+    pitches = np.asarray(pitches, dtype=np.uint64)
+    if len(pitches) < n:
+        return np.unique(pitches)
+    windows = np.lib.stride_tricks.sliding_window_view(pitches, n)
+    # Polynomial hash with wrap-around uint64 arithmetic
+    powers = np.uint64(1000003) ** np.arange(n, dtype=np.uint64)
+    return np.unique((windows * powers).sum(axis=1, dtype=np.uint64))
+
+
+class MinHasher:
+    """MinHash signatures with multiply-shift hash functions over uint64 values"""
+
+    def __init__(self, num_permutations=NUM_PERMUTATIONS, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 63, size=num_permutations, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_permutations, dtype=np.uint64)
+
+    def signature(self, values):
+        if len(values) == 0:
+            return np.full(len(self.a), _MASK64, dtype=np.uint64)
+        hashed = self.a[:, None] * np.asarray(values, dtype=np.uint64)[None, :] + self.b[:, None]
+        return hashed.min(axis=1)
+
+
+class LSHIndex:
+    """Banded locality-sensitive hashing over MinHash signatures.
+
+    Only items that share at least one band bucket are compared, so finding
+    near-duplicates scales with the number of collisions, not all pairs.
+    """
+
+    def __init__(self, bands=LSH_BANDS):
+        self.bands = bands
+        self.signatures = []
+        self._buckets = defaultdict(list)
+
+    def add(self, signature):
+        item = len(self.signatures)
+        self.signatures.append(signature)
+        for band, chunk in enumerate(np.array_split(signature, self.bands)):
+            self._buckets[(band, chunk.tobytes())].append(item)
+        return item
+
+    def candidate_pairs(self):
+        pairs = set()
+        for members in self._buckets.values():
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    pairs.add((members[i], members[j]))
+        return pairs
+
+    def similarity(self, i, j):
+        """Estimated Jaccard similarity: share of agreeing signature slots"""
+        return float(np.mean(self.signatures[i] == self.signatures[j]))
+
+
+def _clusters(num_items, pairs):
+    parent = list(range(num_items))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    groups = defaultdict(list)
+    for item in range(num_items):
+        groups[find(item)].append(item)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def _read_reports(path):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {'roots': {}}
+
+
+def find_near_duplicates(root, threshold=NEAR_DUPLICATE_THRESHOLD, n=NGRAM_SIZE, catalog=None, save=True):
+    """Group MIDI files under `root` whose note n-gram sets are near-identical.
+
+    Files with identical content (same catalog hash) are always grouped. The
+    first file of each cluster (by path) is kept and the rest are listed as
+    duplicates. Reports are saved to duplicates.json next to the catalog
+    (data/processed/ for roots under data/), and a saved report is returned
+    as is while the root's MIDI files and the settings are unchanged, so the
+    MinHash pass runs once however many pipeline stages ask for it.
+
+    Returns:
+        {'threshold', 'clusters': [[relpath, ...]], 'duplicates': [relpath, ...]}
+    """
+    catalog = catalog or Catalog.build(root)
+    entries = [(relpath, entry) for relpath, entry in catalog.query(fmt='midi')
+               if entry.get('note_count')]
+    # Fingerprint of the inputs: every file's path and content hash, plus the settings
+    inputs = hashlib.sha1(json.dumps([threshold, n, [(relpath, entry['sha1']) for relpath, entry in entries]])
+                          .encode()).hexdigest()
+    report_path = generated_path(root, DUPLICATES_FILENAME)
+    reports = _read_reports(report_path)
+    saved = reports['roots'].get(root_key(root))
+    if saved is not None and saved.get('inputs') == inputs:
+        return saved
+
+    hasher = MinHasher()
+    index = LSHIndex()
+    pairs = set()
+    first_with_hash = {}
+    for item, (relpath, entry) in enumerate(entries):
+        if entry['sha1'] in first_with_hash:
+            pairs.add((first_with_hash[entry['sha1']], item))
+        else:
+            first_with_hash[entry['sha1']] = item
+        try:
+            grams = ngram_hashes(_midi_pitches(os.path.join(root, relpath)), n)
+        except Exception as e:
+            print(f"Error reading {relpath}: {str(e)}")
+            grams = np.zeros(0, dtype=np.uint64)
+        index.add(hasher.signature(grams))
+
+    pairs |= {(i, j) for i, j in index.candidate_pairs() if index.similarity(i, j) >= threshold}
+    clusters = [[entries[i][0] for i in members] for members in _clusters(len(entries), pairs)]
+    report = {
+        'threshold': threshold,
+        'inputs': inputs,
+        'clusters': clusters,
+        'duplicates': sorted(relpath for cluster in clusters for relpath in cluster[1:]),
+    }
+    if save:
+        reports['roots'][root_key(root)] = report
+        reports['roots'] = {key: r for key, r in reports['roots'].items()
+                            if os.path.isdir(os.path.join(DATA_DIR, key))}
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(reports, f, indent=2)
+    print(f"Found {len(report['duplicates'])} near-duplicate MIDI files in {len(clusters)} clusters")
+    return report
+
+
+def unique_window_mask(X, y=None):
+    """Boolean mask keeping the first occurrence of every distinct (window, target)"""
+    if len(X) == 0:
+        return np.zeros(0, dtype=bool)
+    rows = np.column_stack([X, y]) if y is not None else np.asarray(X)
+    rows = np.ascontiguousarray(rows)
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first = np.unique(keys, return_index=True)
+    mask = np.zeros(len(X), dtype=bool)
+    mask[first] = True
+    return mask
+
+
+if __name__ == '__main__':
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    find_near_duplicates(os.path.join(base_dir, 'raw', 'midi'))
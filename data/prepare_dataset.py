@@ -1,105 +1,43 @@
 import os
-import shutil
-import random
-from pathlib import Path
 import sys
 sys.path.append('..')
 from model.data_processor import DataProcessor
-import numpy as np
+from data.split_manifest import SPLITS, build_split_manifest, split_files
 
-def create_directory_structure():
-    """Create the necessary directory structure for training"""
-    dirs = ['train', 'val', 'test']
-    for dir_name in dirs:
-        for subdir in ['midi', 'audio']:
-            path = Path(f'data/{dir_name}/{subdir}')
-            path.mkdir(parents=True, exist_ok=True)
+RAW_DIR = 'data/raw'
+PROCESSED_DIR = 'data/processed'
+MANIFEST_PATH = os.path.join(PROCESSED_DIR, 'split_manifest.json')
+# Drop near-duplicate MIDI files and repeated (window, target) pairs (see data/dedup.py)
+DEDUP = True
 
-def split_dataset(raw_midi_dir: str, raw_audio_dir: str, split_ratio=(0.7, 0.15, 0.15)):
-    """Split the dataset into train, validation and test sets"""
-    # Get list of files
-    midi_files = [f for f in os.listdir(raw_midi_dir) if f.endswith('.mid')]
-    audio_files = [f for f in os.listdir(raw_audio_dir) if f.endswith(('.mp3', '.wav'))]
-    
-    # Shuffle files
-    random.shuffle(midi_files)
-    random.shuffle(audio_files)
-    
-    # Calculate split points
-    midi_train_idx = int(len(midi_files) * split_ratio[0])
-    midi_val_idx = midi_train_idx + int(len(midi_files) * split_ratio[1])
-    
-    audio_train_idx = int(len(audio_files) * split_ratio[0])
-    audio_val_idx = audio_train_idx + int(len(audio_files) * split_ratio[1])
-    
-    # Split the files
-    splits = {
-        'train': {
-            'midi': midi_files[:midi_train_idx],
-            'audio': audio_files[:audio_train_idx]
-        },
-        'val': {
-            'midi': midi_files[midi_train_idx:midi_val_idx],
-            'audio': audio_files[audio_train_idx:audio_val_idx]
-        },
-        'test': {
-            'midi': midi_files[midi_val_idx:],
-            'audio': audio_files[audio_val_idx:]
-        }
-    }
-    
-    return splits
-
-def copy_files(splits: dict, raw_midi_dir: str, raw_audio_dir: str):
-    """Copy files to their respective directories"""
-    for split_type, split_files in splits.items():
-        # Copy MIDI files
-        for midi_file in split_files['midi']:
-            src = os.path.join(raw_midi_dir, midi_file)
-            dst = os.path.join(f'data/{split_type}/midi', midi_file)
-            shutil.copy2(src, dst)
-        
-        # Copy audio files
-        for audio_file in split_files['audio']:
-            src = os.path.join(raw_audio_dir, audio_file)
-            dst = os.path.join(f'data/{split_type}/audio', audio_file)
-            shutil.copy2(src, dst)
+def create_split_manifest(raw_dir: str = RAW_DIR, split_ratio=(0.7, 0.15, 0.15)):
+    """Assign every raw file to train, validation or test by composition, stratified by raga"""
+    os.makedirs(PROCESSED_DIR, exist_ok=True)
+    return build_split_manifest(raw_dir, MANIFEST_PATH, ratios=split_ratio)
 
-def process_split(split_type: str, processor: DataProcessor):
-    """Process the data for a specific split"""
-    midi_dir = f'data/{split_type}/midi'
-    audio_dir = f'data/{split_type}/audio'
-    
-    midi_features, audio_features = processor.process_dataset(midi_dir, audio_dir)
-    
-    # Save processed features
-    output_dir = f'data/processed/{split_type}'
+def process_split(split_type: str, processor: DataProcessor, manifest: dict):
+    """Process the audio of a specific split, reading files in place via the manifest"""
+    output_dir = os.path.join(PROCESSED_DIR, split_type)
     os.makedirs(output_dir, exist_ok=True)
     
-    np.save(os.path.join(output_dir, 'midi_features.npy'), midi_features)
-    np.save(os.path.join(output_dir, 'audio_features.npy'), audio_features)
+    # Audio pitch contours go to pitch_f0.npy/pitch_index.json
+    audio_paths = [os.path.join(RAW_DIR, f) for f in split_files(manifest, split_type, 'audio')]
+    processor.extract_pitch_tracks(None, output_dir, audio_paths=audio_paths)
 
 def main():
-    # Set random seed for reproducibility
-    random.seed(42)
-    
-    # Create directory structure
-    create_directory_structure()
-    
-    # Split dataset
-    raw_midi_dir = 'data/raw/midi'
-    raw_audio_dir = 'data/raw/Ragas-mp3'
-    splits = split_dataset(raw_midi_dir, raw_audio_dir)
-    
-    # Copy files to their respective directories
-    copy_files(splits, raw_midi_dir, raw_audio_dir)
+    # Split dataset once; files stay where they are and are looked up by reference
+    manifest = create_split_manifest()
     
     # Initialize data processor
     processor = DataProcessor()
     
+    # MIDI windows for all splits share one vocabulary; RagaDataset selects
+    # each split's windows through sources.npy and the manifest
+    processor.process_dataset(RAW_DIR, PROCESSED_DIR, dedup=DEDUP)
+    
     # Process each split
-    for split_type in ['train', 'val', 'test']:
-        process_split(split_type, processor)
+    for split_type in SPLITS:
+        process_split(split_type, processor, manifest)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
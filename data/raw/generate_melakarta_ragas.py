@@ -1,7 +1,11 @@
 import pretty_midi
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from data.swara_codec import melakarta_scale, midi_to_note_names, to_midi
 
-def create_raga_sequence(notes, tempo=120):
+def create_raga_sequence(notes, tempo=120, mirror=True):
+    """Render note names as piano notes; with `mirror` the arohanam is followed by its avarohanam."""
     pm = pretty_midi.PrettyMIDI()
     instrument = pretty_midi.Instrument(program=0)  # Piano
     
@@ -15,29 +19,20 @@ def create_raga_sequence(notes, tempo=120):
         instrument.notes.append(note)
         current_time += note_duration
     
-    # Add a slight pause between ascending and descending
-    current_time += note_duration / 2
-    
-    # Descending (Avarohanam)
-    for note in reversed(notes):
-        note_number = pretty_midi.note_name_to_number(note)
-        note = pretty_midi.Note(velocity=100, pitch=note_number, start=current_time, end=current_time + note_duration)
-        instrument.notes.append(note)
-        current_time += note_duration
+    if mirror:
+        # Add a slight pause between ascending and descending
+        current_time += note_duration / 2
+        
+        # Descending (Avarohanam)
+        for note in reversed(notes):
+            note_number = pretty_midi.note_name_to_number(note)
+            note = pretty_midi.Note(velocity=100, pitch=note_number, start=current_time, end=current_time + note_duration)
+            instrument.notes.append(note)
+            current_time += note_duration
     
     pm.instruments.append(instrument)
     return pm
 
-# Define the basic notes for Carnatic music (Sa, Ri, Ga, Ma, Pa, Dha, Ni)
-base_notes = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
-
-# Define variations for each note (except Sa and Pa which are fixed)
-ri_variants = ['D', 'D#']
-ga_variants = ['E', 'F']
-ma_variants = ['F', 'F#']
-dha_variants = ['A', 'A#']
-ni_variants = ['B', 'C']
-
 # Define Melakarta raga names
 melakarta_names = {
     1: 'Kanakangi', 2: 'Ratnangi', 3: 'Ganamurthi', 4: 'Vanaspathi', 5: 'Manavathi', 6: 'Tanarupi',
@@ -54,37 +49,23 @@ melakarta_names = {
     67: 'Sucharitra', 68: 'Jyotiswarupini', 69: 'Dhatuvardani', 70: 'Nasikabhushani', 71: 'Kosalam', 72: 'Rasikapriya'
 }
 
-# Create output directory if it doesn't exist
-output_dir = os.path.join(os.path.dirname(__file__), 'midi', 'melakarta')
-os.makedirs(output_dir, exist_ok=True)
+def generate_melakarta_files(output_dir):
+    """Write arohanam/avarohanam MIDI files for all 72 Melakarta ragas."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Generate all 72 Melakarta ragas from their Ri/Ga, Ma and Dha/Ni combinations
+    for raga_number, raga_name in melakarta_names.items():
+        # Create the scale, Sa = C4
+        scale = midi_to_note_names(to_midi(melakarta_scale(raga_number)))
+        
+        # Create MIDI file
+        midi_data = create_raga_sequence(scale)
+        
+        # Save the MIDI file with raga number and name
+        filename = f'{raga_number:02d}_{raga_name}.mid'
+        midi_data.write(os.path.join(output_dir, filename))
 
-# Generate all 72 Melakarta ragas
-raga_number = 1
-for ri in ri_variants:
-    for ga in ga_variants:
-        for ma in ma_variants:
-            for dha in dha_variants:
-                for ni in ni_variants:
-                    # Create the scale
-                    scale = ['C4']  # Sa
-                    scale.append(f'{ri}4')  # Ri
-                    scale.append(f'{ga}4')  # Ga
-                    scale.append(f'{ma}4')  # Ma
-                    scale.append('G4')      # Pa
-                    scale.append(f'{dha}4') # Dha
-                    scale.append(f'{ni}4')  # Ni
-                    scale.append('C5')      # Sa
-                    
-                    # Create MIDI file
-                    midi_data = create_raga_sequence(scale)
-                    
-                    # Get the raga name and create filename
-                    raga_name = melakarta_names[raga_number]
-                    filename = f'{raga_number:02d}_{raga_name}.mid'
-                    
-                    # Save the MIDI file with raga number and name
-                    midi_data.write(os.path.join(output_dir, filename))
-                    
-                    raga_number += 1
+    print(f'Generated {len(melakarta_names)} Melakarta raga MIDI files in {output_dir}')
 
-print(f'Generated {raga_number-1} Melakarta raga MIDI files in {output_dir}')
\ No newline at end of file
+if __name__ == '__main__':
+    generate_melakarta_files(os.path.join(os.path.dirname(__file__), 'midi', 'melakarta'))
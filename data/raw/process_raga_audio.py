@@ -1,7 +1,9 @@
 import os
-import librosa
+import sys
 import pretty_midi
 import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from data.swara_codec import to_midi
 
 def parse_raga_pattern(text_file):
     """Parse arohanam and avarohanam patterns from text file."""
@@ -16,56 +18,111 @@ def parse_raga_pattern(text_file):
             patterns['avarohanam'] = line.split(':')[-1].strip().split()
     return patterns
 
-def convert_swaras_to_midi_notes(swaras):
-    """Convert Carnatic swaras to MIDI note numbers."""
-    # Basic swara to MIDI note mapping (starting from middle C)
-    swara_map = {
-        'S': 60,  # C
-        'R1': 61, 'R2': 62, 'R3': 63,  # C#/Db, D, D#/Eb
-        'G1': 63, 'G2': 64, 'G3': 65,  # D#/Eb, E, F
-        'M1': 65, 'M2': 66,  # F, F#/Gb
-        'P': 67,  # G
-        'D1': 68, 'D2': 69, 'D3': 70,  # G#/Ab, A, A#/Bb
-        'N1': 70, 'N2': 71, 'N3': 72,  # A#/Bb, B, C
+# Pitch-bend wheel range in semitones (General MIDI default of +/- 2)
+PITCH_BEND_RANGE = 2
+PITCH_BEND_SAMPLES_PER_SECOND = 20
+
+
+def semitones_to_pitch_bend(semitones):
+    """Convert semitone offsets to 14-bit pitch-bend values."""
+    bends = np.round(np.asarray(semitones) * 8192 / PITCH_BEND_RANGE)
+    return np.clip(bends, -8192, 8191).astype(np.int64)
+
+
+def kampita_contour(position, interval_from_previous, depth=1.0, cycles=2):
+    """Kampita: oscillation from the note up towards its upper neighbour.
+
+    `position` is the normalized time within each note (0..1), shaped
+    (num_notes, num_samples); the result is a semitone offset per sample.
+    The oscillation does not depend on the approach, so
+    `interval_from_previous` is unused; it is accepted only because every
+    contour in GAMAKA_CONTOURS is called with the same arguments.
+    """
+    return depth * 0.5 * (1 - np.cos(2 * np.pi * cycles * position))
+
+
+def jaru_contour(position, interval_from_previous, slide_fraction=0.3):
+    """Jaru: glide from the previous note's pitch into the current one."""
+    remaining = np.clip(1 - position / slide_fraction, 0, 1)
+    return -interval_from_previous[:, None] * remaining ** 2
+
+
+GAMAKA_CONTOURS = {
+    'kampita': kampita_contour,
+    'jaru': jaru_contour,
+}
+
+
+def render_expression(midi_notes, duration=0.5, gamaka=None, vibrato_rate=5,
+                      vibrato_depth=30, rng=None):
+    """Compute the note, pitch-bend and control-change events of a sequence as arrays.
+
+    Every note gets an initial bend of 100, a sampled vibrato curve of
+    `vibrato_depth` pitch-bend units, a velocity of 90 +/- 10 and expression
+    (CC11) and modulation (CC1) events at its onset. `gamaka` names a contour
+    in GAMAKA_CONTOURS (or is a list with one name or None per note) whose
+    semitone offsets are added to the vibrato curve.
+    """
+    pitches = np.asarray(midi_notes, dtype=np.int64)
+    num_notes = len(pitches)
+    starts = np.arange(num_notes) * duration
+    if rng is None:
+        velocities = 90 + np.random.randint(-10, 10, size=num_notes)
+    else:
+        velocities = 90 + rng.integers(-10, 10, size=num_notes)
+
+    # Vibrato samples: one row per note, one column per sample within the note
+    num_samples = int(duration * PITCH_BEND_SAMPLES_PER_SECOND)
+    position = np.arange(num_samples) / max(num_samples, 1)
+    sample_times = starts[:, None] + position[None, :] * duration
+    vibrato = np.trunc(vibrato_depth * np.sin(2 * np.pi * vibrato_rate * sample_times))
+
+    if gamaka is not None:
+        intervals = np.diff(pitches, prepend=pitches[:1])
+        positions = np.broadcast_to(position, sample_times.shape)
+        kinds = [gamaka] * num_notes if isinstance(gamaka, str) else list(gamaka)
+        offsets = np.zeros(sample_times.shape)
+        for kind in set(kinds) - {None}:
+            rows = np.array([k == kind for k in kinds])
+            offsets[rows] = GAMAKA_CONTOURS[kind](positions[rows], intervals[rows])
+        vibrato = vibrato + semitones_to_pitch_bend(offsets)
+
+    # Each note starts with a fixed bend of 100 followed by its curve
+    bend_times = np.concatenate([starts[:, None], sample_times], axis=1).ravel()
+    bend_values = np.concatenate(
+        [np.full((num_notes, 1), 100), vibrato.astype(np.int64)], axis=1).ravel()
+
+    return {
+        'pitch': pitches,
+        'velocity': velocities,
+        'start': starts,
+        'end': starts + duration,
+        'bend_time': bend_times,
+        'bend_value': np.clip(bend_values, -8192, 8191),
+        'cc_time': np.repeat(starts, 2),
+        'cc_number': np.tile([11, 1], num_notes),  # Expression, Modulation
+        'cc_value': np.tile([100, 64], num_notes),
     }
-    return [swara_map[s] for s in swaras if s in swara_map]
 
-def create_midi_sequence(midi_notes, duration=0.5):
+
+def create_midi_sequence(midi_notes, duration=0.5, gamaka=None, rng=None):
     """Create a MIDI sequence from note numbers with voice-like expression."""
+    events = render_expression(midi_notes, duration, gamaka=gamaka, rng=rng)
+
     pm = pretty_midi.PrettyMIDI()
     # Use choir instrument instead of piano for more voice-like sound
     voice = pretty_midi.Instrument(program=52)  # Choir Aahs
-    
-    current_time = 0.0
-    for note_num in midi_notes:
-        # Add slight pitch bend for more natural sound
-        pitch_bend = pretty_midi.PitchBend(pitch=100, time=current_time)
-        voice.pitch_bends.append(pitch_bend)
-        
-        # Add vibrato effect
-        vibrato_rate = 5  # Hz
-        vibrato_depth = 30  # cents
-        num_vibrato_samples = int(duration * 20)  # 20 samples per second
-        for i in range(num_vibrato_samples):
-            t = current_time + (i / num_vibrato_samples) * duration
-            bend_amount = int(vibrato_depth * np.sin(2 * np.pi * vibrato_rate * t))
-            voice.pitch_bends.append(pretty_midi.PitchBend(bend_amount, t))
-        
-        # Create note with dynamic velocity and expression
-        note = pretty_midi.Note(
-            velocity=90 + np.random.randint(-10, 10),  # Slight velocity variation
-            pitch=note_num,
-            start=current_time,
-            end=current_time + duration
-        )
-        voice.notes.append(note)
-        
-        # Add control changes for expression
-        voice.control_changes.append(pretty_midi.ControlChange(11, 100, current_time))  # Expression
-        voice.control_changes.append(pretty_midi.ControlChange(1, 64, current_time))    # Modulation
-        
-        current_time += duration
-    
+
+    # Write all events in bulk from plain Python scalars
+    voice.notes.extend(map(
+        pretty_midi.Note, events['velocity'].tolist(), events['pitch'].tolist(),
+        events['start'].tolist(), events['end'].tolist()))
+    voice.pitch_bends.extend(map(
+        pretty_midi.PitchBend, events['bend_value'].tolist(), events['bend_time'].tolist()))
+    voice.control_changes.extend(map(
+        pretty_midi.ControlChange, events['cc_number'].tolist(),
+        events['cc_value'].tolist(), events['cc_time'].tolist()))
+
     pm.instruments.append(voice)
     return pm
 
@@ -85,8 +142,8 @@ def process_raga_files(input_dir):
             patterns = parse_raga_pattern(text_file)
             
             # Convert swaras to MIDI notes
-            arohanam_notes = convert_swaras_to_midi_notes(patterns['arohanam'])
-            avarohanam_notes = convert_swaras_to_midi_notes(patterns['avarohanam'])
+            arohanam_notes = to_midi(patterns['arohanam']).tolist()
+            avarohanam_notes = to_midi(patterns['avarohanam']).tolist()
             
             # Create MIDI sequence
             all_notes = arohanam_notes + avarohanam_notes
@@ -0,0 +1,106 @@
+import os
+import json
+from collections import defaultdict
+import numpy as np
+from data.catalog import Catalog
+
+MANIFEST_VERSION = 1
+SPLITS = ('train', 'val', 'test')
+SPLIT_FORMATS = ('midi', 'musicxml', 'audio')
+
+
+def _groups(catalog, entries, root, use_dedup):
+    """Map each relpath to a composition group: its near-duplicate cluster, else its content hash"""
+    group_of = {relpath: entry['sha1'] for relpath, entry in entries}
+    if use_dedup:
+        from data.dedup import find_near_duplicates
+        for cluster in find_near_duplicates(root, catalog=catalog)['clusters']:
+            for relpath in cluster:
+                group_of[relpath] = group_of[cluster[0]]
+    return group_of
+
+
+def _assign(groups, ratios, counts, rng):
+    """Greedily give each group to the split furthest below its target share"""
+    order = rng.permutation(len(groups))
+    # Place big groups first so small ones can even out the proportions
+    order = sorted(order, key=lambda i: -len(groups[i][1]))
+    assignment = {}
+    for i in order:
+        key, members = groups[i]
+        total = sum(counts.values()) + len(members)
+        split = max(SPLITS, key=lambda s: ratios[s] * total - counts[s])
+        counts[split] += len(members)
+        assignment[key] = split
+    return assignment
+
+
+def build_split_manifest(root, manifest_path, ratios=(0.7, 0.15, 0.15), seed=42, use_dedup=True):
+    """Create or extend the persisted train/val/test manifest for a dataset root.
+
+    Files are grouped by composition (identical content and near-duplicate
+    clusters from data.dedup share a group), and groups are distributed per
+    raga so every raga is split in roughly the requested ratios. Existing
+    assignments are never moved; only files new to the catalog are placed.
+    Unlike the old top-level listing, files in subfolders of `root` are split too.
+    Loaders select files by looking them up here instead of copying them.
+
+    Returns:
+        The manifest dictionary, also written to `manifest_path`.
+    """
+    ratios = dict(zip(SPLITS, ratios))
+    manifest = load_split_manifest(manifest_path) if os.path.exists(manifest_path) else None
+    if manifest is None or manifest['version'] != MANIFEST_VERSION:
+        manifest = {'version': MANIFEST_VERSION, 'seed': seed, 'ratios': ratios, 'files': {}}
+
+    catalog = Catalog.build(root)
+    entries = catalog.query(fmt=SPLIT_FORMATS)
+    group_of = _groups(catalog, entries, root, use_dedup)
+    known = manifest['files']
+
+    # Groups that already have a member in the manifest keep its split
+    split_of_group = {}
+    for relpath, record in known.items():
+        split_of_group.setdefault(record['group'], record['split'])
+
+    pending = defaultdict(lambda: defaultdict(list))
+    counts = defaultdict(lambda: dict.fromkeys(SPLITS, 0))
+    for relpath, entry in entries:
+        raga = entry['raga_name'].lower()
+        if relpath in known:
+            counts[raga][known[relpath]['split']] += 1
+        elif group_of[relpath] not in split_of_group:
+            pending[raga][group_of[relpath]].append(relpath)
+
+    rng = np.random.default_rng(manifest['seed'])
+    for raga in sorted(pending):
+        groups = sorted(pending[raga].items())
+        split_of_group.update(_assign(groups, manifest['ratios'], counts[raga], rng))
+
+    for relpath, entry in entries:
+        if relpath not in known:
+            known[relpath] = {
+                'split': split_of_group[group_of[relpath]],
+                'group': group_of[relpath],
+                'raga': entry['raga_name'],
+                'format': entry['format'],
+            }
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+    sizes = {s: sum(1 for r in known.values() if r['split'] == s) for s in SPLITS}
+    print(f"Split manifest {manifest_path}: {sizes}")
+    return manifest
+
+
+def load_split_manifest(manifest_path):
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def split_files(manifest, split, fmt=None):
+    """Relative paths assigned to `split`, optionally restricted to one format"""
+    return sorted(relpath for relpath, record in manifest['files'].items()
+                  if record['split'] == split and (fmt is None or record['format'] == fmt))
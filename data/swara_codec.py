@@ -0,0 +1,213 @@
+import re
+from itertools import repeat
+import numpy as np
+
+# The sixteen swara names in scale order; a token's code is
+# (octave + MAX_OCTAVE) * NUM_SWARAS + its index in this tuple
+SWARA_NAMES = ('S', 'R1', 'R2', 'R3', 'G1', 'G2', 'G3', 'M1', 'M2',
+               'P', 'D1', 'D2', 'D3', 'N1', 'N2', 'N3')
+# Semitones above Sa. R2/G1, R3/G2, D2/N1 and D3/N2 are the vivadi
+# (enharmonic) pairs: different names for the same pitch
+SWARA_SEMITONES = {
+    'S': 0, 'R1': 1, 'R2': 2, 'R3': 3, 'G1': 2, 'G2': 3, 'G3': 4,
+    'M1': 5, 'M2': 6, 'P': 7, 'D1': 8, 'D2': 9, 'D3': 10, 'N1': 9, 'N2': 10, 'N3': 11,
+}
+NUM_SWARAS = len(SWARA_NAMES)
+MAX_OCTAVE = 2
+NUM_CODES = NUM_SWARAS * (2 * MAX_OCTAVE + 1)
+UNKNOWN = -1
+
+# Names used when a pitch has to be spelled without knowing the raga
+DEFAULT_SPELLING = ('S', 'R1', 'R2', 'G2', 'G3', 'M1', 'M2', 'P', 'D1', 'D2', 'N2', 'N3')
+
+_INDEX = {name: i for i, name in enumerate(SWARA_NAMES)}
+_BASE_SEMITONES = np.array([SWARA_SEMITONES[name] for name in SWARA_NAMES], dtype=np.int16)
+_OCTAVES = np.arange(NUM_CODES) // NUM_SWARAS - MAX_OCTAVE
+
+# Code -> semitones from middle Sa, and code -> display name
+CODE_SEMITONES = (_BASE_SEMITONES[np.arange(NUM_CODES) % NUM_SWARAS] + 12 * _OCTAVES).astype(np.int16)
+CODE_NAMES = np.array([SWARA_NAMES[code % NUM_SWARAS] + ("'" * octave if octave > 0 else '.' * -octave)
+                       for code, octave in enumerate(_OCTAVES)], dtype=object)
+
+# Upper octave: trailing ' (or a leading/trailing ^); lower octave: trailing . or ,
+_TOKEN = re.compile(r"^(\^*)([SRGMPDN])([123]?)('*|\^*|\.*|,*)$")
+_DEFAULT_VARIANTS = {'R': 'R2', 'G': 'G3', 'D': 'D2', 'N': 'N3'}
+
+
+def _parse_token(token):
+    match = _TOKEN.match(token.strip().upper().replace('’', "'"))
+    if not match:
+        return UNKNOWN
+    caret, letter, variant, marks = match.groups()
+    name = letter + variant if variant else _DEFAULT_VARIANTS.get(letter, letter)
+    if name not in _INDEX:
+        return UNKNOWN
+    octave = len(caret) + (len(marks) if marks[:1] in ("'", '^') else -len(marks))
+    if abs(octave) > MAX_OCTAVE:
+        return UNKNOWN
+    return (octave + MAX_OCTAVE) * NUM_SWARAS + _INDEX[name]
+
+
+def _compile_table():
+    """Every spelling the tokenizer accepts, mapped straight to its code"""
+    table = {}
+    marks = [''] + [m * n for m in ("'", '^', '.', ',') for n in range(1, MAX_OCTAVE + 1)]
+    for name in list(SWARA_NAMES) + list(_DEFAULT_VARIANTS):
+        for spelling in {name, name.lower()}:
+            for mark in marks:
+                table[spelling + mark] = _parse_token(spelling + mark)
+    return table
+
+
+_TABLE = _compile_table()
+
+
+def _tokens(swaras):
+    return swaras.split() if isinstance(swaras, str) else list(swaras)
+
+
+def _raw_codes(tokens):
+    codes = np.fromiter(map(_TABLE.get, tokens, repeat(UNKNOWN)), dtype=np.int16, count=len(tokens))
+    for i in np.flatnonzero(codes == UNKNOWN):
+        # Rare spellings outside the compiled table (e.g. "^^S")
+        codes[i] = _parse_token(tokens[i])
+    return codes
+
+
+def encode(swaras, errors='drop'):
+    """Tokenize a swara string (or token list) into an int16 array of codes.
+
+    Octave marks are kept: "S'" is upper Sa, "P." lower Pa. Unknown tokens are
+    dropped, kept as UNKNOWN (errors='keep') or raise ValueError
+    (errors='raise').
+    """
+    tokens = _tokens(swaras)
+    return _handle_unknown(_raw_codes(tokens), tokens, errors)
+
+
+def _handle_unknown(codes, tokens, errors):
+    unknown = codes == UNKNOWN
+    if not unknown.any() or errors == 'keep':
+        return codes
+    if errors == 'raise':
+        bad = sorted({tokens[i] for i in np.flatnonzero(unknown)})
+        raise ValueError(f"Unknown swaras: {' '.join(bad)}")
+    return codes[~unknown]
+
+
+def encode_corpus(patterns, errors='drop'):
+    """Encode many swara strings at once.
+
+    Returns:
+        (codes, offsets): all codes concatenated, and offsets of length
+        len(patterns) + 1 so pattern i is codes[offsets[i]:offsets[i + 1]].
+    """
+    token_lists = [_tokens(p) for p in patterns]
+    lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+    tokens = [t for tokens in token_lists for t in tokens]
+    codes = _raw_codes(tokens)
+    if errors != 'keep':
+        keep = codes != UNKNOWN
+        if errors == 'raise' and not keep.all():
+            _handle_unknown(codes, tokens, errors)
+        pattern_ids = np.repeat(np.arange(len(lengths)), lengths)
+        codes = codes[keep]
+        lengths = np.bincount(pattern_ids[keep], minlength=len(lengths))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return codes, offsets
+
+
+def decode(codes):
+    """Swara names, with octave marks, for an array of codes"""
+    return CODE_NAMES[np.asarray(codes, dtype=np.int64)].tolist()
+
+
+def codes_to_midi(codes, tonic=60):
+    """MIDI note numbers for codes, with middle-octave Sa at `tonic`"""
+    return CODE_SEMITONES[np.asarray(codes, dtype=np.int64)] + np.int16(tonic)
+
+
+def to_midi(swaras, tonic=60, errors='drop'):
+    """MIDI note numbers of a swara string or token list"""
+    return codes_to_midi(encode(swaras, errors), tonic)
+
+
+def pitch_classes(swaras):
+    """Semitones above Sa (0-11) of a swara pattern, ignoring octave marks"""
+    return (CODE_SEMITONES[encode(swaras).astype(np.int64)] % 12).tolist()
+
+
+def spelling_table(scale=None):
+    """Swara index for each of the 12 pitch classes.
+
+    Pitch classes present in `scale` (a swara string or list, e.g. a raga's
+    arohanam) are spelled with that raga's names, so vivadi ragas get R3 or
+    N1 back; the rest use DEFAULT_SPELLING.
+    """
+    table = np.array([_INDEX[name] for name in DEFAULT_SPELLING], dtype=np.int16)
+    if scale is not None:
+        indices = encode(scale) % NUM_SWARAS
+        table[_BASE_SEMITONES[indices]] = indices
+    return table
+
+
+def midi_to_codes(midi, tonic=60, scale=None):
+    """Codes for MIDI note numbers relative to `tonic`, clipped to the supported octaves"""
+    offsets = np.asarray(midi, dtype=np.int64) - tonic
+    octaves = np.clip(offsets // 12, -MAX_OCTAVE, MAX_OCTAVE)
+    return ((octaves + MAX_OCTAVE) * NUM_SWARAS + spelling_table(scale)[offsets % 12]).astype(np.int16)
+
+
+def midi_to_swaras(midi, tonic=60, scale=None):
+    """Swara names for MIDI note numbers; see `spelling_table` for `scale`"""
+    return decode(midi_to_codes(midi, tonic, scale))
+
+
+def midi_to_note_names(midi):
+    """Western note names (e.g. 'C#4') for MIDI note numbers"""
+    names = np.array(['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'], dtype=object)
+    midi = np.asarray(midi, dtype=np.int64)
+    return (names[midi % 12] + (midi // 12 - 1).astype(str).astype(object)).tolist()
+
+
+_NOTE_NAME = re.compile(r'^([A-Ga-g])([#b-]*)(-?\d+)$')
+_NATURALS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+
+def note_to_midi(token):
+    """Map a note token (MIDI number, note name or music21 chord) to one MIDI pitch"""
+    if isinstance(token, (int, np.integer)):
+        return int(token)
+    token = str(token).strip()
+    if token.replace('.', '').isdigit():
+        # Chords are stored as pitch classes (e.g. '0.4.7'); voice the root in octave 4
+        return 60 + int(token.split('.')[0])
+    # music21 spells flats with '-' (e.g. 'E-4')
+    match = _NOTE_NAME.match(token)
+    if not match:
+        raise ValueError(f'Unknown note {token!r}')
+    letter, accidentals, octave = match.groups()
+    shift = accidentals.count('#') - accidentals.count('b') - accidentals.count('-')
+    return _NATURALS[letter.upper()] + shift + 12 * (int(octave) + 1)
+
+
+def index_table(vocabulary):
+    """Lookup array mapping codes to positions in `vocabulary` (UNKNOWN elsewhere)"""
+    vocabulary = encode(vocabulary, errors='raise')
+    table = np.full(NUM_CODES, UNKNOWN, dtype=np.int64)
+    table[vocabulary] = np.arange(len(vocabulary))
+    return table
+
+
+# Ri/Ga and Dha/Ni pairs in the order the Melakarta numbering cycles through them
+_LOWER_PAIRS = [('R1', 'G1'), ('R1', 'G2'), ('R1', 'G3'), ('R2', 'G2'), ('R2', 'G3'), ('R3', 'G3')]
+_UPPER_PAIRS = [('D1', 'N1'), ('D1', 'N2'), ('D1', 'N3'), ('D2', 'N2'), ('D2', 'N3'), ('D3', 'N3')]
+
+
+def melakarta_scale(number):
+    """Arohanam of a Melakarta raga derived from its number (1-72)"""
+    k = (number - 1) % 36
+    ri, ga = _LOWER_PAIRS[k // 6]
+    dha, ni = _UPPER_PAIRS[k % 6]
+    ma = 'M1' if number <= 36 else 'M2'
+    return f"S {ri} {ga} {ma} P {dha} {ni} S'"
@@ -1,5 +1,19 @@
 # This file makes the model directory a Python package
-from .data_processor import DataProcessor
-from .model import DeepRagaModel
+import importlib
 
-__all__ = ['DataProcessor', 'DeepRagaModel']
\ No newline at end of file
+# Exports are imported on first access, so `import model.generation` for
+# serving does not pull in the data-processing stack
+_EXPORTS = {
+    'DataProcessor': '.data_processor',
+    'DeepRagaModel': '.model',
+}
+
+__all__ = ['DataProcessor', 'DeepRagaModel']
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,191 @@
+import os
+import json
+import math
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import soundfile as sf
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg')
+PITCH_FILENAME = 'pitch_f0.npy'
+INDEX_FILENAME = 'pitch_index.json'
+FRAME_LENGTH = 2048
+FMIN = 65.0    # C2, below the lowest male Sa
+FMAX = 1050.0  # C6, above the highest female tara sthayi
+RESAMPLE_MARGIN = 1024  # target-rate samples read past each segment edge
+# YIN frames quieter than this (dBFS RMS) are unvoiced. An absolute floor keeps
+# quiet passages voiced whatever the loudest note of their block
+VOICING_FLOOR_DB = -40.0
+
+
+def _audio_info(path):
+    """Return (sample_rate, num_samples) at the file's native rate"""
+    info = sf.info(path)
+    return info.samplerate, info.frames
+
+
+def _readable(path):
+    try:
+        sf.info(path)
+        return True
+    except RuntimeError:
+        return False
+
+
+def _decode_to_wav(job):
+    """Decode a file soundfile cannot read (e.g. mp3 with an older libsndfile) into a WAV.
+
+    The file is decoded once, front to back, so its blocks can then be read
+    with random access instead of decoding from the start for every block.
+    """
+    import audioread
+    path, wav_path = job
+    with audioread.audio_open(path) as source, \
+            sf.SoundFile(wav_path, 'w', samplerate=source.samplerate, channels=source.channels,
+                         subtype='PCM_16') as out:
+        for buffer in source:
+            # audioread yields 16-bit little-endian PCM
+            out.write(np.frombuffer(buffer, dtype='<i2').reshape(-1, source.channels))
+    return wav_path
+
+
+def _try_decode(job):
+    try:
+        _decode_to_wav(job)
+        return True
+    except Exception as e:
+        print(f"Error decoding {job[0]}: {str(e)}")
+        return False
+
+
+def _read_block(path, native_sr, start, stop):
+    """Decode native-rate samples [start, stop) as mono float32, zero-padded outside the file"""
+    begin = max(start, 0)
+    y = sf.read(path, start=begin, stop=max(stop, begin), dtype='float32', always_2d=True)[0]
+    y = y.mean(axis=1)
+    return np.pad(y, (begin - start, max(0, stop - start - (begin - start) - len(y))))
+
+
+def plan_segments(path, sample_rate, hop_length, segment_seconds):
+    """Split a recording into (start_frame, num_frames) blocks of pitch frames"""
+    native_sr, native_samples = _audio_info(path)
+    num_samples = math.ceil(native_samples * sample_rate / native_sr)
+    num_frames = math.ceil(num_samples / hop_length)
+    segment_frames = max(1, int(segment_seconds * sample_rate / hop_length))
+    segments = [(start, min(segment_frames, num_frames - start))
+                for start in range(0, num_frames, segment_frames)]
+    return native_sr, num_frames, segments
+
+
+def _extract_segment(job):
+    """Decode one block, track its pitch and write the frames into the shared memmap"""
+    import librosa
+    (path, native_sr, out_path, out_offset, start_frame, num_frames,
+     sample_rate, hop_length, method) = job
+
+    # Centered frames: frame k covers [k*hop - FRAME_LENGTH/2, k*hop + FRAME_LENGTH/2)
+    start = start_frame * hop_length - FRAME_LENGTH // 2 - RESAMPLE_MARGIN
+    length = (num_frames - 1) * hop_length + FRAME_LENGTH + 2 * RESAMPLE_MARGIN
+    native_start = int(math.floor(start * native_sr / sample_rate))
+    native_stop = int(math.ceil((start + length) * native_sr / sample_rate))
+    y = _read_block(path, native_sr, native_start, native_stop)
+    if native_sr != sample_rate:
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sample_rate)
+    y = librosa.util.fix_length(y, size=length)[RESAMPLE_MARGIN:length - RESAMPLE_MARGIN]
+
+    if method == 'pyin':
+        f0, voiced, _ = librosa.pyin(y, fmin=FMIN, fmax=FMAX, sr=sample_rate,
+                                     frame_length=FRAME_LENGTH, hop_length=hop_length,
+                                     center=False)
+        f0 = np.where(voiced, f0, 0.0)
+    else:
+        f0 = librosa.yin(y, fmin=FMIN, fmax=FMAX, sr=sample_rate,
+                         frame_length=FRAME_LENGTH, hop_length=hop_length, center=False)
+        # YIN always returns a pitch, so mark near-silent frames unvoiced
+        rms = librosa.feature.rms(y=y, frame_length=FRAME_LENGTH, hop_length=hop_length,
+                                  center=False)[0]
+        f0 = np.where(rms > 10 ** (VOICING_FLOOR_DB / 20), f0, 0.0)
+
+    tracks = np.load(out_path, mmap_mode='r+')
+    tracks[out_offset:out_offset + num_frames] = f0[:num_frames].astype(np.float16)
+    tracks.flush()
+    return num_frames
+
+
+def extract_pitch_tracks(audio_paths, output_dir, sample_rate=22050, hop_length=512,
+                         method='yin', segment_seconds=30.0, num_workers=None):
+    """Extract f0 contours for many recordings into one memory-mapped float16 array.
+
+    Every recording is cut into blocks of `segment_seconds`, and the blocks of
+    all files are tracked in parallel with YIN (fast) or pYIN (more robust).
+    Workers decode only their block and write straight into the output memmap,
+    so memory stays bounded for hour-long concerts. Unvoiced frames are 0 Hz.
+    Files soundfile cannot read are first decoded once into temporary WAVs.
+
+    Args:
+        audio_paths: Audio files to process
+        output_dir: Directory for pitch_f0.npy and pitch_index.json
+        sample_rate: Analysis sample rate
+        hop_length: Hop between pitch frames in samples
+        method: 'yin' or 'pyin'
+        segment_seconds: Length of each decoded block
+        num_workers: Worker processes (defaults to the CPU count)
+
+    Returns:
+        The index dictionary, mapping each file to its frame range.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    out_path = os.path.join(output_dir, PITCH_FILENAME)
+
+    with tempfile.TemporaryDirectory(prefix='.decoded-', dir=output_dir) as decoded_dir, \
+            ProcessPoolExecutor(max_workers=num_workers) as executor:
+        sources = {path: path for path in audio_paths}
+        undecoded = [path for path in audio_paths if not _readable(path)]
+        decode_jobs = [(path, os.path.join(decoded_dir, f'{i}.wav')) for i, path in enumerate(undecoded)]
+        for (path, wav_path), decoded in zip(decode_jobs, executor.map(_try_decode, decode_jobs)):
+            sources[path] = wav_path if decoded else None
+
+        files = []
+        jobs = []
+        offset = 0
+        for path in audio_paths:
+            try:
+                if sources[path] is None:
+                    raise RuntimeError('could not decode the file')
+                native_sr, num_frames, segments = plan_segments(sources[path], sample_rate, hop_length,
+                                                                segment_seconds)
+            except Exception as e:
+                print(f"Error reading {path}: {str(e)}")
+                continue
+            files.append({'path': path, 'offset': offset, 'num_frames': num_frames})
+            for start_frame, count in segments:
+                jobs.append((sources[path], native_sr, out_path, offset + start_frame, start_frame, count,
+                             sample_rate, hop_length, method))
+            offset += num_frames
+
+        np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float16, shape=(offset,)).flush()
+        done = sum(executor.map(_extract_segment, jobs))
+    print(f"Extracted {done} pitch frames from {len(files)} recordings")
+
+    index = {
+        'sample_rate': sample_rate,
+        'hop_length': hop_length,
+        'method': method,
+        'files': files,
+    }
+    with open(os.path.join(output_dir, INDEX_FILENAME), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def load_pitch_tracks(output_dir):
+    """Open extracted pitch tracks read-only; returns (memmap, index)"""
+    with open(os.path.join(output_dir, INDEX_FILENAME), 'r') as f:
+        index = json.load(f)
+    tracks = np.load(os.path.join(output_dir, PITCH_FILENAME), mmap_mode='r')
+    return tracks, index
+
+
+def file_pitch_track(tracks, entry):
+    """Slice one recording's f0 contour out of the shared array"""
+    return tracks[entry['offset']:entry['offset'] + entry['num_frames']]
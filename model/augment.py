@@ -0,0 +1,150 @@
+import numpy as np
+import torch
+from torch.utils.data import default_collate
+from data.swara_codec import note_to_midi
+
+
+def _chord_classes(token):
+    """Pitch classes of a chord token like '0.4.7', or None for single notes"""
+    token = str(token)
+    if '.' in token and token.replace('.', '').isdigit():
+        return frozenset(int(p) for p in token.split('.'))
+    return None
+
+
+class TokenAugmenter:
+    """On-the-fly, vectorized augmentation of batches of note-index windows.
+
+    Every variant is a lookup table over the vocabulary applied with fancy
+    indexing, so a batch costs a few array operations and nothing is written
+    to disk:
+
+    - shruti transposition: every note (and chord) moves by a few semitones,
+      so the model sees each raga on more than one Sa. The shift is not an
+      input to the model, so pass `transpositions=()` when training a
+      raga-conditioned model, whose raga IDs assume Sa = `tonic`;
+    - octave shifts of single notes by +-12 semitones;
+    - rhythmic variation: the token streams carry no durations, so a slower
+      rendering is a time stretch that holds notes over several tokens;
+    - gamaka variants: a held note alternates with the next swara above it
+      in the raga's scale, the shape of a kampita oscillation.
+
+    Rhythm and gamakas are applied first, on the original Sa; a row whose
+    transposed or shifted notes fall outside the vocabulary keeps its pitch.
+    Call it on numpy arrays, or use `collate` as a DataLoader collate_fn so
+    it runs in the loader's worker processes.
+    """
+
+    def __init__(self, int_to_note, scales=None, tonic=60, transpositions=(-2, -1, 1, 2),
+                 transpose_prob=0.5, octave_prob=0.2, rhythm_prob=0.3, min_rate=0.6,
+                 gamaka_prob=0.3, gamaka_rate=0.5):
+        """`scales` is a (num raga IDs, 12) bool array of each raga's swaras relative to `tonic`"""
+        self.transpose_prob = transpose_prob
+        self.octave_prob = octave_prob
+        self.rhythm_prob = rhythm_prob
+        self.min_rate = min_rate
+        self.gamaka_prob = gamaka_prob
+        self.gamaka_rate = gamaka_rate
+
+        vocab_size = len(int_to_note)
+        pitches = np.full(vocab_size, -1, dtype=np.int64)
+        chords = {}
+        for i, token in int_to_note.items():
+            classes = _chord_classes(token)
+            if classes is not None:
+                chords[classes] = i
+                continue
+            try:
+                pitches[i] = note_to_midi(token)
+            except ValueError:
+                pass
+        # Vocabulary index of every MIDI pitch, -1 where the vocabulary has none
+        pitch_index = np.full(128 + 24, -1, dtype=np.int64)
+        for i in np.flatnonzero(pitches >= 0)[::-1]:
+            if 0 <= pitches[i] < len(pitch_index):
+                pitch_index[pitches[i]] = i
+
+        def shift_table(shift, move_chords):
+            table = np.full(vocab_size, -1, dtype=np.int64)
+            notes = np.flatnonzero(pitches >= 0)
+            targets = pitches[notes] + shift
+            inside = (targets >= 0) & (targets < len(pitch_index))
+            table[notes[inside]] = pitch_index[targets[inside]]
+            for classes, i in chords.items():
+                table[i] = chords.get(frozenset((c + shift) % 12 for c in classes), -1) if move_chords else i
+            return table
+
+        self.transpositions = np.array([shift_table(s, True) for s in transpositions]).reshape(-1, vocab_size)
+        self.octaves = np.array([shift_table(s, False) for s in (-12, 12)])
+
+        # Next vocabulary note above each note within the raga's scale (a tone and a half at most)
+        self.gamaka_up = None
+        if scales is not None:
+            scales = np.asarray(scales, dtype=bool)
+            self.gamaka_up = np.full((len(scales), vocab_size), -1, dtype=np.int64)
+            notes = np.flatnonzero(pitches >= 0)
+            for step in range(4, 0, -1):
+                targets = pitches[notes] + step
+                inside = targets < len(pitch_index)
+                candidates = np.where(inside, pitch_index[np.minimum(targets, len(pitch_index) - 1)], -1)
+                in_scale = scales[:, (targets - tonic) % 12] & (candidates >= 0)
+                # Smaller steps overwrite larger ones, leaving the nearest swara
+                rows, columns = np.nonzero(in_scale)
+                self.gamaka_up[rows, notes[columns]] = candidates[columns]
+
+    @classmethod
+    def build(cls, int_to_note, raga_to_int, raga_index, **kwargs):
+        """Augmenter with the scales of `raga_index` (a RagaIndex) for the conditioning IDs in `raga_to_int`"""
+        scales = np.zeros((max(raga_to_int.values(), default=0) + 1, 12), dtype=bool)
+        for name, raga_id in raga_to_int.items():
+            position = raga_index.position(name)
+            if position is not None:
+                scales[raga_id] = raga_index.scale_bits[position].astype(bool)
+        return cls(int_to_note, scales, **kwargs)
+
+    def _remap(self, sequences, tables, prob, rng):
+        """Map each selected row through one random table, unless a note has no image"""
+        if len(tables) == 0:
+            return sequences
+        rows = len(sequences)
+        choice = rng.integers(len(tables), size=rows)
+        mapped = tables[choice[:, None], sequences]
+        apply = (rng.random(rows) < prob) & (mapped >= 0).all(axis=1)
+        return np.where(apply[:, None], mapped, sequences)
+
+    def __call__(self, sequences, targets, ragas=None, rng=None):
+        """Augmented copies of (batch, window) note indices and their next-note targets"""
+        rng = rng if rng is not None else np.random.default_rng()
+        full = np.concatenate([sequences, targets[:, None]], axis=1).astype(np.int64)
+        rows, length = full.shape
+
+        # Time stretch ending on the window's last note, so the move to the target
+        # is kept; a rate below 1 holds the earlier notes over several tokens
+        rates = np.where(rng.random(rows) < self.rhythm_prob, rng.uniform(self.min_rate, 1.0, rows), 1.0)
+        offsets = np.floor(np.arange(length - 2, -1, -1)[None] * rates[:, None]).astype(np.int64)
+        source = np.concatenate([length - 2 - offsets, np.full((rows, 1), length - 1)], axis=1)
+        full = np.take_along_axis(full, source, axis=1)
+
+        if self.gamaka_up is not None and ragas is not None:
+            ragas = np.clip(np.asarray(ragas, dtype=np.int64), 0, len(self.gamaka_up) - 1)
+            # Held notes (equal to the one before) of selected rows, never the target
+            held = np.zeros_like(full, dtype=bool)
+            held[:, 1:-1] = full[:, 1:-1] == full[:, :-2]
+            selected = rng.random(rows) < self.gamaka_prob
+            chosen = held & selected[:, None] & (rng.random(full.shape) < self.gamaka_rate)
+            up = self.gamaka_up[ragas[:, None], full]
+            full = np.where(chosen & (up >= 0), up, full)
+
+        full = self._remap(full, self.transpositions, self.transpose_prob, rng)
+        full = self._remap(full, self.octaves, self.octave_prob, rng)
+        return full[:, :-1], full[:, -1]
+
+    def collate(self, samples):
+        """DataLoader collate_fn: stack RagaDataset samples and augment the batch"""
+        batch = default_collate(samples)
+        # Drawn from torch's RNG, which DataLoader seeds per worker and epoch
+        rng = np.random.default_rng(int(torch.randint(2 ** 62, (1,))))
+        sequences, targets = self(batch['sequence'].numpy(), batch['target'].numpy(), batch['raga'].numpy(), rng)
+        batch['sequence'] = torch.from_numpy(sequences)
+        batch['target'] = torch.from_numpy(targets)
+        return batch
@@ -0,0 +1,232 @@
+"""Bulk offline generation of phrases from a job spec.
+
+The spec (JSON) lists ragas, how many phrases each gets per length and
+temperature, and the seed:
+
+    {"ragas": ["Mechakalyani", "Hanumatodi"], "count": 1000, "lengths": [64, 256],
+     "temperatures": [0.8, 1.0], "seed": 0}
+
+`count` may also map raga names to counts. The work is cut into shards of
+phrases sharing a raga, length and temperature. Each shard is decoded in
+batches by a pool of worker processes and written as one JSONL file (or a
+directory of MIDI files) under the output directory. Shards are renamed into
+place once complete, so rerunning the same command after an interruption
+only generates the missing shards.
+
+    python -m model.batch_generate jobs.json --output data/generated --workers 4
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import itertools
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import torch
+from data.swara_codec import note_to_midi
+from .generation import generate_batch
+from .precision import PRECISIONS, resolve_precision
+from .registry import DEFAULT_REGISTRY_DIR, ModelBundle, ModelRegistry
+from .raga_index import RagaIndex
+
+MANIFEST_FILENAME = 'manifest.json'
+PROGRESS_FILENAME = 'progress.json'
+LEGACY_WEIGHTS = os.path.join('model', 'trained_model.pth')
+LEGACY_VOCAB = os.path.join('data', 'processed', 'vocab.pkl')
+
+_bundle = None  # Model of the current worker process
+_precision = 'fp32'
+
+
+def load_spec(path):
+    with open(path, 'r') as f:
+        spec = json.load(f)
+    missing = [key for key in ('ragas', 'count', 'lengths', 'temperatures') if key not in spec]
+    if missing:
+        raise ValueError(f"Job spec is missing {', '.join(missing)}")
+    index = raga_index()
+    unknown = [raga for raga in spec['ragas'] if index.position(raga) is None]
+    if unknown:
+        raise ValueError(f"Unknown ragas: {', '.join(unknown)}")
+    return spec
+
+
+def plan_shards(spec, shard_size):
+    """List the shards of a spec: dicts of shard number, raga, length, temperature and count"""
+    shards = []
+    for raga, length, temperature in itertools.product(spec['ragas'], spec['lengths'], spec['temperatures']):
+        count = spec['count'][raga] if isinstance(spec['count'], dict) else spec['count']
+        for offset in range(0, count, shard_size):
+            shards.append({'shard': len(shards), 'raga': raga, 'length': int(length),
+                           'temperature': float(temperature), 'count': min(shard_size, count - offset)})
+    return shards
+
+
+def shard_path(output_dir, shard, output_format):
+    name = f"shard-{shard['shard']:05d}"
+    return os.path.join(output_dir, name + '.jsonl' if output_format == 'jsonl' else name)
+
+
+@lru_cache(maxsize=None)
+def raga_index():
+    return RagaIndex.from_sources()
+
+
+def scale_start_indices(int_to_note, raga, tonic=60):
+    """Vocabulary indices whose pitch lies in the raga's scale (all indices if none do).
+
+    Phrases start on one of these, which also steers models trained without raga conditioning.
+    """
+    index = raga_index()
+    in_scale = index.scale_bits[index.position(raga)].astype(bool)
+    allowed = []
+    for i, token in int_to_note.items():
+        try:
+            if in_scale[(note_to_midi(token) - tonic) % 12]:
+                allowed.append(i)
+        except ValueError:
+            continue
+    return np.array(sorted(allowed) or sorted(int_to_note), dtype=np.int64)
+
+
+def init_worker(bundle_dir, weights_path, vocab_path, num_threads, precision='fp32'):
+    global _bundle, _precision
+    torch.set_num_threads(num_threads)
+    _precision = resolve_precision(precision)
+    if bundle_dir is not None:
+        _bundle = ModelBundle.load(bundle_dir)
+    else:
+        _bundle = ModelBundle.from_files('legacy', weights_path, vocab_path)
+
+
+def run_shard(shard, output_dir, output_format, batch_size, seed, tempo):
+    """Generate one shard and move it into place; returns (shard number, notes, seconds)"""
+    start = time.perf_counter()
+    # Seeded by the shard number, so a resumed run writes the same shards
+    shard_seed = int(np.random.SeedSequence([seed, shard['shard']]).generate_state(1)[0])
+    generator = torch.Generator().manual_seed(shard_seed)
+    starts = torch.as_tensor(scale_start_indices(_bundle.int_to_note, shard['raga']))
+    raga = _bundle.raga_id(shard['raga']) if _bundle.model.num_ragas > 0 else None
+
+    sequences = []
+    for offset in range(0, shard['count'], batch_size):
+        size = min(batch_size, shard['count'] - offset)
+        picks = starts[torch.randint(len(starts), (size,), generator=generator)]
+        # Phrases are `length` notes including the seed note
+        sequences.extend(generate_batch(_bundle.model, picks, shard['length'] - 1, shard['temperature'],
+                                        generator=generator, ragas=raga, precision=_precision))
+
+    final_path = shard_path(output_dir, shard, output_format)
+    tmp_path = final_path + '.tmp'
+    if output_format == 'jsonl':
+        with open(tmp_path, 'w') as f:
+            for i, sequence in enumerate(sequences):
+                f.write(json.dumps({'raga': shard['raga'], 'temperature': shard['temperature'],
+                                    'shard': shard['shard'], 'index': i, 'model_version': _bundle.version,
+                                    'notes': [_bundle.int_to_note[int(idx)] for idx in sequence]}) + '\n')
+        os.replace(tmp_path, final_path)
+    else:
+        import pretty_midi
+        from data.raw.generate_melakarta_ragas import create_raga_sequence
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for i, sequence in enumerate(sequences):
+            names = [pretty_midi.note_number_to_name(note_to_midi(_bundle.int_to_note[int(idx)]))
+                     for idx in sequence]
+            create_raga_sequence(names, tempo=tempo, mirror=False).write(
+                os.path.join(tmp_path, f"{shard['raga']}_{i:05d}.mid"))
+        os.rename(tmp_path, final_path)
+    return shard['shard'], sum(len(s) for s in sequences), time.perf_counter() - start
+
+
+def resolve_model(args):
+    """(bundle directory, weights path, vocab path, version name) of the model to generate with"""
+    registry = ModelRegistry(args.registry)
+    version = args.version or registry.current_version()
+    if version is not None:
+        bundle_dir = os.path.join(args.registry, version)
+        if not os.path.isdir(bundle_dir):
+            sys.exit(f'No version {version} in {args.registry}')
+        return bundle_dir, None, None, version
+    if os.path.exists(LEGACY_WEIGHTS) and os.path.exists(LEGACY_VOCAB):
+        return None, LEGACY_WEIGHTS, LEGACY_VOCAB, 'legacy'
+    sys.exit('No published model version or trained_model.pth to generate with')
+
+
+def check_manifest(output_dir, manifest):
+    """Write the run manifest, or check that an existing one describes the same run"""
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            previous = json.load(f)
+        if previous['fingerprint'] != manifest['fingerprint']:
+            sys.exit(f'{output_dir} holds a different run (spec, model or options changed); '
+                     'use a new output directory')
+        return
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('spec', help='Job spec JSON file')
+    parser.add_argument('--output', required=True, help='Output directory (rerun to resume)')
+    parser.add_argument('--format', choices=['jsonl', 'midi'], default='jsonl')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=256, help='Phrases decoded together')
+    parser.add_argument('--shard-size', type=int, default=1024, help='Phrases per output shard')
+    parser.add_argument('--tempo', type=int, default=120, help='Tempo of MIDI output')
+    parser.add_argument('--precision', choices=PRECISIONS, default='fp32',
+                        help='bf16 autocast (auto: where the CPU has bf16 units); shards are only '
+                             'reproducible on the same precision')
+    parser.add_argument('--registry', default=DEFAULT_REGISTRY_DIR)
+    parser.add_argument('--version', help='Registry version (default: CURRENT)')
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    bundle_dir, weights_path, vocab_path, version = resolve_model(args)
+    shards = plan_shards(spec, args.shard_size)
+    os.makedirs(args.output, exist_ok=True)
+    run_options = {'spec': spec, 'model_version': version, 'format': args.format,
+                   'batch_size': args.batch_size, 'shard_size': args.shard_size, 'tempo': args.tempo}
+    if args.precision != 'fp32':
+        # Only recorded when bf16 may be used, so runs started before the option still resume
+        run_options['precision'] = args.precision
+    fingerprint = hashlib.sha256(json.dumps(run_options, sort_keys=True).encode()).hexdigest()
+    check_manifest(args.output, {**run_options, 'fingerprint': fingerprint, 'shards': len(shards)})
+
+    pending = [s for s in shards if not os.path.exists(shard_path(args.output, s, args.format))]
+    print(f"{len(shards)} shards, {len(shards) - len(pending)} already done, model {version}, "
+          f"{resolve_precision(args.precision)}")
+    if not pending:
+        return
+
+    workers = max(1, min(args.workers, len(pending)))
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    seed = int(spec.get('seed', 0))
+    done_notes = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(bundle_dir, weights_path, vocab_path, num_threads,
+                                       args.precision)) as executor:
+        futures = [executor.submit(run_shard, shard, args.output, args.format, args.batch_size, seed, args.tempo)
+                   for shard in pending]
+        for completed, future in enumerate(as_completed(futures), 1):
+            _, notes, _ = future.result()
+            done_notes += notes
+            elapsed = time.perf_counter() - start
+            progress = {'shards_done': len(shards) - len(pending) + completed, 'shards': len(shards),
+                        'notes': done_notes, 'seconds': elapsed, 'notes_per_hour': done_notes / elapsed * 3600}
+            with open(os.path.join(args.output, PROGRESS_FILENAME), 'w') as f:
+                json.dump(progress, f, indent=2)
+            print(f"\r{progress['shards_done']}/{len(shards)} shards, {done_notes} notes, "
+                  f"{progress['notes_per_hour'] / 1e6:.2f}M notes/hour", end='', flush=True)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,17 @@
 import os
 import numpy as np
-import torch
 import json
 import pickle
 from typing import Tuple, List, Dict
-from music21 import converter, note, chord
-import librosa
+from data.catalog import Catalog
+from data.melakarta_init import MELAKARTA_INDEX
+
+# Raga IDs for conditioning: 0 is an unknown raga, 1-72 the Melakarta numbers,
+# and janya ragas get IDs from 73 up as the dataset introduces them
+UNKNOWN_RAGA = 0
+
+def default_raga_table() -> Dict[str, int]:
+    return {name.lower(): number for number, name in MELAKARTA_INDEX.items()}
 
 class DataProcessor:
     def __init__(self, sample_rate=22050, hop_length=512, sequence_length=100):
@@ -14,11 +20,13 @@ class DataProcessor:
         self.sequence_length = sequence_length
         self.note_to_int = {}
         self.int_to_note = {}
+        self.raga_to_int = default_raga_table()
         
     def save_vocab(self, path: str):
         """Save the vocabulary mapping"""
         with open(path, 'wb') as f:
-            pickle.dump({'note_to_int': self.note_to_int, 'int_to_note': self.int_to_note}, f)
+            pickle.dump({'note_to_int': self.note_to_int, 'int_to_note': self.int_to_note,
+                         'raga_to_int': self.raga_to_int}, f)
             
     def load_vocab(self, path: str):
         """Load the vocabulary mapping"""
@@ -27,102 +35,186 @@ class DataProcessor:
                 data = pickle.load(f)
                 self.note_to_int = data['note_to_int']
                 self.int_to_note = data['int_to_note']
+                # Vocabularies from before raga conditioning only have the Melakartas
+                self.raga_to_int = data.get('raga_to_int', default_raga_table())
                 
+    def parse_notes(self, midi_path: str, force_source: bool = False) -> List[str]:
+        """Parse a MIDI file into note tokens (pitch names, or normal-order chords like '0.4.7')
+        
+        music21 keeps a pickled copy of every parsed file; force_source skips it.
+        """
+        # music21 takes seconds to import, so only the parsing paths pay for it
+        from music21 import converter, note, chord
+        try:
+            midi = converter.parse(midi_path, forceSource=force_source)
+            notes_to_parse = midi.flatten().notes
+        except Exception as e:
+            print(f"Music21 failed to parse {midi_path}: {str(e)}")
+            return []
+        
+        notes = []
+        for element in notes_to_parse:
+            if isinstance(element, note.Note):
+                notes.append(str(element.pitch))
+            elif isinstance(element, chord.Chord):
+                notes.append('.'.join(str(n) for n in element.normalOrder))
+        return notes
+    
+    def update_vocab(self, notes: List[str]):
+        """Give every unseen note token the next free id"""
+        for n in notes:
+            if n not in self.note_to_int:
+                new_id = len(self.note_to_int)
+                self.note_to_int[n] = new_id
+                self.int_to_note[new_id] = n
+    
+    def raga_id(self, raga_id, raga_name, training=True) -> int:
+        """Conditioning ID of a catalog raga label; unseen janya ragas get the next ID when training"""
+        if raga_id is not None:
+            return raga_id
+        if not raga_name:
+            return UNKNOWN_RAGA
+        key = raga_name.lower()
+        if key not in self.raga_to_int and training:
+            self.raga_to_int[key] = max(self.raga_to_int.values()) + 1
+        return self.raga_to_int.get(key, UNKNOWN_RAGA)
+    
+    def make_windows(self, notes: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Slide a sequence_length window over the notes; each window predicts the note after it.
+        
+        Windows touching a note outside the vocabulary are skipped.
+        """
+        ids = np.fromiter((self.note_to_int.get(n, -1) for n in notes), dtype=np.int64, count=len(notes))
+        return self.make_id_windows(ids)
+    
+    def make_id_windows(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """make_windows over vocabulary ids, with -1 for notes outside the vocabulary"""
+        # Need at least sequence_length + 1 notes
+        if len(ids) <= self.sequence_length:
+            return np.array([]), np.array([])
+        windows = np.lib.stride_tricks.sliding_window_view(ids, self.sequence_length + 1)
+        windows = windows[(windows >= 0).all(axis=1)]
+        if len(windows) == 0:
+            return np.array([]), np.array([])
+        return windows[:, :-1].copy(), windows[:, -1].copy()
+    
+    def sequence_note_ids(self, sequence) -> np.ndarray:
+        """Vocabulary ids of a NoteSequence parsed by model.tfrecord_reader, one per onset
+        
+        Notes starting together become the chord token of their pitch classes,
+        as parse_notes tokenizes chords; drums are left out and onsets missing
+        from the vocabulary are -1.
+        """
+        from data.swara_codec import note_to_midi
+        pitch_ids, chord_ids = {}, {}
+        for token, i in self.note_to_int.items():
+            if '.' in token and token.replace('.', '').isdigit():
+                chord_ids[frozenset(int(p) for p in token.split('.'))] = i
+            else:
+                try:
+                    pitch_ids.setdefault(note_to_midi(token), i)
+                except ValueError:
+                    pass
+        
+        pitched = ~sequence['is_drum']
+        pitches = sequence['pitch'][pitched]
+        onsets, first = np.unique(sequence['start_time'][pitched], return_index=True)
+        ids = np.full(len(onsets), -1, dtype=np.int64)
+        for k, notes in enumerate(np.split(pitches, first[1:])):
+            if len(set(notes.tolist())) == 1:
+                ids[k] = pitch_ids.get(int(notes[0]), -1)
+            else:
+                ids[k] = chord_ids.get(frozenset(int(p) % 12 for p in notes), -1)
+        return ids
+    
     def extract_midi_features(self, midi_path: str, training=True) -> Tuple[np.ndarray, np.ndarray]:
         """Extract features from MIDI file for next-note prediction"""
         try:
-            # Try to parse MIDI file with music21
-            try:
-                midi = converter.parse(midi_path)
-                notes_to_parse = midi.flatten().notes
-            except Exception as e:
-                print(f"Music21 failed to parse {midi_path}: {str(e)}")
-                return np.array([]), np.array([])
-                
-            notes = []
-            for element in notes_to_parse:
-                if isinstance(element, note.Note):
-                    notes.append(str(element.pitch))
-                elif isinstance(element, chord.Chord):
-                    notes.append('.'.join(str(n) for n in element.normalOrder))
-            
+            notes = self.parse_notes(midi_path)
             if not notes:
                 print(f"No notes found in {midi_path}")
                 return np.array([]), np.array([])
             
             # Update vocabulary if training
             if training:
-                for n in notes:
-                    if n not in self.note_to_int:
-                        new_id = len(self.note_to_int)
-                        self.note_to_int[n] = new_id
-                        self.int_to_note[new_id] = n
+                self.update_vocab(notes)
             
-            # Create sequences
-            network_input = []
-            network_output = []
-            
-            # Need at least sequence_length + 1 notes
-            if len(notes) <= self.sequence_length:
-                # Pad if too short? Or just skip? For now, let's skip very short files or pad
-                # Simple padding for now if needed, but better to just skip for quality
-                return np.array([]), np.array([])
-                
-            for i in range(0, len(notes) - self.sequence_length, 1):
-                sequence_in = notes[i:i + self.sequence_length]
-                sequence_out = notes[i + self.sequence_length]
-                
-                # Check if all notes in sequence are in vocab
-                try:
-                    input_seq = [self.note_to_int[char] for char in sequence_in]
-                    output_note = self.note_to_int[sequence_out]
-                    
-                    network_input.append(input_seq)
-                    network_output.append(output_note)
-                except KeyError:
-                    # If we are not training and encounter unknown notes, we skip
-                    continue
-            
-            if not network_input:
-                return np.array([]), np.array([])
-                
-            return np.array(network_input), np.array(network_output)
+            return self.make_windows(notes)
             
         except Exception as e:
             print(f"Error processing MIDI file {midi_path}: {str(e)}")
             return np.array([]), np.array([])
 
-    def process_dataset(self, midi_dir: str, output_dir: str):
-        """Process all files in the dataset and save processed data"""
+    def process_dataset(self, midi_dir: str, output_dir: str, dedup: bool = False):
+        """Process all files in the dataset and save processed data
+        
+        With dedup, near-duplicate MIDI files are dropped before windowing and
+        repeated (window, target) pairs are dropped afterwards.
+        """
         all_inputs = []
         all_outputs = []
+        all_sources = []
+        all_ragas = []
+        
+        catalog = Catalog.build(midi_dir)
+        midi_paths = catalog.paths(fmt='midi')
+        if dedup:
+            from data.dedup import find_near_duplicates
+            duplicates = set(find_near_duplicates(midi_dir, catalog=catalog)['duplicates'])
+            midi_paths = [p for p in midi_paths
+                          if os.path.relpath(p, midi_dir).replace(os.sep, '/') not in duplicates]
         
         # First pass: Build vocabulary
         print("Building vocabulary...")
-        for root, dirs, files in os.walk(midi_dir):
-            for file in files:
-                if file.endswith('.mid') or file.endswith('.midi'):
-                    self.extract_midi_features(os.path.join(root, file), training=True)
+        file_ragas = []
+        for midi_path in midi_paths:
+            self.extract_midi_features(midi_path, training=True)
+            entry = catalog.entries[os.path.relpath(midi_path, midi_dir).replace(os.sep, '/')]
+            file_ragas.append(self.raga_id(entry['raga_id'], entry['raga_name']))
         
-        print(f"Vocabulary size: {len(self.note_to_int)}")
+        print(f"Vocabulary size: {len(self.note_to_int)}, ragas: {len(set(file_ragas))}")
         self.save_vocab(os.path.join(output_dir, 'vocab.pkl'))
         
         # Second pass: Create sequences
         print("Creating sequences...")
-        for root, dirs, files in os.walk(midi_dir):
-            for file in files:
-                if file.endswith('.mid') or file.endswith('.midi'):
-                    inputs, outputs = self.extract_midi_features(os.path.join(root, file), training=False)
-                    if len(inputs) > 0:
-                        all_inputs.append(inputs)
-                        all_outputs.append(outputs)
+        for file_id, midi_path in enumerate(midi_paths):
+            inputs, outputs = self.extract_midi_features(midi_path, training=False)
+            if len(inputs) > 0:
+                all_inputs.append(inputs)
+                all_outputs.append(outputs)
+                all_sources.append(np.full(len(inputs), file_id, dtype=np.int32))
+                all_ragas.append(np.full(len(inputs), file_ragas[file_id], dtype=np.int16))
         
         if all_inputs:
             X = np.concatenate(all_inputs)
             y = np.concatenate(all_outputs)
+            sources = np.concatenate(all_sources)
+            ragas = np.concatenate(all_ragas)
+            
+            if dedup:
+                from data.dedup import unique_window_mask
+                keep = unique_window_mask(X, y)
+                print(f"Dropped {len(X) - keep.sum()} duplicate windows")
+                X, y, sources, ragas = X[keep], y[keep], sources[keep], ragas[keep]
             
             np.save(os.path.join(output_dir, 'X.npy'), X)
             np.save(os.path.join(output_dir, 'y.npy'), y)
+            # Source file of every window, so splits can be made by file rather than by row
+            np.save(os.path.join(output_dir, 'sources.npy'), sources)
+            # Raga ID of every window for the conditioned model
+            np.save(os.path.join(output_dir, 'ragas.npy'), ragas)
+            with open(os.path.join(output_dir, 'sources.json'), 'w') as f:
+                json.dump([os.path.relpath(p, midi_dir).replace(os.sep, '/') for p in midi_paths], f)
             print(f"Saved {len(X)} sequences to {output_dir}")
         else:
-            print("No data processed!")
\ No newline at end of file
+            print("No data processed!")
+
+    def extract_pitch_tracks(self, audio_dir: str, output_dir: str, method: str = 'yin', num_workers=None,
+                             audio_paths: List[str] = None):
+        """Extract f0 contours for every recording under audio_dir (or in audio_paths) into output_dir"""
+        from model.audio_features import extract_pitch_tracks
+        if audio_paths is None:
+            audio_paths = Catalog.build(audio_dir).paths(fmt='audio')
+        return extract_pitch_tracks(audio_paths, output_dir, sample_rate=self.sample_rate,
+                                    hop_length=self.hop_length, method=method,
+                                    num_workers=num_workers)
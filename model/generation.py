@@ -0,0 +1,330 @@
+import atexit
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+import torch
+from .model import DeepRagaModel
+from .precision import autocast
+
+# Hyperparameters of the served model; they must match training
+MODEL_CONFIG = {'embedding_dim': 64, 'hidden_size': 256, 'num_layers': 2}
+
+
+def build_model(vocab_size, device='cpu', num_ragas=0):
+    """DeepRagaModel with the serving hyperparameters, in eval mode (weights are random until loaded)"""
+    model = DeepRagaModel(vocab_size, MODEL_CONFIG['embedding_dim'], MODEL_CONFIG['hidden_size'],
+                          MODEL_CONFIG['num_layers'], num_ragas=num_ragas).to(device)
+    model.eval()
+    return model
+
+
+def infer_hyperparameters(state_dict):
+    """DeepRagaModel constructor arguments (other than vocab_size) that fit a saved state dict"""
+    num_layers = sum(1 for key in state_dict if key.startswith('lstm.weight_hh_l'))
+    hyperparameters = {'embedding_dim': state_dict['embedding.weight'].shape[1],
+                       'hidden_size': state_dict['lstm.weight_hh_l0'].shape[1], 'num_layers': num_layers}
+    if 'raga_embedding.weight' in state_dict:
+        num_ragas, raga_embedding_dim = state_dict['raga_embedding.weight'].shape
+        hyperparameters.update(num_ragas=num_ragas, raga_embedding_dim=raga_embedding_dim)
+    return {key: int(value) for key, value in hyperparameters.items()}
+
+
+def iter_generate(model, start_index, num_notes, temperature=1.0, device='cpu', generator=None, raga=None):
+    """Sample `num_notes` note indices after `start_index`, yielding each one as soon as it is drawn"""
+    input_seq = torch.tensor([[start_index]], dtype=torch.long, device=device)
+    raga = None if raga is None else torch.tensor([raga], dtype=torch.long, device=device)
+    hidden = None
+    with torch.no_grad():
+        for _ in range(num_notes):
+            output, hidden = model(input_seq, hidden, raga=raga)
+            probs = torch.softmax(output / temperature, dim=1)
+            # (1, 1) index tensor doubles as the next step's input
+            input_seq = torch.multinomial(probs, 1, generator=generator)
+            yield input_seq.item()
+
+
+def generate_batch(model, start_indices, num_notes, temperature=1.0, device='cpu', generator=None, ragas=None,
+                   hidden=None, precision='fp32'):
+    """Sample `num_notes` indices after each start index, decoding all sequences as one batch.
+
+    `temperature` and `ragas` may be scalars or one value per sequence, so a
+    batch can mix ragas. `hidden` is the LSTM state to start from (e.g. from
+    `prefill`), zeros by default. With precision 'bf16' the model runs under
+    bf16 autocast (see model.precision).
+
+    Returns:
+        int64 array of shape (len(start_indices), num_notes + 1), starting with the start indices.
+    """
+    input_seq = torch.as_tensor(start_indices, dtype=torch.long, device=device).view(-1, 1)
+    batch_size = input_seq.shape[0]
+    temperature = torch.as_tensor(temperature, dtype=torch.float32, device=device).expand(batch_size)[:, None]
+    if ragas is not None:
+        ragas = torch.as_tensor(ragas, dtype=torch.long, device=device).expand(batch_size)
+    sequences = torch.empty((batch_size, num_notes + 1), dtype=torch.long)
+    sequences[:, 0] = input_seq[:, 0]
+    with torch.no_grad(), autocast(precision, device):
+        for step in range(1, num_notes + 1):
+            output, hidden = model(input_seq, hidden, raga=ragas)
+            probs = torch.softmax(output.float() / temperature, dim=1)
+            input_seq = torch.multinomial(probs, 1, generator=generator)
+            sequences[:, step] = input_seq[:, 0]
+    return sequences.numpy()
+
+
+def prefill(model, prefix, raga=None, device='cpu', hidden=None):
+    """LSTM state (h, c) after consuming the note indices in `prefix`, in one forward pass from `hidden`"""
+    x = torch.as_tensor(prefix, dtype=torch.long, device=device).view(1, -1)
+    raga = None if raga is None or model.num_ragas == 0 else torch.tensor([raga], dtype=torch.long, device=device)
+    with torch.no_grad():
+        _, hidden = model.encode(x, hidden, raga=raga)
+    return hidden
+
+
+class PrefixCache:
+    """Memory-bounded LRU cache of the LSTM state after seed prefixes.
+
+    Many requests start from the same phrase: a raga's arohanam, a pakad or a
+    client's own prompt. Entries are keyed by raga ID and prefix indices, and
+    a prefix extending a cached one only encodes the notes after it. Decoding
+    steps attend over the current step alone, so the LSTM state is all that
+    a prefix leaves behind. `on_lookup(result)`, if given, is called with
+    'hit', 'partial' or 'miss' for every lookup.
+    """
+
+    def __init__(self, model, device='cpu', max_bytes=64 * 1024 * 1024, on_lookup=None):
+        self.model = model
+        self.device = device
+        self.max_bytes = max_bytes
+        self.on_lookup = on_lookup
+        self.total_bytes = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (raga, prefix) -> (state, bytes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def state(self, prefix, raga=None):
+        """LSTM state after consuming `prefix` (note indices) under `raga`; None for an empty prefix"""
+        prefix = tuple(int(i) for i in prefix)
+        if not prefix:
+            return None
+        raga = int(raga or 0) if self.model.num_ragas > 0 else 0
+        key = (raga, prefix)
+        base, done = None, 0
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                # Longest cached prefix of this one
+                for length in range(len(prefix) - 1, 0, -1):
+                    shorter = self._entries.get((raga, prefix[:length]))
+                    if shorter is not None:
+                        self._entries.move_to_end((raga, prefix[:length]))
+                        base, done = shorter[0], length
+                        break
+                if base is None:
+                    self.misses += 1
+                else:
+                    self.partial_hits += 1
+        if self.on_lookup is not None:
+            self.on_lookup('hit' if entry is not None else 'partial' if base is not None else 'miss')
+        if entry is not None:
+            return entry[0]
+
+        state = prefill(self.model, prefix[done:], raga, self.device, base)
+        size = sum(t.numel() * t.element_size() for t in state) + 8 * len(prefix)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            self.total_bytes += size - (previous[1] if previous else 0)
+            self._entries[key] = (state, size)
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.total_bytes -= old_size
+        return state
+
+    def describe(self):
+        return {'entries': len(self._entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'partial_hits': self.partial_hits, 'misses': self.misses}
+
+
+class GenerationBatcher:
+    """Decodes concurrent generation requests together, one model step for all of them.
+
+    `submit` returns a Future of the request's note indices (starting with the
+    start index). A background thread keeps one running batch: queued requests
+    join it at the next step with a fresh LSTM state (or the `state` they were
+    submitted with, e.g. from a PrefixCache) and leave as soon as they have all
+    their notes, so short requests are not held back by long ones. Rows may
+    differ in raga and temperature. With precision 'bf16' decoding runs
+    under bf16 autocast. `on_step(batch_size, seconds,
+    queue_seconds)`, if given, is called after each step with the time every
+    request that joined at that step spent queued. A request submitted with
+    a `profile` (see observability.ProfileSession) has the steps it takes
+    part in recorded on the batching thread as its 'steps' segment.
+    """
+
+    def __init__(self, model, device='cpu', max_batch=64, on_step=None, precision='fp32'):
+        self.model = model
+        self.device = device
+        self.max_batch = max_batch
+        self.on_step = on_step
+        self.precision = precision
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='generation-batcher', daemon=True)
+        self._thread.start()
+        _live_batchers.add(self)
+
+    def submit(self, start_index, num_notes, temperature=1.0, raga=None, state=None, profile=None):
+        future = Future()
+        if num_notes <= 0:
+            future.set_result([start_index])
+            return future
+        with self._lock:
+            if not self._closed:
+                self._queue.put((start_index, num_notes, float(temperature), raga, future, time.perf_counter(),
+                                 state, profile))
+                return future
+        # Stragglers holding a retired model version decode on their own
+        if profile is not None:
+            profile.start('steps')
+        try:
+            indices = generate_batch(self.model, [start_index], num_notes, temperature, self.device,
+                                     ragas=None if raga is None else [raga], hidden=state, precision=self.precision)
+        finally:
+            if profile is not None:
+                profile.stop()
+        future.set_result(indices[0].tolist())
+        return future
+
+    def close(self):
+        """Stop the batching thread once the requests already submitted are done"""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+
+    def _run(self):
+        # Entered once for the thread's lifetime: autocast keeps its bf16 copies
+        # of the weights until it exits, so they are not re-cast every step
+        with autocast(self.precision, self.device):
+            self._decode()
+
+    def _decode(self):
+        rows = []  # [indices, notes still to draw, future, profile] per row of the running batch
+        inputs = hidden = temperatures = ragas = None
+        closing = False
+        while rows or not closing:
+            joined = []
+            try:
+                # Only block when there is nothing to decode
+                while len(rows) + len(joined) < self.max_batch:
+                    item = self._queue.get(block=not rows and not joined)
+                    if item is None:
+                        closing = True
+                        break
+                    joined.append(item)
+            except queue.Empty:
+                pass
+            if not rows and not joined:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if joined:
+                    for item in joined:
+                        if item[7] is not None:
+                            item[7].start('steps')
+                    rows.extend([[start_index], num_notes, future, profile]
+                                for start_index, num_notes, _, _, future, _, _, profile in joined)
+                    inputs, hidden, temperatures, ragas = self._join(joined, inputs, hidden, temperatures, ragas)
+                with torch.no_grad():
+                    output, hidden = self.model(inputs, hidden, raga=ragas)
+                    probs = torch.softmax(output.float() / temperatures, dim=1)
+                    inputs = torch.multinomial(probs, 1)
+            except Exception as e:
+                for _, _, future, profile in rows:
+                    if profile is not None:
+                        profile.stop()
+                    future.set_exception(e)
+                rows, inputs, hidden = [], None, None
+                continue
+            if self.on_step is not None:
+                self.on_step(len(rows), time.perf_counter() - start, [start - item[5] for item in joined])
+
+            keep = []
+            for i, (row, next_index) in enumerate(zip(rows, inputs[:, 0].tolist())):
+                row[0].append(next_index)
+                row[1] -= 1
+                if row[1] == 0:
+                    if row[3] is not None:
+                        row[3].stop()
+                    row[2].set_result(row[0])
+                else:
+                    keep.append(i)
+            if not keep:
+                rows, inputs, hidden, temperatures, ragas = [], None, None, None, None
+            elif len(keep) < len(rows):
+                rows = [rows[i] for i in keep]
+                index = torch.tensor(keep, dtype=torch.long, device=self.device)
+                inputs, temperatures = inputs[index], temperatures[index]
+                hidden = tuple(state[:, index] for state in hidden)
+                ragas = None if ragas is None else ragas[index]
+
+    def _join(self, joined, inputs, hidden, temperatures, ragas):
+        """Append rows for newly joined requests to the batch tensors"""
+        count = len(joined)
+        new_inputs = torch.tensor([[item[0]] for item in joined], dtype=torch.long, device=self.device)
+        new_temperatures = torch.tensor([[item[2]] for item in joined], dtype=torch.float32, device=self.device)
+        new_ragas = None
+        if self.model.num_ragas > 0:
+            new_ragas = torch.tensor([item[3] or 0 for item in joined], dtype=torch.long, device=self.device)
+        new_hidden = self._initial_states(joined)
+        if inputs is None:
+            return new_inputs, new_hidden, new_temperatures, new_ragas
+        if new_hidden is None:
+            zeros = torch.zeros(self.model.num_layers, count, self.model.hidden_size, device=self.device)
+            new_hidden = (zeros, zeros)
+        if hidden is not None:
+            # Under bf16 autocast the running state is bf16 while new states are fp32
+            hidden = tuple(torch.cat([state, new.to(state.dtype)], dim=1) for state, new in zip(hidden, new_hidden))
+        return (torch.cat([inputs, new_inputs]), hidden, torch.cat([temperatures, new_temperatures]),
+                None if ragas is None else torch.cat([ragas, new_ragas]))
+
+    def _initial_states(self, joined):
+        """(h, c) of newly joined rows: their submitted state, else zeros; None if every row starts fresh"""
+        if all(item[6] is None for item in joined):
+            return None
+        zeros = torch.zeros(self.model.num_layers, 1, self.model.hidden_size, device=self.device)
+        return tuple(torch.cat([zeros if item[6] is None else item[6][i] for item in joined], dim=1)
+                     for i in range(2))
+
+
+_live_batchers = weakref.WeakSet()
+
+
+@atexit.register
+def _stop_batchers():
+    # Torch aborts the process if it is torn down under a running batcher thread
+    for batcher in list(_live_batchers):
+        batcher.close()
+        batcher._thread.join(timeout=5)
+
+
+def generate_notes(model, int_to_note, num_notes, temperature=1.0, device='cpu', start_index=None):
+    """Generate a note-name sequence, starting from a random vocabulary entry unless one is given"""
+    if start_index is None:
+        start_index = np.random.randint(0, len(int_to_note))
+    indices = [start_index]
+    indices.extend(iter_generate(model, start_index, num_notes, temperature, device))
+    return [int_to_note[idx] for idx in indices]
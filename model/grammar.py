@@ -0,0 +1,178 @@
+import numpy as np
+from data.swara_codec import note_to_midi, pitch_classes
+
+# Multiplier of the polynomial n-gram hash; exact (collision-free) for MIDI pitches up to 9-grams
+_HASH_BASE = 131
+
+
+def pitch_table(int_to_note):
+    """MIDI pitch of every vocabulary index (-1 for tokens that are not notes), for fancy indexing"""
+    table = np.full(len(int_to_note), -1, dtype=np.int64)
+    for i, token in int_to_note.items():
+        try:
+            table[i] = note_to_midi(token)
+        except ValueError:
+            pass
+    return table
+
+
+def _flatten(sequences):
+    """(pitches, lengths) of a 2-D array or a list of 1-D sequences"""
+    if isinstance(sequences, np.ndarray) and sequences.ndim == 2:
+        return sequences.astype(np.int64).reshape(-1), np.full(len(sequences), sequences.shape[1])
+    arrays = [np.asarray(s, dtype=np.int64).reshape(-1) for s in sequences]
+    if not arrays:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(arrays), np.array([len(a) for a in arrays])
+
+
+def _rate(count, total):
+    return float(count / total) if total else None
+
+
+class GrammarScorer:
+    """Vectorized raga-grammar metrics for batches of MIDI pitch sequences.
+
+    The grammar of each raga is its arohanam and avarohanam (e.g. from
+    raga-swaras.json via RagaIndex): a note is out of scale if its pitch class
+    is in neither, an ascending move must land on an arohanam swara and a
+    descending move on an avarohanam swara. Novelty is the share of n-grams
+    not found in an index of hashed training n-grams.
+
+    Sequences are scored together: they are concatenated once and every metric
+    is a handful of array operations over all notes, moves and n-grams.
+    """
+
+    def __init__(self, names, arohanams, avarohanams, tonic=60, ngram=4):
+        if not 1 <= ngram <= 9:
+            raise ValueError('ngram must be between 1 and 9')
+        self.names = list(names)
+        self.tonic = tonic
+        self.ngram = ngram
+        self.ascending = np.zeros((len(self.names), 12), dtype=bool)
+        self.descending = np.zeros((len(self.names), 12), dtype=bool)
+        for i, (arohanam, avarohanam) in enumerate(zip(arohanams, avarohanams)):
+            self.ascending[i, pitch_classes(arohanam)] = True
+            self.descending[i, pitch_classes(avarohanam)] = True
+        self.scale = self.ascending | self.descending
+        self._positions = {name.lower(): i for i, name in enumerate(self.names)}
+        self._powers = np.array([pow(_HASH_BASE, k, 1 << 64) for k in range(ngram - 1, -1, -1)], dtype=np.uint64)
+        self.ngram_index = np.empty(0, dtype=np.uint64)
+
+    @classmethod
+    def from_raga_index(cls, index, **kwargs):
+        return cls(index.names, index.arohanams, index.avarohanams, **kwargs)
+
+    def positions(self, ragas):
+        """Grammar rows for raga names (or row numbers, passed through); -1 for unknown ragas"""
+        return np.array([r if isinstance(r, (int, np.integer)) else self._positions.get(str(r).lower(), -1)
+                         for r in ragas], dtype=np.int64)
+
+    def positions_for_ids(self, raga_to_int):
+        """Lookup array from conditioning raga IDs (DataProcessor.raga_to_int) to grammar rows"""
+        table = np.full(max(raga_to_int.values(), default=0) + 1, -1, dtype=np.int64)
+        for name, raga_id in raga_to_int.items():
+            table[raga_id] = self._positions.get(name.lower(), -1)
+        return table
+
+    def _ngram_hashes(self, pitches, segments):
+        """Hash of every n-gram lying within one sequence, and the index of its last note"""
+        n = self.ngram
+        if len(pitches) < n:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+        windows = np.lib.stride_tricks.sliding_window_view(pitches.astype(np.uint64), n)
+        ends = np.arange(n - 1, len(pitches))
+        inside = (segments[:len(segments) - n + 1] == segments[n - 1:]) & (windows.min(axis=1) < (1 << 63))
+        # uint64 products and sums wrap around, which is the hash's modulus
+        return (windows[inside] * self._powers).sum(axis=1), ends[inside]
+
+    def index_ngrams(self, sequences):
+        """Add the n-grams of training sequences to the novelty index"""
+        pitches, lengths = _flatten(sequences)
+        segments = np.repeat(np.arange(len(lengths)), lengths)
+        hashes, _ = self._ngram_hashes(pitches, segments)
+        self.ngram_index = np.union1d(self.ngram_index, hashes)
+        return len(self.ngram_index)
+
+    def score(self, sequences, ragas, context=0, per_sequence=False):
+        """Grammar metrics over MIDI pitch sequences, each with its target raga.
+
+        The first `context` notes of every sequence (e.g. a prompt) are not
+        scored themselves but still count as the origin of moves and n-grams
+        ending after them. Sequences of unknown ragas (-1) only count towards
+        novelty and range. Rates are over all scored notes, moves or n-grams;
+        with `per_sequence` the per-sequence rates are returned as arrays too.
+        """
+        pitches, lengths = _flatten(sequences)
+        if isinstance(ragas, np.ndarray) and np.issubdtype(ragas.dtype, np.integer):
+            rows = ragas.astype(np.int64)
+        else:
+            rows = self.positions(ragas)
+        num_sequences = len(lengths)
+        segments = np.repeat(np.arange(num_sequences), lengths)
+        offset_in_sequence = np.arange(len(pitches)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        note_rows = rows[segments]
+        pcs = (pitches - self.tonic) % 12
+        scored = (offset_in_sequence >= context) & (pitches >= 0)
+        graded = scored & (note_rows >= 0)
+
+        # Notes outside the raga's scale
+        out_of_scale = graded & ~self.scale[note_rows, pcs]
+
+        # Moves: ascending ones must land on an arohanam swara, descending ones on an avarohanam swara
+        same = (segments[1:] == segments[:-1]) & graded[1:] & (pitches[:-1] >= 0)
+        step = pitches[1:] - pitches[:-1]
+        up, down = same & (step > 0), same & (step < 0)
+        target_rows, target_pcs = note_rows[1:], pcs[1:]
+        up_violations = up & ~self.ascending[target_rows, target_pcs]
+        down_violations = down & ~self.descending[target_rows, target_pcs]
+
+        # n-grams missing from the training index
+        hashes, ends = self._ngram_hashes(pitches, segments)
+        keep = offset_in_sequence[ends] >= context
+        hashes, ends = hashes[keep], ends[keep]
+        novel = None
+        if len(self.ngram_index):
+            # The index is sorted and unique, so membership is a binary search
+            found = np.minimum(np.searchsorted(self.ngram_index, hashes), len(self.ngram_index) - 1)
+            novel = self.ngram_index[found] != hashes
+
+        # Pitch range of every non-empty sequence
+        nonempty = lengths > 0
+        starts = (np.cumsum(lengths) - lengths)[nonempty]
+        valid_pitches = np.where(pitches >= 0, pitches, np.iinfo(np.int64).max)
+        lows = np.minimum.reduceat(valid_pitches, starts) if len(starts) else np.empty(0, dtype=np.int64)
+        highs = np.maximum.reduceat(pitches, starts) if len(starts) else np.empty(0, dtype=np.int64)
+        ranges = highs - lows
+
+        moves = up | down
+        metrics = {
+            'sequences': int(num_sequences),
+            'graded_sequences': int((rows >= 0).sum()),
+            'notes': int(scored.sum()),
+            'out_of_scale_rate': _rate(out_of_scale.sum(), graded.sum()),
+            'direction_violation_rate': _rate(up_violations.sum() + down_violations.sum(), moves.sum()),
+            'arohana_violation_rate': _rate(up_violations.sum(), up.sum()),
+            'avarohana_violation_rate': _rate(down_violations.sum(), down.sum()),
+            'ngram_novelty': _rate(novel.sum(), len(novel)) if novel is not None else None,
+            'pitch_range_mean': float(ranges.mean()) if len(ranges) else None,
+            'pitch_range_max': int(ranges.max()) if len(ranges) else None,
+            'pitch_min': int(lows.min()) if len(lows) else None,
+            'pitch_max': int(highs.max()) if len(highs) else None,
+        }
+        if per_sequence:
+            def per(values, mask, index=segments):
+                counts = np.bincount(index, weights=mask, minlength=num_sequences)
+                totals = np.bincount(index, weights=None if values is None else values, minlength=num_sequences)
+                return np.divide(counts, totals, out=np.full(num_sequences, np.nan), where=totals > 0)
+
+            move_segments = segments[1:]
+            range_per_sequence = np.full(num_sequences, np.nan)
+            range_per_sequence[nonempty] = ranges
+            metrics['per_sequence'] = {
+                'out_of_scale_rate': per(graded, out_of_scale),
+                'direction_violation_rate': per(moves, up_violations | down_violations, move_segments),
+                'ngram_novelty': per(None, novel, segments[ends]) if novel is not None else None,
+                'pitch_range': range_per_sequence,
+            }
+        return metrics
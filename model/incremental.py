@@ -0,0 +1,180 @@
+"""Incremental sliding-window generation for window-conditioned models.
+
+A naive window generator reruns the model over its whole input window for
+every new token and shifts the window with a concatenation, so each token
+costs O(window) compute and allocation. The steppers here consume one token
+per step instead: recurrent state is carried from step to step, and the
+window lives in a preallocated ring buffer that is overwritten in place.
+
+`DeepRagaStepper` keeps the attention keys and values of the window's LSTM
+outputs, projected once as they are produced, so while the sequence fits in
+the window its outputs match running DeepRagaModel over the whole sequence.
+Beyond that, the LSTM state still summarises everything seen so far, where a
+rerun window would start from a zero state at its first note.
+`KerasLSTMStepper` does the same for the Keras BasicRaagaModel by stepping
+its LSTM cells.
+"""
+import math
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class RingBuffer:
+    """The last `capacity` rows written, in preallocated storage (a numpy array or torch tensor).
+
+    `append` overwrites the oldest row in place. `rows()` is a view in
+    storage order, enough for order-free consumers such as attention without
+    positional encoding; `ordered()` gathers them oldest first.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.capacity = storage.shape[0]
+        self.count = 0  # Rows written since the last reset
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def reset(self):
+        self.count = 0
+
+    def append(self, row):
+        self.storage[self.count % self.capacity] = row
+        self.count += 1
+
+    def extend(self, rows):
+        rows = rows[-self.capacity:]
+        for row in rows:
+            self.append(row)
+
+    def rows(self):
+        return self.storage[:len(self)]
+
+    def ordered(self):
+        if self.count <= self.capacity:
+            return self.storage[:self.count]
+        index = (np.arange(self.capacity) + self.count) % self.capacity
+        return self.storage[index]
+
+
+class DeepRagaStepper:
+    """Steps a DeepRagaModel one note at a time over a sliding attention window.
+
+    `prime(indices)` consumes a prompt and `step(index)` one more note; both
+    return the next-note logits, shape (vocab_size,). Each step runs the LSTM
+    on the new note only, projects its output to one attention key and value,
+    and attends over the last `window` of them.
+    """
+
+    def __init__(self, model, window, raga=None, device='cpu'):
+        self.model = model
+        self.window = window
+        self.device = device
+        self.raga = None
+        if raga is not None and model.num_ragas > 0:
+            self.raga = torch.tensor([raga], dtype=torch.long, device=device)
+        self.keys = RingBuffer(torch.zeros(window, model.hidden_size, device=device))
+        self.values = RingBuffer(torch.zeros(window, model.hidden_size, device=device))
+        self.hidden = None
+        attention = model.attention
+        self.num_heads = attention.num_heads
+        self.head_dim = model.hidden_size // attention.num_heads
+        self.weights = attention.in_proj_weight.chunk(3)
+        self.biases = attention.in_proj_bias.chunk(3)
+
+    def reset(self):
+        self.keys.reset()
+        self.values.reset()
+        self.hidden = None
+
+    def prime(self, indices):
+        """Start over from a prompt of note indices"""
+        self.reset()
+        with torch.no_grad():
+            x = torch.as_tensor(indices, dtype=torch.long, device=self.device).view(1, -1)
+            lstm_out, self.hidden = self.model.encode(x, None, raga=self.raga)
+            return self._predict(lstm_out[0, -self.keys.capacity:])
+
+    def step(self, index):
+        with torch.no_grad():
+            x = torch.tensor([[int(index)]], dtype=torch.long, device=self.device)
+            lstm_out, self.hidden = self.model.encode(x, self.hidden, raga=self.raga)
+            return self._predict(lstm_out[0])
+
+    def _predict(self, outputs):
+        """Append the keys and values of new LSTM outputs (n, hidden_size); logits after the last one"""
+        self.keys.extend(F.linear(outputs, self.weights[1], self.biases[1]))
+        self.values.extend(F.linear(outputs, self.weights[2], self.biases[2]))
+        # Same computation as nn.MultiheadAttention for a single query; it has
+        # no positional encoding, so the ring buffer's order does not matter
+        query = F.linear(outputs[-1], self.weights[0], self.biases[0]).view(self.num_heads, self.head_dim)
+        keys = self.keys.rows().view(-1, self.num_heads, self.head_dim)
+        values = self.values.rows().view(-1, self.num_heads, self.head_dim)
+        scores = torch.einsum('hd,nhd->hn', query, keys) / math.sqrt(self.head_dim)
+        context = torch.einsum('hn,nhd->hd', torch.softmax(scores, dim=-1), values).reshape(1, -1)
+        model = self.model
+        attn_output = model.attention.out_proj(context)
+        return model.fc2(model.dropout(model.relu(model.fc1(attn_output))))[0]
+
+
+class KerasLSTMStepper:
+    """Steps a Keras BasicRaagaModel one frame at a time through its LSTM cells.
+
+    `prime(frames)` consumes a prompt of input frames, shape (steps,
+    input_dim), and `step(frame)` one more; both return the output frame.
+    Each step costs one cell update per layer whatever the window length.
+    The last `window` input frames are kept in a ring buffer (`window_frames`).
+    The model must be built or loaded; a loaded model's own layers are used.
+    """
+
+    def __init__(self, model, window):
+        import tensorflow as tf
+        self.tf = tf
+        keras_model = getattr(model, 'model', model)
+        self.lstm_layers = [layer for layer in keras_model.layers if isinstance(layer, tf.keras.layers.LSTM)]
+        self.output_layer = keras_model.layers[-1]
+        self.frames = RingBuffer(np.zeros((window, keras_model.input_shape[-1]), dtype=np.float32))
+        self.states = None
+
+    def reset(self):
+        self.frames.reset()
+        self.states = [[self.tf.zeros((1, layer.units)), self.tf.zeros((1, layer.units))]
+                       for layer in self.lstm_layers]
+
+    def prime(self, frames):
+        """Start over from a prompt of input frames"""
+        self.reset()
+        output = None
+        for frame in frames:
+            output = self.step(frame)
+        return output
+
+    def step(self, frame):
+        if self.states is None:
+            self.reset()
+        frame = np.asarray(frame, dtype=np.float32)
+        self.frames.append(frame)
+        x = self.tf.convert_to_tensor(frame[None])
+        for i, layer in enumerate(self.lstm_layers):
+            x, self.states[i] = layer.cell(x, self.states[i], training=False)
+        return self.output_layer(x)[0].numpy()
+
+    def window_frames(self):
+        """The last `window` input frames, oldest first"""
+        return self.frames.ordered()
+
+
+def generate(stepper, prompt, num_steps, choose):
+    """Run a stepper from `prompt` for `num_steps`, feeding back `choose(output)` as the next input.
+
+    Returns the list of chosen inputs, e.g. note indices for DeepRagaStepper
+    with `choose=lambda logits: int(logits.argmax())`.
+    """
+    output = stepper.prime(prompt)
+    chosen = []
+    for i in range(num_steps):
+        chosen.append(choose(output))
+        if i < num_steps - 1:
+            output = stepper.step(chosen[-1])
+    return chosen
@@ -2,16 +2,23 @@ import torch
 import torch.nn as nn
 
 class DeepRagaModel(nn.Module):
-    def __init__(self, vocab_size, embedding_dim, hidden_size, num_layers, dropout=0.3):
+    def __init__(self, vocab_size, embedding_dim, hidden_size, num_layers, dropout=0.3,
+                 num_ragas=0, raga_embedding_dim=16):
         super(DeepRagaModel, self).__init__()
         self.hidden_size = hidden_size
         self.num_layers = num_layers
+        self.num_ragas = num_ragas
         
         # Embedding layer
         self.embedding = nn.Embedding(vocab_size, embedding_dim)
         
+        # Raga embedding (ID 0 = unknown raga) appended to every note embedding;
+        # with num_ragas=0 the model is unconditioned
+        self.raga_embedding = nn.Embedding(num_ragas, raga_embedding_dim) if num_ragas > 0 else None
+        lstm_input_size = embedding_dim + (raga_embedding_dim if num_ragas > 0 else 0)
+        
         # LSTM layers
-        self.lstm = nn.LSTM(embedding_dim, hidden_size, num_layers, 
+        self.lstm = nn.LSTM(lstm_input_size, hidden_size, num_layers, 
                            batch_first=True, dropout=dropout)
         
         # Attention mechanism
@@ -23,16 +30,27 @@ class DeepRagaModel(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.fc2 = nn.Linear(hidden_size, vocab_size)
         
-    def forward(self, x, hidden=None):
-        # x shape: (batch_size, seq_len)
+    def encode(self, x, hidden=None, raga=None):
+        """Embeddings and LSTM only: (lstm_out, hidden) after consuming `x`, e.g. to prefill a prompt"""
+        # x shape: (batch_size, seq_len); raga shape: (batch_size,), one raga ID per row
         
         # Embed input
         # shape: (batch_size, seq_len, embedding_dim)
         embedded = self.embedding(x)
         
+        if self.raga_embedding is not None:
+            if raga is None:
+                raga = torch.zeros(x.shape[0], dtype=torch.long, device=x.device)
+            # shape: (batch_size, seq_len, embedding_dim + raga_embedding_dim)
+            raga_embedded = self.raga_embedding(raga).unsqueeze(1).expand(-1, x.shape[1], -1)
+            embedded = torch.cat([embedded, raga_embedded], dim=2)
+        
         # Forward propagate LSTM
         # lstm_out shape: (batch_size, seq_len, hidden_size)
-        lstm_out, hidden = self.lstm(embedded, hidden)
+        return self.lstm(embedded, hidden)
+        
+    def forward(self, x, hidden=None, raga=None):
+        lstm_out, hidden = self.encode(x, hidden, raga)
         
         # Apply attention mechanism
         # attn_output shape: (batch_size, seq_len, hidden_size)
@@ -0,0 +1,106 @@
+"""bfloat16 mixed precision for training and inference.
+
+Under `autocast('bf16')` matrix multiplies (the LSTM, attention and dense
+layers) run in bfloat16 while parameters, gradients and optimizer state stay
+in float32, so no loss scaling is needed. CPUs only gain from it with native
+bf16 units (AVX512-BF16 or AMX); elsewhere 'auto' keeps float32.
+"""
+import os
+import warnings
+import contextlib
+import torch
+import torch.nn.functional as F
+
+PRECISIONS = ('auto', 'bf16', 'fp32')
+
+
+def _cpu_flags():
+    """Feature flags of the CPU from /proc/cpuinfo, or None where it is unavailable"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return None
+
+
+def bf16_supported(device='cpu', native=True):
+    """Whether `device` can run bf16 kernels; with `native`, only if a CPU has bf16 units"""
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    try:
+        if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            return False
+    except (AttributeError, RuntimeError):
+        return False
+    if not native:
+        return True
+    flags = _cpu_flags()
+    # Without /proc/cpuinfo (e.g. macOS, Windows) trust oneDNN's own check
+    return flags is None or bool(flags & {'avx512_bf16', 'amx_bf16'})
+
+
+def resolve_precision(precision='auto', device='cpu'):
+    """'bf16' or 'fp32' for a requested precision.
+
+    'auto' picks bf16 on hardware with native bf16 support. An explicit
+    'bf16' also runs on CPUs that only emulate it, and falls back to fp32
+    with a warning where bf16 kernels are missing altogether.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {', '.join(PRECISIONS)}, got {precision!r}")
+    if precision == 'fp32':
+        return 'fp32'
+    if bf16_supported(device, native=precision == 'auto'):
+        return 'bf16'
+    if precision == 'bf16':
+        warnings.warn(f'bf16 is not supported on {device}; falling back to fp32')
+    return 'fp32'
+
+
+def precision_from_env(device='cpu', default='auto'):
+    """Resolved precision requested by DEEPRAAGA_PRECISION"""
+    return resolve_precision(os.environ.get('DEEPRAAGA_PRECISION', default), device)
+
+
+def autocast(precision, device='cpu'):
+    """Context running eligible ops in bfloat16 for precision 'bf16'; a no-op for 'fp32'"""
+    if precision != 'bf16':
+        return contextlib.nullcontext()
+    return torch.autocast(torch.device(device).type, dtype=torch.bfloat16)
+
+
+def compare_precisions(model, loader, device='cpu', max_batches=None):
+    """Validation loss and next-note distributions of `model` in fp32 and under bf16 autocast.
+
+    `loader` yields RagaDataset batches. Returns both losses, the mean
+    KL divergence and total variation distance from the fp32 next-note
+    distribution to the bf16 one, and how often their top notes agree.
+    """
+    was_training = model.training
+    model.eval()
+    totals = {'fp32_loss': 0.0, 'bf16_loss': 0.0, 'kl': 0.0, 'tv': 0.0, 'top1_agreement': 0.0}
+    count = 0
+    with torch.no_grad():
+        for i, batch in enumerate(loader):
+            if max_batches is not None and i >= max_batches:
+                break
+            sequences = batch['sequence'].to(device)
+            targets = batch['target'].to(device)
+            ragas = batch['raga'].to(device)
+            reference, _ = model(sequences, raga=ragas)
+            with autocast('bf16', device):
+                mixed, _ = model(sequences, raga=ragas)
+            mixed = mixed.float()
+            log_p, log_q = F.log_softmax(reference, dim=1), F.log_softmax(mixed, dim=1)
+            totals['fp32_loss'] += F.cross_entropy(reference, targets, reduction='sum').item()
+            totals['bf16_loss'] += F.cross_entropy(mixed, targets, reduction='sum').item()
+            totals['kl'] += (log_p.exp() * (log_p - log_q)).sum().item()
+            totals['tv'] += 0.5 * (log_p.exp() - log_q.exp()).abs().sum().item()
+            totals['top1_agreement'] += (reference.argmax(1) == mixed.argmax(1)).sum().item()
+            count += len(targets)
+    model.train(was_training)
+    return {key: value / count for key, value in totals.items()} if count else None
@@ -1,6 +1,9 @@
 import json
 import numpy as np
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data.swara_codec import encode_corpus, codes_to_midi, to_midi
 
 def load_raga_data(json_path):
     """Load and parse the raga-swaras.json file"""
@@ -8,39 +11,9 @@ def load_raga_data(json_path):
         data = json.load(f)
     return data['ragas']
 
-def swara_to_midi(swara):
-    """Convert Carnatic swara to MIDI note number"""
-    # Base MIDI note number for Sa (C4)
-    base_note = 60
-    
-    # Swara to semitone mapping
-    swara_map = {
-        'S': 0,  # Sa
-        'R1': 1, # Suddha Rishabham
-        'R2': 2, # Chatusruti Rishabham
-        'G1': 2, # Suddha Gandharam
-        'G2': 3, # Sadharana Gandharam
-        'G3': 4, # Antara Gandharam
-        'M1': 5, # Suddha Madhyamam
-        'M2': 6, # Prati Madhyamam
-        'P': 7,  # Panchamam
-        'D1': 8, # Suddha Dhaivatam
-        'D2': 9, # Chatusruti Dhaivatam
-        'D3': 10, # Shatsruti Dhaivatam
-        'N1': 10, # Suddha Nishadam
-        'N2': 11, # Kaisiki Nishadam
-        'N3': 12, # Kakali Nishadam
-        "S'": 12  # Upper Sa
-    }
-    
-    # Remove any whitespace and handle upper octave notation
-    swara = swara.strip()
-    return base_note + swara_map.get(swara, 0)
-
 def convert_pattern_to_midi(pattern):
-    """Convert a swara pattern to MIDI note numbers"""
-    swaras = pattern.split()
-    return [swara_to_midi(swara) for swara in swaras]
+    """Convert a swara pattern to MIDI note numbers (Sa = C4)"""
+    return to_midi(pattern).tolist()
 
 def create_raga_features(raga):
     """Create feature vector for a raga from its ascending and descending patterns"""
@@ -65,18 +38,16 @@ def preprocess_ragas(json_path, output_dir):
     """Preprocess all ragas and save as numpy arrays"""
     ragas = load_raga_data(json_path)
     
-    # Create features for each raga
-    midi_features = []
-    labels = []
-    
-    for i, raga in enumerate(ragas):
-        feature = create_raga_features(raga)
-        midi_features.append(feature)
-        labels.append(i)
-    
-    # Convert to numpy arrays
-    midi_features = np.array(midi_features)
-    labels = np.array(labels)
+    # Encode every raga's arohanam + avarohanam in one pass and pad/truncate
+    # each to the fixed feature length
+    target_length = 128  # Match the input_size in train.py
+    codes, offsets = encode_corpus([f"{r['ascending']} {r['descending']}" for r in ragas])
+    lengths = np.minimum(np.diff(offsets), target_length)
+    midi_features = np.zeros((len(ragas), target_length), dtype=np.float32)
+    rows = np.repeat(np.arange(len(ragas)), lengths)
+    cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    midi_features[rows, cols] = codes_to_midi(codes[offsets[rows] + cols])
+    labels = np.arange(len(ragas))
     
     # Create processed directory if it doesn't exist
     processed_dir = os.path.join(output_dir, 'processed')
@@ -0,0 +1,379 @@
+import os
+import json
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from .audio_features import FMAX, FMIN, VOICING_FLOOR_DB
+from .raga_index import DEFAULT_SWARAS_JSON, PROFILE_SIZE, sequence_profile
+from .tonic import tonic_candidates
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'raga_classifier.npz')
+MIN_NOTE_FRAMES = 4  # Frames a semitone must be held to count as a note
+# Labelled recordings (raga-<name>-....mp3) whose pitch tracks train the classifier next to the scale rows
+RECORDINGS_DIR = os.path.dirname(DEFAULT_SWARAS_JSON)
+TRACKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'data', 'processed', 'raga_classifier_tracks')
+# Recording names that differ from the class names in raga-swaras.json
+RECORDING_ALIASES = {'karaharapriya': 'Kharaharapriya', 'thodi': 'Hanumatodi', 'kalyani': 'Mechakalyani'}
+EXCERPT_FRAMES = 256  # About 6 s of pitch frames per audio training excerpt
+EXCERPT_HOP = 43      # About 1 s between excerpts
+AUDIO_REPEATS = 10    # Weight of each audio excerpt; every scale row yields 201 samples
+
+
+def midi_row_features(row, tonic=60):
+    """Features of one padded row of raga_midi_features.npy (0 marks padding)"""
+    notes = row[row > 0].astype(np.int64)
+    return sequence_profile((notes - tonic) % 12)
+
+
+def pitch_track_notes(f0, tonic_hz, min_frames=MIN_NOTE_FRAMES):
+    """Collapse an f0 contour into the pitch classes of its held notes.
+
+    Frames are rounded to the nearest semitone above Sa; runs shorter than
+    `min_frames` (glides, gamaka transits) and unvoiced frames are dropped.
+    """
+    f0 = np.asarray(f0, dtype=np.float64)
+    voiced = f0 > 0
+    semitones = np.full(len(f0), -1, dtype=np.int64)
+    semitones[voiced] = np.round(12 * np.log2(f0[voiced] / tonic_hz)).astype(np.int64) % 12
+    if len(semitones) == 0:
+        return semitones
+    boundaries = np.flatnonzero(np.diff(semitones)) + 1
+    starts = np.concatenate([[0], boundaries])
+    lengths = np.diff(np.concatenate([starts, [len(semitones)]]))
+    notes = semitones[starts][(lengths >= min_frames) & (semitones[starts] >= 0)]
+    # Merge repeats left behind by the dropped runs
+    return notes[np.concatenate([[True], notes[1:] != notes[:-1]])] if len(notes) else notes
+
+
+def pitch_track_features(f0):
+    """Tonic-normalized note profile of an f0 contour, or None if no tonic is found"""
+    candidates = tonic_candidates(f0, num_candidates=1)
+    if not candidates:
+        return None
+    return sequence_profile(pitch_track_notes(f0, candidates[0][0]))
+
+
+def _augment(notes, rng, num_samples):
+    """Random contiguous excerpts of a note sequence with occasional dropped notes"""
+    samples = []
+    for _ in range(num_samples):
+        length = rng.integers(max(2, len(notes) // 2), len(notes) + 1)
+        start = rng.integers(0, len(notes) - length + 1)
+        excerpt = notes[start:start + length]
+        keep = rng.random(len(excerpt)) > 0.1
+        samples.append(sequence_profile(excerpt[keep] if keep.sum() > 1 else excerpt))
+    return samples
+
+
+def recording_label(path):
+    """Class name of a recording such as raga-kapi-arohanam_avarohanam.mp3"""
+    raga = os.path.basename(path).split('-')[1].split('_')[0]
+    return RECORDING_ALIASES.get(raga, raga.capitalize())
+
+
+def load_recordings(audio_dir=RECORDINGS_DIR, tracks_dir=TRACKS_DIR):
+    """(label, f0) of every recording in `audio_dir`, pitch-tracked once into `tracks_dir`"""
+    from .audio_features import (AUDIO_EXTENSIONS, INDEX_FILENAME, extract_pitch_tracks, file_pitch_track,
+                                 load_pitch_tracks)
+    paths = sorted(os.path.join(audio_dir, f) for f in os.listdir(audio_dir)
+                   if f.lower().endswith(AUDIO_EXTENSIONS))
+    index_path = os.path.join(tracks_dir, INDEX_FILENAME)
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            tracked = [entry['path'] for entry in json.load(f)['files']]
+    else:
+        tracked = None
+    if tracked != paths:
+        extract_pitch_tracks(paths, tracks_dir)
+    tracks, index = load_pitch_tracks(tracks_dir)
+    return [(recording_label(entry['path']), np.asarray(file_pitch_track(tracks, entry), dtype=np.float32))
+            for entry in index['files']]
+
+
+def recording_profiles(f0, frames=EXCERPT_FRAMES, hop=EXCERPT_HOP):
+    """Profiles of overlapping excerpts of one recording, read on the recording's own tonic"""
+    candidates = tonic_candidates(f0, num_candidates=1)
+    if not candidates:
+        return []
+    tonic_hz = candidates[0][0]
+    return [sequence_profile(pitch_track_notes(f0[start:start + frames], tonic_hz))
+            for start in range(0, max(len(f0) - frames, 0) + 1, hop)]
+
+
+class RagaClassifier:
+    """Multinomial logistic regression over pitch-class/transition profiles.
+
+    `validation` holds the held-out accuracy measured when the classifier was
+    fitted ({'accuracy', 'chance', 'excerpts'}), or None if it never was.
+    """
+
+    def __init__(self, weights, bias, class_names, validation=None):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.class_names = list(class_names)
+        self.validation = validation
+
+    @classmethod
+    def train(cls, features_path, labels_path, swaras_json=DEFAULT_SWARAS_JSON, recordings=None,
+              samples_per_class=200, audio_repeats=AUDIO_REPEATS, epochs=300, learning_rate=0.5, seed=0):
+        """Fit on raga_midi_features.npy / raga_labels.npy with excerpt augmentation.
+
+        `recordings` are (label, f0) pairs, e.g. from load_recordings; the
+        profiles of their excerpts are added as audio training samples, and
+        labels missing from raga-swaras.json become extra classes.
+        """
+        rows = np.load(features_path)
+        labels = np.load(labels_path)
+        with open(swaras_json, 'r') as f:
+            class_names = [r['name'] for r in json.load(f)['ragas']]
+
+        rng = np.random.default_rng(seed)
+        X, y = [], []
+        for row, label in zip(rows, labels):
+            notes = (row[row > 0].astype(np.int64) - 60) % 12
+            X.append(sequence_profile(notes))
+            X.extend(_augment(notes, rng, samples_per_class))
+            y.extend([label] * (samples_per_class + 1))
+        for label, f0 in recordings or []:
+            if label not in class_names:
+                class_names.append(label)
+            profiles = recording_profiles(f0)
+            X.extend(profiles * audio_repeats)
+            y.extend([class_names.index(label)] * (len(profiles) * audio_repeats))
+        X = np.stack(X)
+        y = np.asarray(y)
+
+        num_classes = len(class_names)
+        weights = np.zeros((PROFILE_SIZE, num_classes), dtype=np.float32)
+        bias = np.zeros(num_classes, dtype=np.float32)
+        targets = np.eye(num_classes, dtype=np.float32)[y]
+        for _ in range(epochs):
+            probs = _softmax(X @ weights + bias)
+            grad = (probs - targets) / len(X)
+            weights -= learning_rate * (X.T @ grad + 1e-4 * weights)
+            bias -= learning_rate * grad.sum(axis=0)
+        return cls(weights, bias, class_names)
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        np.savez(path, weights=self.weights, bias=self.bias, class_names=np.array(self.class_names),
+                 validation=np.array(json.dumps(self.validation)))
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        data = np.load(path)
+        validation = json.loads(str(data['validation'])) if 'validation' in data.files else None
+        return cls(data['weights'], data['bias'], data['class_names'].tolist(), validation)
+
+    @property
+    def validated(self):
+        """True if the held-out accuracy measured at fit time beats chance"""
+        return bool(self.validation) and self.validation['accuracy'] > self.validation['chance']
+
+    def predict_proba(self, features):
+        """Class probabilities for a (batch, PROFILE_SIZE) feature matrix"""
+        return _softmax(np.atleast_2d(features) @ self.weights + self.bias)
+
+    def top_k(self, probs, k=5):
+        order = np.argsort(-probs)[:k]
+        return [{'raga': self.class_names[i], 'probability': float(probs[i])} for i in order]
+
+
+def held_out_accuracy(features_path, labels_path, recordings, num_blocks=3, frames=EXCERPT_FRAMES,
+                      hop=EXCERPT_HOP, **train_kwargs):
+    """Top-1 accuracy on recording excerpts the classifier did not see in training.
+
+    Every recording is cut into `num_blocks` contiguous blocks. For each block
+    a classifier is fitted on the scale rows and the other blocks, then it
+    classifies the excerpts inside the block as /api/classify would, with the
+    tonic estimated from the excerpt alone. The blocks come from the same
+    recordings, so this measures unseen passages rather than unseen singers.
+
+    Returns:
+        {'accuracy', 'chance' (1 / number of classes), 'excerpts'}
+    """
+    correct = total = 0
+    num_classes = None
+    for block in range(num_blocks):
+        train_recordings, tests = [], []
+        for label, f0 in recordings:
+            lo, hi = block * len(f0) // num_blocks, (block + 1) * len(f0) // num_blocks
+            train_recordings += [(label, f0[:lo]), (label, f0[hi:])]
+            tests += [(label, f0[start:start + frames]) for start in range(lo, hi - frames + 1, hop)]
+        classifier = RagaClassifier.train(features_path, labels_path, recordings=train_recordings, **train_kwargs)
+        num_classes = len(classifier.class_names)
+        for label, f0 in tests:
+            features = pitch_track_features(f0)
+            predicted = None
+            if features is not None:
+                probs = classifier.predict_proba(features)[0]
+                predicted = classifier.class_names[int(np.argmax(probs))]
+            correct += predicted == label
+            total += 1
+    return {'accuracy': correct / total if total else 0.0, 'chance': 1.0 / num_classes, 'excerpts': total}
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class AudioTooLong(ValueError):
+    """The stream holds more audio than StreamingWavFeatures accepts"""
+
+
+class StreamingWavFeatures:
+    """Incrementally decodes a WAV byte stream and pitch-tracks it as it arrives.
+
+    Bytes can be fed in arbitrary chunks (e.g. straight from an upload); each
+    complete block of samples is tracked with YIN immediately, so only the
+    tonic estimate and the final profile are left when the stream ends.
+    Streams longer than `max_seconds` raise AudioTooLong.
+    """
+
+    def __init__(self, block_seconds=2.0, max_seconds=None):
+        self.block_seconds = block_seconds
+        self.max_seconds = max_seconds
+        self._num_samples = 0
+        self._buffer = bytearray()
+        self._format = None
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._f0 = []
+
+    def _parse_header(self):
+        """Consume RIFF chunks up to 'data'; returns False until enough bytes arrived"""
+        if len(self._buffer) < 12:
+            return False
+        if self._buffer[:4] != b'RIFF' or self._buffer[8:12] != b'WAVE':
+            raise ValueError('Expected a WAV (RIFF/WAVE) stream; other formats such as mp3 are not supported')
+        pos = 12
+        fmt = None
+        while len(self._buffer) >= pos + 8:
+            chunk_id, size = struct.unpack_from('<4sI', self._buffer, pos)
+            if chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError('WAV data chunk before fmt chunk')
+                audio_format, channels, sample_rate, _, _, bits = fmt
+                if (audio_format, bits) not in ((1, 16), (3, 32)):
+                    raise ValueError('Only 16-bit PCM and 32-bit float WAV are supported')
+                self._format = (channels, sample_rate, np.dtype('<i2' if bits == 16 else '<f4'))
+                frame_length = 2048 if sample_rate <= 24000 else 4096
+                self._frame_length = frame_length
+                self._hop_length = frame_length // 4
+                del self._buffer[:pos + 8]
+                return True
+            if len(self._buffer) < pos + 8 + size:
+                return False
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack_from('<HHIIHH', self._buffer, pos + 8)
+            pos += 8 + size + (size & 1)
+        return False
+
+    def feed(self, chunk):
+        """Add raw bytes of the WAV stream"""
+        self._buffer.extend(chunk)
+        if self._format is None and not self._parse_header():
+            return
+        channels, sample_rate, dtype = self._format
+        frame_bytes = channels * dtype.itemsize
+        usable = len(self._buffer) - len(self._buffer) % frame_bytes
+        if usable:
+            samples = np.frombuffer(bytes(self._buffer[:usable]), dtype=dtype)
+            del self._buffer[:usable]
+            samples = samples.reshape(-1, channels).mean(axis=1).astype(np.float32)
+            self._num_samples += len(samples)
+            if self.max_seconds is not None and self._num_samples > self.max_seconds * sample_rate:
+                raise AudioTooLong(f'Audio longer than {self.max_seconds:g} seconds')
+            if dtype.kind == 'i':
+                samples /= 32768.0
+            self._pending = np.concatenate([self._pending, samples])
+        block = int(self.block_seconds * sample_rate) // self._hop_length * self._hop_length
+        while len(self._pending) >= block + self._frame_length:
+            self._track(self._pending[:block + self._frame_length - self._hop_length])
+            self._pending = self._pending[block:]
+
+    def _track(self, y):
+        import librosa
+        sample_rate = self._format[1]
+        # Same range and voicing floor as audio_features, so streamed and batch tracks agree
+        f0 = librosa.yin(y, fmin=FMIN, fmax=FMAX, sr=sample_rate, frame_length=self._frame_length,
+                         hop_length=self._hop_length, center=False)
+        rms = librosa.feature.rms(y=y, frame_length=self._frame_length, hop_length=self._hop_length,
+                                  center=False)[0]
+        self._f0.append(np.where(rms > 10 ** (VOICING_FLOOR_DB / 20), f0, 0.0).astype(np.float32))
+
+    def finish(self):
+        """Track the remaining samples and return the clip's feature vector (or None)"""
+        if self._format is None:
+            raise ValueError('Incomplete WAV header')
+        if len(self._pending) >= self._frame_length:
+            self._track(self._pending)
+        self._pending = np.zeros(0, dtype=np.float32)
+        f0 = np.concatenate(self._f0) if self._f0 else np.zeros(0, dtype=np.float32)
+        return pitch_track_features(f0)
+
+
+class MicroBatcher:
+    """Collects feature vectors from concurrent requests and classifies them together.
+
+    `submit` returns a Future; a background thread waits up to `max_wait` seconds
+    for up to `max_batch` vectors and runs one batched predict_proba over them.
+    `on_batch(batch_size, queue_seconds)`, if given, is called before each batch
+    runs with the time every request in it spent queued.
+    """
+
+    def __init__(self, classifier, max_batch=64, max_wait=0.005, on_batch=None):
+        self.classifier = classifier
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.on_batch = on_batch
+        self.batch_sizes = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, features):
+        future = Future()
+        self._queue.put((features, future, time.perf_counter()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self._queue.get(timeout=self.max_wait))
+            except queue.Empty:
+                pass
+            self.batch_sizes.append(len(batch))
+            del self.batch_sizes[:-1000]
+            if self.on_batch is not None:
+                now = time.perf_counter()
+                self.on_batch(len(batch), [now - queued for _, _, queued in batch])
+            try:
+                probs = self.classifier.predict_proba(np.stack([features for features, _, _ in batch]))
+                for (_, future, _), row in zip(batch, probs):
+                    future.set_result(row)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+
+if __name__ == '__main__':
+    processed_dir = os.path.join('data', 'processed')
+    features_path = os.path.join(processed_dir, 'raga_midi_features.npy')
+    labels_path = os.path.join(processed_dir, 'raga_labels.npy')
+    recordings = load_recordings()
+    validation = held_out_accuracy(features_path, labels_path, recordings)
+    print(f"Held-out top-1 accuracy on {validation['excerpts']} recording excerpts: "
+          f"{validation['accuracy']:.1%} (chance {validation['chance']:.1%})")
+    classifier = RagaClassifier.train(features_path, labels_path, recordings=recordings)
+    classifier.validation = validation
+    classifier.save()
+    print(f'Trained raga classifier over {len(classifier.class_names)} ragas: {DEFAULT_MODEL_PATH}')
+    if not classifier.validated:
+        print('Held-out accuracy is not above chance; the API will not serve this classifier')
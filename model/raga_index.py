@@ -0,0 +1,139 @@
+import os
+import json
+import numpy as np
+from data.melakarta_init import MELAKARTA_INDEX
+from data.swara_codec import melakarta_scale, pitch_classes
+
+DEFAULT_SWARAS_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'data', 'raw', 'Ragas-mp3', 'raga-swaras.json')
+
+PROFILE_SIZE = 12 + 12 * 12
+
+
+def sequence_profile(pitch_classes):
+    """Unit-norm vector of pitch-class frequencies followed by the 12x12 transition frequencies"""
+    pcs = np.asarray(pitch_classes, dtype=np.int64) % 12
+    profile = np.zeros(PROFILE_SIZE, dtype=np.float32)
+    if len(pcs) == 0:
+        return profile
+    profile[:12] = np.bincount(pcs, minlength=12) / len(pcs)
+    if len(pcs) > 1:
+        moves = pcs[:-1] * 12 + pcs[1:]
+        profile[12:] = np.bincount(moves, minlength=144) / (len(pcs) - 1)
+    norm = np.linalg.norm(profile)
+    return profile / norm if norm > 0 else profile
+
+
+def pitch_class_mask(pitch_classes):
+    """12-bit integer with bit p set for every pitch class present"""
+    present = np.zeros(12, dtype=bool)
+    present[np.asarray(pitch_classes, dtype=np.int64) % 12] = True
+    return int(np.dot(present, 1 << np.arange(12)))
+
+
+class RagaIndex:
+    """Precompiled scale masks and transition profiles for fast raga matching.
+
+    Each raga is stored as a 12-bit swara-set mask and a profile vector built
+    from its arohanam and avarohanam. A query is pruned to ragas whose mask is
+    a superset of the query's, then scored against all remaining profiles with
+    a single matrix-vector product.
+    """
+
+    def __init__(self, names, arohanams, avarohanams):
+        self.names = list(names)
+        self.arohanams = list(arohanams)
+        self.avarohanams = list(avarohanams)
+        sequences = [pitch_classes(a) + pitch_classes(d)
+                     for a, d in zip(arohanams, avarohanams)]
+        self.masks = np.array([pitch_class_mask(s) for s in sequences], dtype=np.uint16)
+        self.scale_bits = ((self.masks[:, None] >> np.arange(12)) & 1).astype(np.float32)
+        self.scale_sizes = self.scale_bits.sum(axis=1)
+        self.profiles = np.stack([sequence_profile(s) for s in sequences])
+        self._positions = {name.lower(): i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_sources(cls, swaras_json=DEFAULT_SWARAS_JSON):
+        """Index the ragas of raga-swaras.json plus any of the 72 Melakartas it lacks"""
+        with open(swaras_json, 'r') as f:
+            ragas = json.load(f)['ragas']
+        names = [r['name'] for r in ragas]
+        arohanams = [r['ascending'] for r in ragas]
+        avarohanams = [r['descending'] for r in ragas]
+        known = {name.lower() for name in names}
+        for number, name in MELAKARTA_INDEX.items():
+            if name.lower() not in known:
+                scale = melakarta_scale(number)
+                names.append(name)
+                arohanams.append(scale)
+                avarohanams.append(' '.join(reversed(scale.split())))
+        return cls(names, arohanams, avarohanams)
+
+    def __len__(self):
+        return len(self.names)
+
+    def position(self, name):
+        return self._positions.get(name.lower())
+
+    def identify(self, pitches, tonic=60, top_k=5, strict=True):
+        """Rank ragas for a sequence of MIDI pitches with the given Sa.
+
+        With `strict`, only ragas containing every pitch class of the query
+        are considered (falling back to all ragas if none qualify). The score
+        is the cosine similarity of the profiles plus the Jaccard overlap of
+        the swara sets, minus the share of query notes outside the raga.
+        """
+        pcs = (np.asarray(pitches, dtype=np.int64) - tonic) % 12
+        if len(pcs) == 0:
+            return []
+        query_mask = pitch_class_mask(pcs)
+        candidates = np.flatnonzero((self.masks & ~np.uint16(query_mask)) == 0) if strict else []
+        if len(candidates) == 0:
+            candidates = np.arange(len(self.names))
+
+        counts = np.bincount(pcs, minlength=12).astype(np.float32)
+        query_bits = (counts > 0).astype(np.float32)
+        bits = self.scale_bits[candidates]
+        similarity = self.profiles[candidates] @ sequence_profile(pcs)
+        overlap = bits @ query_bits
+        jaccard = overlap / (self.scale_sizes[candidates] + query_bits.sum() - overlap)
+        outside = ((1 - bits) @ counts) / len(pcs)
+        scores = similarity + jaccard - outside
+
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        return [{'raga': self.names[candidates[i]], 'score': float(scores[i])} for i in order]
+
+
+def midi_file_pitches(path):
+    """Non-drum note pitches of a MIDI file in onset order"""
+    import pretty_midi
+    midi_data = pretty_midi.PrettyMIDI(path)
+    notes = [n for inst in midi_data.instruments if not inst.is_drum for n in inst.notes]
+    notes.sort(key=lambda n: (n.start, n.pitch))
+    return [n.pitch for n in notes]
+
+
+def label_midi_tree(root, index=None, output_path=None, tonic=60, top_k=3):
+    """Rank candidate ragas for every MIDI file under `root`, optionally writing JSON"""
+    index = index or RagaIndex.from_sources()
+    labels = {}
+    for dirpath, _, files in os.walk(root):
+        for file in sorted(files):
+            if file.lower().endswith(('.mid', '.midi')):
+                path = os.path.join(dirpath, file)
+                try:
+                    labels[os.path.relpath(path, root)] = index.identify(
+                        midi_file_pitches(path), tonic=tonic, top_k=top_k)
+                except Exception as e:
+                    print(f"Error labelling {path}: {str(e)}")
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(labels, f, indent=2)
+    return labels
+
+
+if __name__ == '__main__':
+    midi_root = os.path.join('data', 'raw', 'midi')
+    output_path = os.path.join('data', 'processed', 'raga_labels.json')
+    labels = label_midi_tree(midi_root, output_path=output_path)
+    print(f'Labelled {len(labels)} MIDI files into {output_path}')
@@ -0,0 +1,435 @@
+import os
+import json
+import time
+import pickle
+import random
+import shutil
+import hashlib
+import tempfile
+import argparse
+import threading
+from concurrent.futures import Future
+from data.swara_codec import note_to_midi
+# torch and the model modules are imported where they are used, so that
+# importing the registry (and the API server) does not wait for torch
+
+DEFAULT_REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'versions')
+CURRENT_FILENAME = 'CURRENT'        # name of the version new traffic goes to
+TRAFFIC_FILENAME = 'traffic.json'   # optional {version: share} for A/B splits
+WEIGHTS_FILENAME = 'weights.pth'
+VOCAB_FILENAME = 'vocab.pkl'
+CONFIG_FILENAME = 'config.json'
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def publish_bundle(registry_dir, weights_path, vocab_path, config=None, version=None, make_current=False):
+    """Copy a checkpoint and its vocabulary into the registry as a new version.
+
+    The bundle is assembled in a temporary directory and renamed into place,
+    so watchers never see a half-written version.
+
+    Returns:
+        The version name (by default a timestamp plus the weights hash prefix).
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    sha256 = file_sha256(weights_path)
+    version = version or f"{time.strftime('%Y%m%d-%H%M%S')}-{sha256[:8]}"
+    import torch
+    from .generation import infer_hyperparameters
+    with open(vocab_path, 'rb') as f:
+        vocab_size = len(pickle.load(f)['note_to_int'])
+    hyperparameters = infer_hyperparameters(torch.load(weights_path, map_location='cpu'))
+
+    staging = tempfile.mkdtemp(prefix=f'.{version}-', dir=registry_dir)
+    shutil.copyfile(weights_path, os.path.join(staging, WEIGHTS_FILENAME))
+    shutil.copyfile(vocab_path, os.path.join(staging, VOCAB_FILENAME))
+    with open(os.path.join(staging, CONFIG_FILENAME), 'w') as f:
+        json.dump({'version': version, 'vocab_size': vocab_size, 'sha256': sha256,
+                   'created': time.time(), 'hyperparameters': {**hyperparameters, **(config or {})}}, f, indent=2)
+    os.rename(staging, os.path.join(registry_dir, version))
+    if make_current:
+        set_current(registry_dir, version)
+    return version
+
+
+def set_current(registry_dir, version):
+    """Point CURRENT at a version (atomically, for file watchers)"""
+    path = os.path.join(registry_dir, CURRENT_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        f.write(version + '\n')
+    os.replace(path + '.tmp', path)
+
+
+class ModelBundle:
+    """A loaded, warmed-up model version with its vocabulary"""
+
+    def __init__(self, version, model, note_to_int, int_to_note, config, raga_to_int=None, device='cpu'):
+        self.version = version
+        self.model = model
+        self.note_to_int = note_to_int
+        self.int_to_note = int_to_note
+        self.raga_to_int = raga_to_int or {}
+        self.config = config
+        self.device = device
+        self.loaded_at = time.time()
+        self._batcher = None
+        self._prefix_cache = None
+        self._pitch_indices = None
+        self._batcher_lock = threading.Lock()
+
+    @classmethod
+    def from_files(cls, version, weights_path, vocab_path, config=None, device='cpu'):
+        """Build and warm a bundle from a checkpoint and a DataProcessor vocabulary file"""
+        import torch
+        from .generation import infer_hyperparameters, iter_generate
+        from .model import DeepRagaModel
+        with open(vocab_path, 'rb') as f:
+            vocab = pickle.load(f)
+        state_dict = torch.load(weights_path, map_location=device)
+        config = config or {'version': version, 'vocab_size': len(vocab['note_to_int']),
+                            'hyperparameters': infer_hyperparameters(state_dict)}
+        model = DeepRagaModel(config['vocab_size'], **config['hyperparameters']).to(device)
+        model.load_state_dict(state_dict)
+        model.eval()
+        # One short generation so the first request does not pay for kernel set-up
+        list(iter_generate(model, 0, 2, device=device))
+        return cls(version, model, vocab['note_to_int'], vocab['int_to_note'], config,
+                   vocab.get('raga_to_int'), device)
+
+    @classmethod
+    def load(cls, bundle_dir, device='cpu'):
+        """Load a registry bundle, checking its weights against the recorded hash"""
+        with open(os.path.join(bundle_dir, CONFIG_FILENAME), 'r') as f:
+            config = json.load(f)
+        weights_path = os.path.join(bundle_dir, WEIGHTS_FILENAME)
+        if config.get('sha256') and file_sha256(weights_path) != config['sha256']:
+            raise ValueError(f"Weights of {config['version']} do not match their recorded hash")
+        return cls.from_files(config['version'], weights_path, os.path.join(bundle_dir, VOCAB_FILENAME),
+                              config, device)
+
+    def raga_id(self, raga):
+        """Conditioning ID of a raga name; 0 (unknown) for names the model was not trained on"""
+        raga_id = self.raga_to_int.get(str(raga).lower(), 0) if raga else 0
+        return raga_id if raga_id < self.model.num_ragas else 0
+
+    def batcher(self, **kwargs):
+        """The bundle's GenerationBatcher, created with `kwargs` on first use"""
+        from .generation import GenerationBatcher
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = GenerationBatcher(self.model, self.device, **kwargs)
+            return self._batcher
+
+    def prefix_cache(self, **kwargs):
+        """The bundle's PrefixCache, created with `kwargs` on first use"""
+        from .generation import PrefixCache
+        with self._batcher_lock:
+            if self._prefix_cache is None:
+                self._prefix_cache = PrefixCache(self.model, self.device, **kwargs)
+            return self._prefix_cache
+
+    def note_indices(self, notes):
+        """Vocabulary indices of note tokens or MIDI numbers, matched by pitch when not in the vocabulary.
+
+        Raises KeyError for notes whose pitch the vocabulary does not have.
+        """
+        if self._pitch_indices is None:
+            pitch_indices = {}
+            # Single notes before chords, so a pitch maps to its plain note token
+            for i, token in sorted(self.int_to_note.items(), key=lambda item: ('.' in str(item[1]), item[0])):
+                try:
+                    pitch_indices.setdefault(note_to_midi(token), i)
+                except ValueError:
+                    continue
+            self._pitch_indices = pitch_indices
+        indices = []
+        for note in notes:
+            if isinstance(note, str) and note in self.note_to_int:
+                indices.append(self.note_to_int[note])
+                continue
+            try:
+                indices.append(self._pitch_indices[note_to_midi(note)])
+            except (ValueError, KeyError):
+                raise KeyError(f'Note {note!r} is not in the vocabulary of {self.version}')
+        return indices
+
+    def retire(self):
+        """Stop batching once no new traffic is routed here; late requests still complete"""
+        with self._batcher_lock:
+            if self._batcher is not None:
+                self._batcher.close()
+
+    def describe(self):
+        description = {'version': self.version, 'vocab_size': self.config['vocab_size'],
+                       'num_ragas': self.model.num_ragas, 'sha256': self.config.get('sha256'),
+                       'loaded_at': self.loaded_at}
+        if self._prefix_cache is not None:
+            description['prefix_cache'] = self._prefix_cache.describe()
+        return description
+
+
+class ModelRegistry:
+    """Serves one or more model versions from a registry directory.
+
+    Each version is a bundle directory (weights.pth, vocab.pkl, config.json).
+    Loading happens off the request path; the routing table (loaded bundles,
+    default version and A/B traffic shares) is replaced as a whole, so a
+    request that already picked a bundle finishes on it even if that version
+    is swapped out meanwhile. A `device` of None picks CUDA when available
+    on the first load.
+    """
+
+    def __init__(self, registry_dir=DEFAULT_REGISTRY_DIR, device='cpu', on_load=None):
+        self.registry_dir = registry_dir
+        self._device = device
+        self.on_load = on_load
+        self.loading = set()
+        self.errors = {}
+        # (bundles by version, default version, {version: traffic share})
+        self._routing = ({}, None, {})
+        self._lock = threading.Lock()
+        self._pending = {}  # version -> Future of a load in progress
+        self._watch_state = None
+
+    def versions(self):
+        """Versions published in the registry directory, oldest first"""
+        if not os.path.isdir(self.registry_dir):
+            return []
+        return sorted(name for name in os.listdir(self.registry_dir)
+                      if not name.startswith('.') and
+                      os.path.exists(os.path.join(self.registry_dir, name, CONFIG_FILENAME)))
+
+    def current_version(self):
+        """Version named by CURRENT, else the newest published one"""
+        path = os.path.join(self.registry_dir, CURRENT_FILENAME)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return f.read().strip() or None
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    @property
+    def device(self):
+        if self._device is None:
+            import torch
+            self._device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        return self._device
+
+    @property
+    def default_version(self):
+        return self._routing[1]
+
+    def loaded_versions(self):
+        return sorted(self._routing[0])
+
+    def add(self, bundle, activate=False):
+        """Make a loaded bundle servable; with `activate` it becomes the default.
+
+        A bundle already serving the same version is replaced and retired.
+        """
+        with self._lock:
+            bundles, default, traffic = self._routing
+            replaced = bundles.get(bundle.version)
+            bundles = {**bundles, bundle.version: bundle}
+            if activate or default is None:
+                default = bundle.version
+            self._routing = (bundles, default, traffic)
+        if replaced is not None and replaced is not bundle:
+            replaced.retire()
+
+    def load(self, version, activate=False):
+        """Load a version synchronously (no-op if it is already loaded).
+
+        Concurrent calls for the same version share a single load.
+        """
+        with self._lock:
+            bundle = self._routing[0].get(version)
+            pending = self._pending.get(version) if bundle is None else None
+            owner = bundle is None and pending is None
+            if owner:
+                pending = self._pending[version] = Future()
+        if owner:
+            try:
+                start = time.perf_counter()
+                bundle = ModelBundle.load(os.path.join(self.registry_dir, version), self.device)
+                if self.on_load is not None:
+                    self.on_load(version, time.perf_counter() - start)
+                self.add(bundle)
+                pending.set_result(bundle)
+            except Exception as e:
+                pending.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    del self._pending[version]
+        elif bundle is None:
+            bundle = pending.result()
+        if activate:
+            self.activate(version)
+        return bundle
+
+    def load_async(self, version, activate=False):
+        """Load a version on a background thread; returns the thread"""
+        def run():
+            try:
+                self.load(version, activate)
+                self.errors.pop(version, None)
+            except Exception as e:
+                self.errors[version] = str(e)
+            finally:
+                self.loading.discard(version)
+
+        self.loading.add(version)
+        thread = threading.Thread(target=run, name=f'model-load-{version}', daemon=True)
+        thread.start()
+        return thread
+
+    def activate(self, version):
+        """Route default traffic to a loaded version"""
+        with self._lock:
+            bundles, _, traffic = self._routing
+            if version not in bundles:
+                raise KeyError(f'Version {version} is not loaded')
+            self._routing = (bundles, version, traffic)
+
+    def set_traffic(self, shares):
+        """Split default traffic between loaded versions, e.g. {'v1': 0.9, 'v2': 0.1}; {} disables"""
+        with self._lock:
+            bundles, default, _ = self._routing
+            missing = [v for v in shares if v not in bundles]
+            if missing:
+                raise KeyError(f"Versions not loaded: {', '.join(missing)}")
+            if any(share < 0 for share in shares.values()):
+                raise ValueError('Traffic shares must be non-negative')
+            self._routing = (bundles, default, {v: float(s) for v, s in shares.items() if s > 0})
+
+    def unload(self, version):
+        with self._lock:
+            bundles, default, traffic = self._routing
+            if version == default:
+                raise ValueError('Cannot unload the default version')
+            retired = bundles.get(version)
+            bundles = {v: b for v, b in bundles.items() if v != version}
+            traffic = {v: s for v, s in traffic.items() if v != version}
+            self._routing = (bundles, default, traffic)
+        if retired is not None:
+            retired.retire()
+
+    def select(self, version=None, key=None):
+        """Bundle for a request: the requested version, else an A/B draw, else the default.
+
+        With a `key` (e.g. a client ID) the A/B draw is deterministic, so a
+        client keeps seeing the same version.
+        """
+        bundles, default, traffic = self._routing
+        if version is not None:
+            if version not in bundles:
+                raise KeyError(f'Version {version} is not loaded')
+            return bundles[version]
+        if traffic:
+            total = sum(traffic.values())
+            if key is not None:
+                point = int(hashlib.sha1(str(key).encode()).hexdigest()[:8], 16) / 0x100000000 * total
+            else:
+                point = random.random() * total
+            for candidate, share in sorted(traffic.items()):
+                point -= share
+                if point < 0:
+                    return bundles[candidate]
+        return bundles.get(default)
+
+    def describe(self):
+        bundles, default, traffic = self._routing
+        return {
+            'registry': self.registry_dir,
+            'available': self.versions(),
+            'current': self.current_version(),
+            'default': default,
+            'loaded': [bundles[v].describe() for v in sorted(bundles)],
+            'traffic': traffic,
+            'loading': sorted(self.loading),
+            'errors': self.errors,
+        }
+
+    def _read_traffic_file(self):
+        path = os.path.join(self.registry_dir, TRAFFIC_FILENAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def sync(self):
+        """Load and activate what CURRENT and traffic.json ask for, if it changed.
+
+        Loaded versions that are neither the default nor in traffic.json are
+        unloaded afterwards, so old versions do not pile up in memory.
+        """
+        current = self.current_version()
+        traffic = self._read_traffic_file()
+        state = (current, json.dumps(traffic, sort_keys=True))
+        if state == self._watch_state:
+            return False
+        for version in sorted(set(traffic) | ({current} if current else set())):
+            self.load(version)
+        if current:
+            self.activate(current)
+        self.set_traffic(traffic)
+        keep = set(traffic) | {self.default_version}
+        for version in self.loaded_versions():
+            if version not in keep:
+                self.unload(version)
+        self._watch_state = state
+        return True
+
+    def watch(self, interval=5.0):
+        """Poll the registry directory and hot-swap versions as CURRENT/traffic.json change"""
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    self.errors['watch'] = str(e)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='model-registry-watch', daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish and select model versions in the registry')
+    parser.add_argument('--registry', default=DEFAULT_REGISTRY_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish = commands.add_parser('publish', help='Add a trained checkpoint as a new version')
+    publish.add_argument('--weights', default=os.path.join('model', 'trained_model.pth'))
+    publish.add_argument('--vocab', default=os.path.join('data', 'processed', 'vocab.pkl'))
+    publish.add_argument('--version')
+    publish.add_argument('--current', action='store_true', help='Also make it the CURRENT version')
+    current = commands.add_parser('current', help='Point CURRENT at a published version')
+    current.add_argument('version')
+    commands.add_parser('list', help='List published versions')
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        print(publish_bundle(args.registry, args.weights, args.vocab, version=args.version,
+                             make_current=args.current))
+    elif args.command == 'current':
+        if not os.path.exists(os.path.join(args.registry, args.version, CONFIG_FILENAME)):
+            parser.error(f'No version {args.version} in {args.registry}')
+        set_current(args.registry, args.version)
+    else:
+        registry = ModelRegistry(args.registry)
+        current_version = registry.current_version()
+        for version in registry.versions():
+            print(('* ' if version == current_version else '  ') + version)
+
+
+if __name__ == '__main__':
+    main()
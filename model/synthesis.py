@@ -0,0 +1,128 @@
+import struct
+import numpy as np
+from data.swara_codec import to_midi
+from data.raw.process_raga_audio import GAMAKA_CONTOURS
+
+SAMPLE_RATE = 22050
+BLOCK_SIZE = 4096
+
+# Relative amplitudes of the voice harmonics (a soft, vowel-like spectrum)
+VOICE_HARMONICS = np.array([1.0, 0.55, 0.3, 0.18, 0.1, 0.05])
+# Tanpura plucking cycle as semitone offsets from Sa: Pa (lower octave), Sa, Sa, Sa (lower octave)
+TANPURA_STRINGS = np.array([-5, 0, 0, -12])
+TANPURA_HARMONICS = 16
+TANPURA_DECAY = 2.5  # seconds for a pluck to fall by 1/e
+TANPURA_RINGING_PLUCKS = 4  # plucks still audible at any instant
+
+
+def swaras_to_midi(swaras, tonic_midi=60):
+    """Convert a swara string or list to MIDI numbers relative to the given Sa"""
+    return to_midi(swaras, tonic=tonic_midi, errors='raise').tolist()
+
+
+def midi_to_hz(midi):
+    return 440.0 * 2.0 ** ((np.asarray(midi, dtype=np.float64) - 69) / 12)
+
+
+class Synthesizer:
+    """Block-wise additive synthesis of a melody over a tanpura drone.
+
+    The melody is a harmonic voice whose pitch follows the note sequence plus
+    an optional gamaka contour and a light vibrato. Each call to `blocks`
+    yields fixed-size float32 blocks; oscillator phase is carried between
+    blocks so memory use does not depend on the length of the piece.
+    """
+
+    def __init__(self, pitches, note_duration=0.5, tonic_midi=None, gamaka=None,
+                 sample_rate=SAMPLE_RATE, voice_level=0.5, drone_level=0.25,
+                 tanpura_interval=0.6, vibrato_rate=5.5, vibrato_cents=15):
+        if gamaka is not None and (not isinstance(gamaka, str) or gamaka not in GAMAKA_CONTOURS):
+            raise ValueError(f"Unknown gamaka {gamaka!r}; expected one of {', '.join(GAMAKA_CONTOURS)}")
+        self.pitches = np.asarray(pitches, dtype=np.float64)
+        self.note_duration = float(note_duration)
+        self.sample_rate = sample_rate
+        self.gamaka = gamaka
+        self.voice_level = voice_level
+        self.drone_level = drone_level
+        self.tanpura_interval = tanpura_interval
+        self.vibrato_rate = vibrato_rate
+        self.vibrato_cents = vibrato_cents
+        if tonic_midi is None:
+            # Sa of the octave below the lowest melody note
+            tonic_midi = 12 * (int(self.pitches.min()) // 12) if len(self.pitches) else 60
+        self.tonic_midi = tonic_midi
+        self.intervals = np.diff(self.pitches, prepend=self.pitches[:1])
+        self.num_samples = int(round(len(self.pitches) * self.note_duration * sample_rate))
+
+        # Per-string harmonic amplitudes, brighter upper partials for the jawari buzz
+        k = np.arange(1, TANPURA_HARMONICS + 1)
+        self._tanpura_amps = (1.0 / k ** 0.8) / np.sum(1.0 / k ** 0.8)
+        self._tanpura_hz = midi_to_hz(tonic_midi + TANPURA_STRINGS)
+        self._voice_amps = VOICE_HARMONICS / VOICE_HARMONICS.sum()
+
+    @property
+    def duration(self):
+        return self.num_samples / self.sample_rate
+
+    def _voice(self, t, phase):
+        note_idx = np.minimum((t // self.note_duration).astype(np.int64), len(self.pitches) - 1)
+        time_in_note = t - note_idx * self.note_duration
+        position = time_in_note / self.note_duration
+
+        pitch = self.pitches[note_idx]
+        if self.gamaka is not None:
+            contour = GAMAKA_CONTOURS[self.gamaka]
+            pitch = pitch + contour(position[:, None], self.intervals[note_idx])[:, 0]
+        pitch = pitch + self.vibrato_cents / 100 * np.sin(2 * np.pi * self.vibrato_rate * t)
+
+        # Integrate instantaneous frequency so pitch curves stay phase-continuous
+        phases = phase + np.cumsum(2 * np.pi * midi_to_hz(pitch) / self.sample_rate)
+        harmonics = np.arange(1, len(self._voice_amps) + 1)
+        tone = np.sin(phases[:, None] * harmonics) @ self._voice_amps
+
+        attack = np.minimum(time_in_note / 0.02, 1.0)
+        release = np.clip((self.note_duration - time_in_note) / 0.04, 0.0, 1.0)
+        return tone * attack * release, phases[-1] % (2 * np.pi)
+
+    def _tanpura(self, t):
+        pluck = (t // self.tanpura_interval).astype(np.int64)
+        since = t - pluck * self.tanpura_interval
+        harmonics = np.arange(1, TANPURA_HARMONICS + 1)
+        out = np.zeros_like(t)
+        for back in range(TANPURA_RINGING_PLUCKS):
+            index = pluck - back
+            age = since + back * self.tanpura_interval
+            hz = self._tanpura_hz[index % len(self._tanpura_hz)]
+            partials = np.sin(2 * np.pi * (hz * t)[:, None] * harmonics) @ self._tanpura_amps
+            out += np.where(index >= 0, partials * np.exp(-age / TANPURA_DECAY), 0.0)
+        return out
+
+    def blocks(self, block_size=BLOCK_SIZE):
+        """Yield the rendered signal as float32 blocks of at most `block_size` samples"""
+        phase = 0.0
+        for start in range(0, self.num_samples, block_size):
+            n = min(block_size, self.num_samples - start)
+            t = (start + np.arange(n)) / self.sample_rate
+            voice, phase = self._voice(t, phase)
+            block = self.voice_level * voice + self.drone_level * self._tanpura(t)
+            yield np.clip(block, -1.0, 1.0).astype(np.float32)
+
+    def render(self):
+        """Render the whole piece into one array"""
+        return np.concatenate(list(self.blocks())) if self.num_samples else np.zeros(0, np.float32)
+
+
+def wav_header(num_samples, sample_rate=SAMPLE_RATE, channels=1, bits_per_sample=16):
+    """Build a 44-byte PCM WAV header for a known number of samples"""
+    block_align = channels * bits_per_sample // 8
+    data_size = num_samples * block_align
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1,
+                       channels, sample_rate, sample_rate * block_align, block_align,
+                       bits_per_sample, b'data', data_size)
+
+
+def stream_wav(synthesizer, block_size=BLOCK_SIZE):
+    """Yield a complete 16-bit WAV file chunk by chunk, starting with its header"""
+    yield wav_header(synthesizer.num_samples, synthesizer.sample_rate)
+    for block in synthesizer.blocks(block_size):
+        yield (block * 32767).astype('<i2').tobytes()
@@ -0,0 +1,373 @@
+import os
+import gzip
+import json
+import zlib
+import shutil
+import struct
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+# TFRecord framing: uint64 length, uint32 masked CRC of the length,
+# `length` bytes of payload, uint32 masked CRC of the payload.
+_HEADER = struct.Struct('<QI')
+_FOOTER_SIZE = 4
+
+# Wire types of the protobuf encoding
+_VARINT, _FIXED64, _LENGTH_DELIMITED, _FIXED32 = 0, 1, 2, 5
+
+# NoteSequence field numbers (note_seq/protobuf/music.proto)
+_SEQ_NOTES = 8
+_SEQ_TOTAL_TIME = 9
+_SEQ_PITCH_BENDS = 10
+_NOTE_PITCH, _NOTE_VELOCITY, _NOTE_START, _NOTE_END = 1, 2, 3, 4
+_NOTE_INSTRUMENT, _NOTE_PROGRAM, _NOTE_IS_DRUM = 7, 8, 9
+_BEND_TIME, _BEND_BEND, _BEND_INSTRUMENT, _BEND_PROGRAM = 1, 2, 3, 4
+
+_CRC32C_TABLE = []
+for _i in range(256):
+    _crc = _i
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ 0x82F63B78 if _crc & 1 else _crc >> 1
+    _CRC32C_TABLE.append(_crc)
+
+
+def masked_crc32c(data):
+    """Compute the masked CRC32C checksum TFRecord stores for each chunk"""
+    crc = 0xFFFFFFFF
+    for byte in bytes(data):
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    crc ^= 0xFFFFFFFF
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def shard_compression(path):
+    """Compression of a shard ('GZIP', 'ZLIB' or None) as recorded in its directory's index.json.
+
+    Shards the index does not list fall back to their file suffix.
+    """
+    index_path = os.path.join(os.path.dirname(path), 'index.json')
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        for shard in index['shards']:
+            if shard['path'] == os.path.basename(path):
+                return (shard.get('compression') or '').upper() or None
+    if path.endswith('.gz'):
+        return 'GZIP'
+    if path.endswith('.zlib'):
+        return 'ZLIB'
+    return None
+
+
+class _ZlibReader:
+    """Read-only file object over a zlib stream, as TFRecord's ZLIB compression writes"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+
+    def read(self, size):
+        while len(self._buffer) < size:
+            chunk = self._file.read(1 << 16)
+            if not chunk:
+                self._buffer += self._decompressor.flush()
+                break
+            self._buffer += self._decompressor.decompress(chunk)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _open_shard(path, compression=None):
+    if compression == 'GZIP':
+        return gzip.open(path, 'rb')
+    if compression == 'ZLIB':
+        return _ZlibReader(path)
+    return open(path, 'rb')
+
+
+def uncompressed_copy(path):
+    """Path of an uncompressed version of a shard, decompressing it once to `<shard>.uncompressed`.
+
+    Uncompressed shards are returned as they are.
+    """
+    compression = shard_compression(path)
+    if compression is None:
+        return path
+    copy_path = path + '.uncompressed'
+    if not os.path.exists(copy_path) or os.path.getmtime(copy_path) < os.path.getmtime(path):
+        with _open_shard(path, compression) as src, open(copy_path + '.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(copy_path + '.tmp', copy_path)
+    return copy_path
+
+
+def _read_record(f, verify=False):
+    """Read one record from an open shard; returns None at end of file"""
+    header = f.read(_HEADER.size)
+    if not header:
+        return None
+    if len(header) != _HEADER.size:
+        raise IOError('Truncated TFRecord header')
+    length, length_crc = _HEADER.unpack(header)
+    data = f.read(length)
+    footer = f.read(_FOOTER_SIZE)
+    if len(data) != length or len(footer) != _FOOTER_SIZE:
+        raise IOError('Truncated TFRecord payload')
+    if verify:
+        if masked_crc32c(header[:8]) != length_crc:
+            raise IOError('TFRecord length checksum mismatch')
+        if masked_crc32c(data) != struct.unpack('<I', footer)[0]:
+            raise IOError('TFRecord payload checksum mismatch')
+    return data
+
+
+def iter_records(path, verify=False):
+    """Yield the raw payload of every record in a (possibly GZIP or ZLIB) TFRecord shard"""
+    with _open_shard(path, shard_compression(path)) as f:
+        while True:
+            data = _read_record(f, verify)
+            if data is None:
+                return
+            yield data
+
+
+def build_offset_index(path, save=True):
+    """Scan record headers of an uncompressed shard and return their byte offsets.
+
+    Only the 12-byte headers are read; payloads are skipped with seek. The
+    offsets are cached next to the shard as `<shard>.idx.npy`.
+    """
+    if shard_compression(path) is not None:
+        raise ValueError(f'Random access needs an uncompressed shard (see uncompressed_copy): {path}')
+    index_path = path + '.idx.npy'
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        return np.load(index_path)
+
+    offsets = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset < size:
+            f.seek(offset)
+            length, _ = _HEADER.unpack(f.read(_HEADER.size))
+            offsets.append(offset)
+            offset += _HEADER.size + length + _FOOTER_SIZE
+    offsets = np.array(offsets, dtype=np.int64)
+    if save:
+        np.save(index_path, offsets)
+    return offsets
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _signed(value):
+    """Reinterpret a varint as a signed 64-bit integer (int32 negatives use 10 bytes)"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _iter_fields(buf):
+    """Yield (field_number, value) pairs of a protobuf message"""
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == _VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == _FIXED64:
+            value = struct.unpack_from('<d', buf, pos)[0]
+            pos += 8
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == _FIXED32:
+            value = struct.unpack_from('<f', buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        yield field, value
+
+
+def parse_note_sequence(data):
+    """Decode the NoteSequence fields used for training into NumPy arrays.
+
+    Returns a dict with per-note `pitch`, `velocity`, `start_time`, `end_time`,
+    `instrument`, `program` and `is_drum`, per-event `bend_time`, `bend`,
+    `bend_instrument` and `bend_program`, and the sequence `total_time`.
+    Notes are sorted by start time.
+    """
+    buf = memoryview(data)
+    notes = []
+    bends = []
+    total_time = 0.0
+    for field, value in _iter_fields(buf):
+        if field == _SEQ_NOTES:
+            note = [0, 0, 0.0, 0.0, 0, 0, 0]
+            for note_field, note_value in _iter_fields(value):
+                if note_field == _NOTE_PITCH:
+                    note[0] = _signed(note_value)
+                elif note_field == _NOTE_VELOCITY:
+                    note[1] = _signed(note_value)
+                elif note_field == _NOTE_START:
+                    note[2] = note_value
+                elif note_field == _NOTE_END:
+                    note[3] = note_value
+                elif note_field == _NOTE_INSTRUMENT:
+                    note[4] = _signed(note_value)
+                elif note_field == _NOTE_PROGRAM:
+                    note[5] = _signed(note_value)
+                elif note_field == _NOTE_IS_DRUM:
+                    note[6] = note_value
+            notes.append(note)
+        elif field == _SEQ_PITCH_BENDS:
+            bend = [0.0, 0, 0, 0]
+            for bend_field, bend_value in _iter_fields(value):
+                if bend_field == _BEND_TIME:
+                    bend[0] = bend_value
+                elif bend_field == _BEND_BEND:
+                    bend[1] = _signed(bend_value)
+                elif bend_field == _BEND_INSTRUMENT:
+                    bend[2] = _signed(bend_value)
+                elif bend_field == _BEND_PROGRAM:
+                    bend[3] = _signed(bend_value)
+            bends.append(bend)
+        elif field == _SEQ_TOTAL_TIME:
+            total_time = value
+
+    note_array = np.array(notes, dtype=np.float64).reshape(-1, 7)
+    note_array = note_array[np.argsort(note_array[:, 2], kind='stable')]
+    bend_array = np.array(bends, dtype=np.float64).reshape(-1, 4)
+    return {
+        'pitch': note_array[:, 0].astype(np.int16),
+        'velocity': note_array[:, 1].astype(np.int16),
+        'start_time': note_array[:, 2].astype(np.float32),
+        'end_time': note_array[:, 3].astype(np.float32),
+        'instrument': note_array[:, 4].astype(np.int16),
+        'program': note_array[:, 5].astype(np.int16),
+        'is_drum': note_array[:, 6].astype(bool),
+        'bend_time': bend_array[:, 0].astype(np.float32),
+        'bend': bend_array[:, 1].astype(np.int16),
+        'bend_instrument': bend_array[:, 2].astype(np.int16),
+        'bend_program': bend_array[:, 3].astype(np.int16),
+        'total_time': float(total_time),
+    }
+
+
+def list_shards(tfrecord_dir):
+    """Return shard paths listed in the converter's index.json, in write order"""
+    with open(os.path.join(tfrecord_dir, 'index.json'), 'r') as f:
+        index = json.load(f)
+    return [os.path.join(tfrecord_dir, shard['path']) for shard in index['shards']
+            if shard['num_records'] > 0]
+
+
+def iter_indexed_records(tfrecord_dir, verify=False):
+    """Yield (content hash, raw record) for every record of the shards in index.json.
+
+    The hash is the catalog SHA-1 of the file the record was converted from.
+    """
+    with open(os.path.join(tfrecord_dir, 'index.json'), 'r') as f:
+        index = json.load(f)
+    for shard in index['shards']:
+        if shard['num_records'] > 0:
+            yield from zip(shard['content_hashes'],
+                           iter_records(os.path.join(tfrecord_dir, shard['path']), verify))
+
+
+class NoteSequenceDataset(Dataset):
+    """Map-style dataset with random access into NoteSequence shards.
+
+    Compressed shards are read through a cached uncompressed copy.
+    """
+
+    def __init__(self, shards, transform=None, verify=False):
+        self.shards = [uncompressed_copy(path) for path in shards]
+        self.transform = transform
+        self.verify = verify
+        self.offsets = [build_offset_index(path) for path in self.shards]
+        self.cumulative = np.cumsum([0] + [len(o) for o in self.offsets])
+        self._handles = {}
+
+    def __len__(self):
+        return int(self.cumulative[-1])
+
+    def _handle(self, shard_id):
+        # File handles are opened lazily so each DataLoader worker gets its own
+        handle = self._handles.get(shard_id)
+        if handle is None:
+            handle = open(self.shards[shard_id], 'rb')
+            self._handles[shard_id] = handle
+        return handle
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        shard_id = int(np.searchsorted(self.cumulative, idx, side='right')) - 1
+        f = self._handle(shard_id)
+        f.seek(int(self.offsets[shard_id][idx - self.cumulative[shard_id]]))
+        sequence = parse_note_sequence(_read_record(f, self.verify))
+        return self.transform(sequence) if self.transform else sequence
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handles'] = {}
+        return state
+
+
+class NoteSequenceShardDataset(IterableDataset):
+    """Streams NoteSequences from (possibly compressed) shards.
+
+    Shards are divided between DataLoader workers, and their order is
+    reshuffled every epoch when a seed is given.
+    """
+
+    def __init__(self, shards, transform=None, shuffle_seed=None, verify=False):
+        self.shards = list(shards)
+        self.transform = transform
+        self.shuffle_seed = shuffle_seed
+        self.verify = verify
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        shards = self.shards
+        if self.shuffle_seed is not None:
+            order = np.random.default_rng(self.shuffle_seed + self.epoch).permutation(len(shards))
+            shards = [shards[i] for i in order]
+        worker = get_worker_info()
+        if worker is not None:
+            shards = shards[worker.id::worker.num_workers]
+        for path in shards:
+            for data in iter_records(path, self.verify):
+                sequence = parse_note_sequence(data)
+                yield self.transform(sequence) if self.transform else sequence
+
+
+def pitches_to_tensor(sequence):
+    """Transform for the datasets above: the note pitches as a LongTensor"""
+    return torch.from_numpy(sequence['pitch'].astype(np.int64))
@@ -0,0 +1,122 @@
+import os
+import json
+import numpy as np
+from .audio_features import PITCH_FILENAME, load_pitch_tracks, file_pitch_track
+
+REFERENCE_HZ = 55.0          # Cents are measured from A1
+HISTOGRAM_BIN_CENTS = 5      # Resolution of the absolute pitch histogram
+HISTOGRAM_OCTAVES = 6        # 55 Hz to 3.5 kHz
+SMOOTHING_CENTS = 15         # Gaussian kernel width applied to the histogram
+TONIC_RANGE_HZ = (100.0, 370.0)
+PA_CENTS = 702               # Just fifth above Sa
+PA_WEIGHT = 0.6
+OCTAVE_WEIGHT = 0.4
+PITCH_CLASS_BINS = 120       # 10-cent bins for the tonic-relative histogram
+TONIC_CACHE = 'tonic.json'
+HISTOGRAM_CACHE = 'pitch_class_histograms.npy'
+
+
+def hz_to_cents(f0, reference=REFERENCE_HZ):
+    """Convert voiced frequencies to cents above `reference`; unvoiced frames (<= 0) are dropped"""
+    f0 = np.asarray(f0, dtype=np.float64)
+    return 1200.0 * np.log2(f0[f0 > 0] / reference)
+
+
+def pitch_histogram(f0):
+    """Smoothed, normalized histogram of absolute pitch in HISTOGRAM_BIN_CENTS bins"""
+    num_bins = HISTOGRAM_OCTAVES * 1200 // HISTOGRAM_BIN_CENTS
+    bins = np.floor(hz_to_cents(f0) / HISTOGRAM_BIN_CENTS).astype(np.int64)
+    counts = np.bincount(bins[(bins >= 0) & (bins < num_bins)], minlength=num_bins).astype(np.float64)
+    sigma = SMOOTHING_CENTS / HISTOGRAM_BIN_CENTS
+    offsets = np.arange(-3 * int(np.ceil(sigma)), 3 * int(np.ceil(sigma)) + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    counts = np.convolve(counts, kernel / kernel.sum(), mode='same')
+    total = counts.sum()
+    return counts / total if total > 0 else counts
+
+
+def _shifted(histogram, cents):
+    """histogram[i + cents/bin] for every i, zero outside the range"""
+    shift = int(round(cents / HISTOGRAM_BIN_CENTS))
+    out = np.zeros_like(histogram)
+    if shift >= 0:
+        out[:len(histogram) - shift] = histogram[shift:]
+    else:
+        out[-shift:] = histogram[:shift]
+    return out
+
+
+def tonic_candidates(f0, num_candidates=5):
+    """Rank tonic (Sa) candidates for one pitch track.
+
+    Each histogram bin in TONIC_RANGE_HZ is scored by its own weight plus the
+    weight found at its Pa and at the octaves above and below, as Sa and Pa
+    dominate both the melody and the drone. Returns (hz, score) pairs, best first.
+    """
+    histogram = pitch_histogram(f0)
+    score = (histogram
+             + PA_WEIGHT * (_shifted(histogram, PA_CENTS) + _shifted(histogram, PA_CENTS - 1200))
+             + OCTAVE_WEIGHT * (_shifted(histogram, 1200) + _shifted(histogram, -1200)))
+
+    centers = (np.arange(len(histogram)) + 0.5) * HISTOGRAM_BIN_CENTS
+    hz = REFERENCE_HZ * 2.0 ** (centers / 1200)
+    in_range = (hz >= TONIC_RANGE_HZ[0]) & (hz <= TONIC_RANGE_HZ[1])
+    peaks = in_range & (score >= np.roll(score, 1)) & (score > np.roll(score, -1)) & (score > 0)
+
+    candidates = np.flatnonzero(peaks)
+    candidates = candidates[np.argsort(score[candidates])[::-1][:num_candidates]]
+    return [(float(hz[i]), float(score[i])) for i in candidates]
+
+
+def pitch_class_histogram(f0, tonic_hz, bins=PITCH_CLASS_BINS):
+    """Octave-folded, normalized histogram of pitch in cents relative to Sa.
+
+    Bins are centred on multiples of 1200/bins cents, so bin 0 is Sa itself.
+    """
+    width = 1200.0 / bins
+    cents = (hz_to_cents(f0, reference=tonic_hz) + width / 2) % 1200
+    counts = np.bincount((cents // width).astype(np.int64), minlength=bins)[:bins]
+    total = counts.sum()
+    return (counts / total if total > 0 else counts).astype(np.float32)
+
+
+def _features_signature(feature_dir):
+    stat = os.stat(os.path.join(feature_dir, PITCH_FILENAME))
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def analyze_pitch_tracks(feature_dir, num_candidates=5, bins=PITCH_CLASS_BINS, force=False):
+    """Estimate the tonic and tonic-relative histogram of every extracted pitch track.
+
+    Works on the output of audio_features.extract_pitch_tracks. Results are
+    cached in feature_dir as tonic.json and pitch_class_histograms.npy and
+    reused while the pitch tracks are unchanged.
+
+    Returns:
+        (list of per-file dicts with path, tonic_hz and candidates,
+         float32 array of shape (num_files, bins))
+    """
+    tonic_path = os.path.join(feature_dir, TONIC_CACHE)
+    histogram_path = os.path.join(feature_dir, HISTOGRAM_CACHE)
+    signature = _features_signature(feature_dir)
+    if not force and os.path.exists(tonic_path) and os.path.exists(histogram_path):
+        with open(tonic_path, 'r') as f:
+            cached = json.load(f)
+        if cached['features'] == signature and cached['bins'] == bins:
+            return cached['files'], np.load(histogram_path)
+
+    tracks, index = load_pitch_tracks(feature_dir)
+    results = []
+    histograms = np.zeros((len(index['files']), bins), dtype=np.float32)
+    for i, entry in enumerate(index['files']):
+        f0 = np.asarray(file_pitch_track(tracks, entry), dtype=np.float32)
+        candidates = tonic_candidates(f0, num_candidates)
+        tonic_hz = candidates[0][0] if candidates else None
+        if tonic_hz is not None:
+            histograms[i] = pitch_class_histogram(f0, tonic_hz, bins)
+        results.append({'path': entry['path'], 'tonic_hz': tonic_hz, 'candidates': candidates})
+
+    with open(tonic_path, 'w') as f:
+        json.dump({'features': signature, 'bins': bins, 'files': results}, f, indent=2)
+    np.save(histogram_path, histograms)
+    return results, histograms
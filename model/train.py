@@ -3,39 +3,85 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
 import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from model import DeepRagaModel
 from data_processor import DataProcessor
-import os
+from data.catalog import Catalog
+from data.dedup import unique_window_mask
+from data.split_manifest import build_split_manifest, load_split_manifest
+from grammar import GrammarScorer, pitch_table
+from raga_index import RagaIndex
+from precision import autocast, compare_precisions, resolve_precision
+from augment import TokenAugmenter
+from tfrecord_reader import iter_indexed_records, parse_note_sequence
 import pickle
+import json
 
 class RagaDataset(Dataset):
-    def __init__(self, data_dir, split='train'):
+    def __init__(self, data_dir, split='train', source='npy', processor=None, dedup=False):
+        """`source` 'tfrecord' builds the windows from the converter's shards with `processor`'s vocabulary.
+        With `dedup`, repeated (window, target) pairs are dropped from the train split.
+        """
         self.data_dir = data_dir
         self.split = split
+        self.source = source
+        self.processor = processor
         self.X = []
         self.y = []
+        self.ragas = []
         self.load_data()
+        if dedup and self.split == 'train' and len(self.X) > 0:
+            keep = unique_window_mask(self.X, self.y)
+            if not keep.all():
+                print(f"Dropped {len(self.X) - keep.sum()} duplicate training windows")
+                self.X, self.y, self.ragas = self.X[keep], self.y[keep], self.ragas[keep]
         
     def load_data(self):
         """Load preprocessed data from numpy files"""
         try:
+            if self.source == 'tfrecord':
+                self.load_tfrecords()
+                return
             # Load preprocessed features
-            X_path = os.path.join(self.data_dir, 'processed', 'X.npy')
-            y_path = os.path.join(self.data_dir, 'processed', 'y.npy')
+            processed_dir = os.path.join(self.data_dir, 'processed')
+            X_path = os.path.join(processed_dir, 'X.npy')
+            y_path = os.path.join(processed_dir, 'y.npy')
+            manifest_path = os.path.join(processed_dir, 'split_manifest.json')
+            sources_path = os.path.join(processed_dir, 'sources.npy')
             
             if os.path.exists(X_path) and os.path.exists(y_path):
                 self.X = np.load(X_path)
                 self.y = np.load(y_path)
+                # Raga ID per window; data processed before raga labels count as unknown (0)
+                ragas_path = os.path.join(processed_dir, 'ragas.npy')
+                self.ragas = np.load(ragas_path) if os.path.exists(ragas_path) else np.zeros(len(self.y), dtype=np.int16)
                 
-                # Simple split for train/val (80/20) if not already split
-                # In a real scenario, we'd have separate folders or files
-                split_idx = int(0.8 * len(self.X))
-                if self.split == 'train':
-                    self.X = self.X[:split_idx]
-                    self.y = self.y[:split_idx]
+                if os.path.exists(manifest_path) and os.path.exists(sources_path):
+                    # Keep the windows whose source file the manifest assigns to this split,
+                    # so windows of one composition never land on both sides
+                    manifest = load_split_manifest(manifest_path)
+                    with open(os.path.join(processed_dir, 'sources.json'), 'r') as f:
+                        source_files = json.load(f)
+                    in_split = np.array([manifest['files'].get(f, {}).get('split') == self.split
+                                         for f in source_files], dtype=bool)
+                    mask = in_split[np.load(sources_path)]
+                    self.X = self.X[mask]
+                    self.y = self.y[mask]
+                    self.ragas = self.ragas[mask]
                 else:
-                    self.X = self.X[split_idx:]
-                    self.y = self.y[split_idx:]
+                    # Without a manifest fall back to an 80/20 split by row
+                    print("No split manifest found; splitting windows 80/20 by row")
+                    split_idx = int(0.8 * len(self.X))
+                    if self.split == 'train':
+                        self.X = self.X[:split_idx]
+                        self.y = self.y[:split_idx]
+                        self.ragas = self.ragas[:split_idx]
+                    else:
+                        self.X = self.X[split_idx:]
+                        self.y = self.y[split_idx:]
+                        self.ragas = self.ragas[split_idx:]
                     
                 print(f"Loaded {len(self.X)} sequences for {self.split}")
             else:
@@ -45,16 +91,86 @@ class RagaDataset(Dataset):
         except Exception as e:
             print(f"Error loading data: {str(e)}")
         
+    def load_tfrecords(self):
+        """Window the NoteSequences in data/processed/tfrecord (written by data/convert_data.py)
+        
+        Records are matched to their source file through the catalog content
+        hash, which gives their split in the manifest and their raga.
+        """
+        processed_dir = os.path.join(self.data_dir, 'processed')
+        manifest_path = os.path.join(processed_dir, 'split_manifest.json')
+        manifest = load_split_manifest(manifest_path) if os.path.exists(manifest_path) else None
+        sources = {entry['sha1']: (relpath, entry)
+                   for relpath, entry in Catalog.build(os.path.join(self.data_dir, 'raw')).query()}
+        
+        X, y, ragas = [], [], []
+        for content_hash, record in iter_indexed_records(os.path.join(processed_dir, 'tfrecord')):
+            relpath, entry = sources.get(content_hash, (None, None))
+            if manifest is not None and manifest['files'].get(relpath, {}).get('split') != self.split:
+                continue
+            inputs, outputs = self.processor.make_id_windows(
+                self.processor.sequence_note_ids(parse_note_sequence(record)))
+            if len(inputs) > 0:
+                X.append(inputs)
+                y.append(outputs)
+                raga = self.processor.raga_id(entry['raga_id'], entry['raga_name'], training=False) if entry else 0
+                ragas.append(np.full(len(inputs), raga, dtype=np.int16))
+        if not X:
+            print(f"No {self.split} windows in the TFRecord shards")
+            return
+        self.X, self.y, self.ragas = np.concatenate(X), np.concatenate(y), np.concatenate(ragas)
+        if manifest is None:
+            print("No split manifest found; splitting windows 80/20 by row")
+            split_idx = int(0.8 * len(self.X))
+            rows = slice(None, split_idx) if self.split == 'train' else slice(split_idx, None)
+            self.X, self.y, self.ragas = self.X[rows], self.y[rows], self.ragas[rows]
+        print(f"Loaded {len(self.X)} sequences for {self.split} from TFRecord shards")
+        
     def __len__(self):
         return len(self.X)
         
     def __getitem__(self, idx):
         return {
             'sequence': torch.LongTensor(self.X[idx]),
-            'target': torch.LongTensor([self.y[idx]]).squeeze()
+            'target': torch.LongTensor([self.y[idx]]).squeeze(),
+            'raga': torch.tensor(int(self.ragas[idx]), dtype=torch.long)
         }
 
-def train_model(model, train_loader, val_loader, num_epochs, device, vocab_size):
+class GrammarCheck:
+    """Scores each validation window's predicted next note against the raga grammar.
+
+    The predictions are scored with the window's last notes as context, so
+    moves and n-grams ending on a prediction are covered.
+    """
+    def __init__(self, scorer, pitches, raga_rows):
+        self.scorer = scorer
+        self.pitches = pitches
+        self.raga_rows = raga_rows
+        self.context = max(scorer.ngram - 1, 1)
+
+    @classmethod
+    def build(cls, processor, train_dataset):
+        scorer = GrammarScorer.from_raga_index(RagaIndex.from_sources())
+        pitches = pitch_table(processor.int_to_note)
+        if len(train_dataset):
+            X, y = train_dataset.X, train_dataset.y
+            # Windows of one file slide one note at a time, so their leading n-grams
+            # cover all but the tail of the file. The tail is in the file's last window
+            # and target: the last row of each run of consecutive windows
+            follows = (X[1:, :-1] == X[:-1, 1:]).all(axis=1) & (X[1:, -1] == y[:-1])
+            last = np.append(~follows, True)
+            scorer.index_ngrams(pitches[X[:, :scorer.ngram]])
+            scorer.index_ngrams(pitches[np.column_stack([X[last], y[last]])])
+        return cls(scorer, pitches, scorer.positions_for_ids(processor.raga_to_int))
+
+    def __call__(self, windows, predicted, ragas):
+        sequences = self.pitches[np.concatenate([windows[:, -self.context:], predicted[:, None]], axis=1)]
+        return self.scorer.score(sequences, self.raga_rows[ragas], context=self.context)
+
+def train_model(model, train_loader, val_loader, num_epochs, device, vocab_size, grammar_check=None,
+                precision='fp32'):
+    # With precision 'bf16' the forward passes run under bf16 autocast; weights,
+    # gradients and Adam state stay in fp32
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(model.parameters())
     
@@ -64,10 +180,12 @@ def train_model(model, train_loader, val_loader, num_epochs, device, vocab_size)
         for batch in train_loader:
             sequences = batch['sequence'].to(device)
             targets = batch['target'].to(device)
+            ragas = batch['raga'].to(device)
             
             optimizer.zero_grad()
-            outputs, _ = model(sequences)
-            loss = criterion(outputs, targets)
+            with autocast(precision, device):
+                outputs, _ = model(sequences, raga=ragas)
+            loss = criterion(outputs.float(), targets)
             loss.backward()
             optimizer.step()
             
@@ -78,24 +196,39 @@ def train_model(model, train_loader, val_loader, num_epochs, device, vocab_size)
         val_loss = 0
         correct = 0
         total = 0
+        grammar_inputs = []
         with torch.no_grad():
             for batch in val_loader:
                 sequences = batch['sequence'].to(device)
                 targets = batch['target'].to(device)
+                ragas = batch['raga'].to(device)
                 
-                outputs, _ = model(sequences)
+                with autocast(precision, device):
+                    outputs, _ = model(sequences, raga=ragas)
+                outputs = outputs.float()
                 loss = criterion(outputs, targets)
                 val_loss += loss.item()
                 
                 _, predicted = outputs.max(1)
                 total += targets.size(0)
                 correct += predicted.eq(targets).sum().item()
+                if grammar_check is not None:
+                    grammar_inputs.append((sequences[:, -grammar_check.context:].cpu().numpy(),
+                                           predicted.cpu().numpy(), batch['raga'].numpy()))
         
         print(f'Epoch {epoch+1}/{num_epochs}')
         print(f'Train Loss: {train_loss/len(train_loader):.4f}')
         if len(val_loader) > 0:
             print(f'Val Loss: {val_loss/len(val_loader):.4f}')
             print(f'Val Accuracy: {100.*correct/total:.2f}%')
+        if grammar_inputs:
+            windows, predicted, ragas = (np.concatenate(parts) for parts in zip(*grammar_inputs))
+            grammar = grammar_check(windows, predicted, ragas)
+            rates = [(label, grammar[key]) for label, key in (
+                ('out-of-scale', 'out_of_scale_rate'), ('direction violations', 'direction_violation_rate'),
+                (f'novel {grammar_check.scorer.ngram}-grams', 'ngram_novelty'))]
+            print('Val Grammar: ' + ', '.join(f'{label} {100. * rate:.2f}%' for label, rate in rates
+                                               if rate is not None))
 
 def main():
     # Configuration
@@ -108,16 +241,28 @@ def main():
     # Initialize DataProcessor
     processor = DataProcessor()
     
+    # 'npy' trains on the windows saved by DataProcessor; 'tfrecord' windows the NoteSequence
+    # shards of data/convert_data.py in data/processed/tfrecord with the same vocabulary
+    data_source = 'npy'
+    # Drop near-duplicate MIDI files before windowing and repeated training windows
+    dedup = True
+    
     # Check if data needs processing
-    if not os.path.exists(os.path.join(processed_dir, 'X.npy')):
+    processed_file = 'X.npy' if data_source == 'npy' else 'vocab.pkl'
+    if not os.path.exists(os.path.join(processed_dir, processed_file)):
         print("Processing data...")
-        processor.process_dataset(os.path.join(data_dir, 'raw'), processed_dir)
+        processor.process_dataset(os.path.join(data_dir, 'raw'), processed_dir, dedup=dedup)
     else:
         print("Loading existing vocabulary...")
         processor.load_vocab(os.path.join(processed_dir, 'vocab.pkl'))
     
     vocab_size = len(processor.note_to_int)
-    print(f"Vocabulary size: {vocab_size}")
+    # One embedding row per raga ID (Melakartas 1-72, then the dataset's janya ragas)
+    num_ragas = max(processor.raga_to_int.values()) + 1
+    print(f"Vocabulary size: {vocab_size}, raga IDs: {num_ragas}")
+    
+    # Assign files to train/val/test once; later runs only place new files
+    build_split_manifest(os.path.join(data_dir, 'raw'), os.path.join(processed_dir, 'split_manifest.json'))
     
     if vocab_size == 0:
         print("No data found or processed. Exiting.")
@@ -129,30 +274,53 @@ def main():
     num_layers = 2
     batch_size = 32
     num_epochs = 50
+    check_grammar = True  # Score validation predictions against the raga grammar every epoch
+    precision = 'auto'  # 'bf16' autocast where the CPU/GPU has bf16 units, 'fp32' to turn it off
+    augment = True  # Octave-shift, stretch and ornament (and, unconditioned, transpose) batches on the fly
+    loader_workers = min(4, os.cpu_count() or 1)
     
     # Device configuration
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    precision = resolve_precision(precision, device)
+    print(f"Training on {device} in {precision}")
     
     # Initialize model
-    model = DeepRagaModel(vocab_size, embedding_dim, hidden_size, num_layers).to(device)
+    model = DeepRagaModel(vocab_size, embedding_dim, hidden_size, num_layers, num_ragas=num_ragas).to(device)
     
     # Load data
-    train_dataset = RagaDataset(data_dir, split='train')
-    val_dataset = RagaDataset(data_dir, split='val')
+    train_dataset = RagaDataset(data_dir, split='train', source=data_source, processor=processor, dedup=dedup)
+    val_dataset = RagaDataset(data_dir, split='val', source=data_source, processor=processor)
     
     if len(train_dataset) == 0:
         print("No training data available.")
         return
         
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
+    # Augmentation runs in the loader's worker processes; augmented copies are never stored.
+    # A raga ID implies Sa = C4 (grammar, start notes, gamakas), so a raga-conditioned
+    # model is not shown transposed windows: they would be out of scale for their ID
+    transpositions = () if model.num_ragas > 0 else (-2, -1, 1, 2)
+    augmenter = TokenAugmenter.build(processor.int_to_note, processor.raga_to_int, RagaIndex.from_sources(),
+                                     transpositions=transpositions) if augment else None
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=loader_workers,
+                              persistent_workers=loader_workers > 0,
+                              collate_fn=augmenter.collate if augmenter is not None else None)
     val_loader = DataLoader(val_dataset, batch_size=batch_size)
     
+    grammar_check = GrammarCheck.build(processor, train_dataset) if check_grammar else None
+    
     # Train the model
-    train_model(model, train_loader, val_loader, num_epochs, device, vocab_size)
+    train_model(model, train_loader, val_loader, num_epochs, device, vocab_size, grammar_check, precision)
+    
+    if precision == 'bf16' and len(val_loader) > 0:
+        # Check that bf16 changes little against an fp32 evaluation of the same weights
+        parity = compare_precisions(model, val_loader, device)
+        print(f"Precision parity: val loss fp32 {parity['fp32_loss']:.4f}, bf16 {parity['bf16_loss']:.4f}; "
+              f"next-note KL {parity['kl']:.5f}, TV {parity['tv']:.4f}, "
+              f"top-1 agreement {100. * parity['top1_agreement']:.2f}%")
     
     # Save the trained model
     torch.save(model.state_dict(), os.path.join(model_dir, 'trained_model.pth'))
-    print("Model saved!")
+    print("Model saved! Publish it for serving with: python -m model.registry publish --current")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -2,7 +2,8 @@ import os
 import tensorflow as tf
 import numpy as np
 from model.basic_model import BasicRaagaModel
-from data.raw.process_raga_audio import parse_raga_pattern, convert_swaras_to_midi_notes
+from data.raw.process_raga_audio import parse_raga_pattern
+from data.swara_codec import to_midi
 
 def prepare_training_data(raga_dir):
     """Prepare training data from raga patterns."""
@@ -15,8 +16,8 @@ def prepare_training_data(raga_dir):
             patterns = parse_raga_pattern(text_file)
             
             # Convert swaras to MIDI notes
-            arohanam_notes = convert_swaras_to_midi_notes(patterns['arohanam'])
-            avarohanam_notes = convert_swaras_to_midi_notes(patterns['avarohanam'])
+            arohanam_notes = to_midi(patterns['arohanam']).tolist()
+            avarohanam_notes = to_midi(patterns['avarohanam']).tolist()
             
             # Create sequence
             sequence = np.array(arohanam_notes + avarohanam_notes)
@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import uuid
+import bisect
+import random
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+# Seconds; the defaults of the Prometheus client libraries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                     for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    """Base of the metric types. With `function`, values are read at scrape time:
+    a number for unlabelled metrics, else {label values tuple: number}."""
+    kind = None
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, '') for n in self.labels)
+
+    def render(self):
+        if self.function is not None:
+            values = self.function()
+            with self._lock:
+                self._values.update(values if isinstance(values, dict) else {(): values})
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_labels_text(self.labels, key)} {value}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            labels = _labels_text(self.labels + ('le',), key + (bound,))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _labels_text(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def resident_memory_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # ru_maxrss (a peak, not the current size) is KiB on Linux and bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter(
+    'deepraaga_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'method', 'status')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'deepraaga_request_seconds', 'End-to-end request latency', ('endpoint',)))
+QUEUE_SECONDS = REGISTRY.register(Histogram(
+    'deepraaga_queue_seconds', 'Time from request arrival (or batch submission) to the first model call',
+    ('endpoint',)))
+MODEL_STEP_SECONDS = REGISTRY.register(Histogram(
+    'deepraaga_model_step_seconds', 'Time per model forward step', ('endpoint',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)))
+DECODE_SECONDS = REGISTRY.register(Histogram(
+    'deepraaga_decode_seconds', 'Time turning model output into the response body', ('endpoint',)))
+TOKENS_GENERATED = REGISTRY.register(Counter(
+    'deepraaga_tokens_generated_total', 'Notes sampled by the generator'))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    'deepraaga_batch_size', 'Requests per model batch', ('model',),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)))
+# Render lookups are read from the cache's own counters (the app sets the function);
+# prefix-cache lookups are counted as they happen
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'deepraaga_cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result')))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    'deepraaga_model_load_seconds', 'Time taken by the last model load', ('model',)))
+REGISTRY.register(Gauge('process_resident_memory_bytes', 'Resident memory size in bytes',
+                        function=resident_memory_bytes))
+REGISTRY.register(Counter('process_cpu_seconds_total', 'Total user and system CPU time in seconds',
+                        function=cpu_seconds))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, message and any `fields` passed via extra"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_logger(name='deepraaga'):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(os.environ.get('DEEPRAAGA_LOG_LEVEL', 'INFO'))
+        logger.propagate = False
+    return logger
+
+
+class Trace:
+    """Per-request trace ID and named span timings"""
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans = {}
+
+    @contextmanager
+    def span(self, name, histogram=None, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(name, elapsed)
+            if histogram is not None:
+                histogram.observe(elapsed, **labels)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def since_start(self):
+        return time.perf_counter() - self.start
+
+
+class ProfileSession:
+    """Torch profiler recordings of one sampled request.
+
+    torch only records ops on the thread that started a profiler, so work a
+    request hands to another thread (e.g. the generation batcher) is
+    recorded there as a segment of its own: `start(name)` and `stop()` are
+    called on the thread doing the work, one segment at a time.
+    """
+
+    def __init__(self):
+        self.segments = []
+        self._active = None
+
+    def start(self, name):
+        import torch.profiler
+        profile = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+        profile.__enter__()
+        self._active = (name, profile)
+
+    def stop(self):
+        if self._active is not None:
+            name, profile = self._active
+            self._active = None
+            profile.__exit__(None, None, None)
+            self.segments.append((name, profile))
+
+
+class Profiler:
+    """Opt-in torch profiler around a sampled share of requests.
+
+    DEEPRAAGA_PROFILE_RATE (0-1, default 0) sets the sampled share and
+    DEEPRAAGA_PROFILE_DIR where the Chrome traces of each sampled request
+    are written, named by trace ID and segment. Only one request is
+    profiled at a time; requests arriving meanwhile are not sampled.
+    """
+
+    def __init__(self, rate=None, output_dir=None):
+        self.rate = float(os.environ.get('DEEPRAAGA_PROFILE_RATE', 0) if rate is None else rate)
+        self.output_dir = output_dir or os.environ.get('DEEPRAAGA_PROFILE_DIR',
+                                                       os.path.join('data', 'processed', 'profiles'))
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return self.rate > 0 and random.random() < self.rate
+
+    def session(self):
+        """A ProfileSession for a sampled request, or None (not sampled, or another one is running)"""
+        if not self.sampled() or not self._lock.acquire(blocking=False):
+            return None
+        return ProfileSession()
+
+    def finish(self, session, trace_id):
+        """Stop a session and write one Chrome trace per segment; returns their paths"""
+        try:
+            session.stop()
+            os.makedirs(self.output_dir, exist_ok=True)
+            paths = []
+            for name, profile in session.segments:
+                path = os.path.join(self.output_dir, f'{trace_id}-{name}.json')
+                profile.export_chrome_trace(path)
+                paths.append(path)
+            return paths
+        finally:
+            self._lock.release()
+
+    def discard(self, session):
+        try:
+            session.stop()
+        finally:
+            self._lock.release()
+
+
+def install(app, profiler=None):
+    """Add trace IDs, request metrics, structured access logs and /metrics to a Flask app"""
+    from flask import Response, g, request
+
+    logger = get_logger()
+    profiler = profiler or Profiler()
+
+    @app.before_request
+    def start_trace():
+        g.trace = Trace(request.headers.get('X-Request-ID'))
+        # Scrapes are neither profiled nor logged above debug level
+        scrape = request.path == '/metrics'
+        g.profile = None if scrape else profiler.session()
+        if g.profile is not None:
+            g.profile.start('request')
+
+    @app.after_request
+    def finish_trace(response):
+        trace = g.get('trace')
+        if trace is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        elapsed = trace.since_start()
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        fields = {
+            'trace_id': trace.trace_id, 'method': request.method, 'path': request.path,
+            'endpoint': endpoint, 'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+            'spans_ms': {name: round(seconds * 1000, 3) for name, seconds in trace.spans.items()},
+        }
+        if g.get('profile') is not None:
+            fields['profile'] = profiler.finish(g.profile, trace.trace_id)
+            g.profile = None
+        level = logging.DEBUG if request.path == '/metrics' else logging.INFO
+        logger.log(level, 'request', extra={'fields': fields})
+        response.headers['X-Trace-ID'] = trace.trace_id
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # Requests that failed before after_request still close their profiler
+        if g.get('profile') is not None:
+            profiler.discard(g.profile)
+            g.profile = None
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    return logger
+
+
+def current_profile():
+    """The active request's ProfileSession, or None when it is not being profiled"""
+    from flask import g, has_request_context
+    return g.get('profile') if has_request_context() else None
+
+
+def current_trace():
+    """The active request's Trace, or a throwaway one outside a request"""
+    from flask import g, has_request_context
+    if has_request_context() and g.get('trace') is not None:
+        return g.trace
+    return Trace()
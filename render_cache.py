@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """Content-addressed, size-bounded LRU cache of rendered files on disk.
+
+    Entries are named by a SHA-256 of their render inputs, so a key doubles as
+    a strong ETag. Recency is kept in memory and mirrored to file mtimes, which
+    lets a restarted server rebuild the LRU order from a directory scan.
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, suffix='.mid'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.suffix):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                found.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def key_for(inputs):
+        """Hash a JSON-serializable description of the render inputs"""
+        canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get(self, key):
+        """Return the cached file path for `key`, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Removed behind our back (e.g. by another worker's eviction)
+            with self._lock:
+                self.total_bytes -= self._entries.pop(key, 0)
+            return None
+        return path
+
+    def put(self, key, data):
+        """Store rendered bytes under `key` and evict least recently used entries"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        path = self.path_for(key)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.path_for(old_key))
+            except FileNotFoundError:
+                pass
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -3,8 +3,15 @@ import numpy as np
 import sys
 sys.path.append('..')
 from model.model import DeepRagaModel
+from model.incremental import DeepRagaStepper, generate
+from data.swara_codec import SWARA_NAMES, decode, encode, index_table
 import json
 
+# Model vocabulary: the sixteen swaras of the middle octave and upper Sa
+VOCABULARY = list(SWARA_NAMES) + ["S'"]
+VOCABULARY_CODES = encode(VOCABULARY)
+VOCABULARY_INDEX = index_table(VOCABULARY)
+
 def load_raga_data(json_path):
     """Load raga patterns from JSON file"""
     with open(json_path, 'r') as f:
@@ -15,47 +22,19 @@ def load_raga_data(json_path):
     return None
 
 def preprocess_swara_sequence(swara_sequence):
-    """Convert swara sequence to numerical representation"""
-    # Define swara to numerical mapping
-    swara_map = {
-        'S': 0, 'R1': 1, 'R2': 2, 'R3': 3,
-        'G1': 4, 'G2': 5, 'G3': 6,
-        'M1': 7, 'M2': 8,
-        'P': 9,
-        'D1': 10, 'D2': 11, 'D3': 12,
-        'N1': 13, 'N2': 14, 'N3': 15,
-        "S'": 16
-    }
-    
-    sequence = swara_sequence.split()
-    return torch.tensor([swara_map[s] for s in sequence], dtype=torch.float32)
+    """Convert swara sequence to vocabulary indices"""
+    indices = VOCABULARY_INDEX[encode(swara_sequence, errors='raise')]
+    return torch.tensor(indices, dtype=torch.long)
 
-def generate_kanada_sequence(model, raga_pattern, sequence_length=32):
+def generate_kanada_sequence(model, raga_pattern, sequence_length=32, window=None):
     """Generate new sequence based on Kanada raga pattern"""
     model.eval()
     
-    # Prepare input sequence from ascending pattern
+    # Prime with the ascending pattern, then feed back one predicted note per
+    # step; the attention window defaults to the length of the pattern
     input_sequence = preprocess_swara_sequence(raga_pattern['ascending'])
-    input_sequence = input_sequence.unsqueeze(0).unsqueeze(2)  # Add batch and feature dimensions
-    
-    generated_sequence = []
-    
-    with torch.no_grad():
-        for _ in range(sequence_length):
-            # Generate next note
-            output = model(input_sequence)
-            
-            # Get the predicted note
-            predicted = torch.argmax(output, dim=1)
-            generated_sequence.append(predicted.item())
-            
-            # Update input sequence
-            input_sequence = torch.cat([
-                input_sequence[:, 1:, :],
-                predicted.unsqueeze(0).unsqueeze(1).unsqueeze(2)
-            ], dim=1)
-    
-    return generated_sequence
+    stepper = DeepRagaStepper(model, window or len(input_sequence))
+    return generate(stepper, input_sequence, sequence_length, lambda logits: int(logits.argmax()))
 
 def main():
     # Load Kanada raga pattern
@@ -66,10 +45,10 @@ def main():
     
     # Initialize model
     model = DeepRagaModel(
-        input_size=1,  # Single feature (note)
+        vocab_size=len(VOCABULARY),  # Number of possible swaras
+        embedding_dim=32,
         hidden_size=128,
-        num_layers=2,
-        output_size=17  # Number of possible swaras
+        num_layers=2
     )
     
     # Load trained weights
@@ -84,17 +63,7 @@ def main():
     generated_sequence = generate_kanada_sequence(model, raga_pattern)
     
     # Convert numerical sequence back to swaras
-    swara_map = {
-        0: 'S', 1: 'R1', 2: 'R2', 3: 'R3',
-        4: 'G1', 5: 'G2', 6: 'G3',
-        7: 'M1', 8: 'M2',
-        9: 'P',
-        10: 'D1', 11: 'D2', 12: 'D3',
-        13: 'N1', 14: 'N2', 15: 'N3',
-        16: "S'"
-    }
-    
-    generated_swaras = [swara_map[note] for note in generated_sequence]
+    generated_swaras = decode(VOCABULARY_CODES[generated_sequence])
     print("\nGenerated Kanada Raga Sequence:")
     print(' '.join(generated_swaras))
 
@@ -0,0 +1,88 @@
+import os
+import gzip
+import json
+import zlib
+import struct
+import tempfile
+import numpy as np
+import sys
+sys.path.append('..')
+from model.tfrecord_reader import (NoteSequenceDataset, iter_indexed_records, iter_records, masked_crc32c,
+                                   parse_note_sequence)
+from model.data_processor import DataProcessor
+
+# A NoteSequence as protobuf serializes it: a C4 (velocity 80) from 0.25 s to
+# 0.5 s, an E4+G4 chord from 0.5 s to 1 s, a pitch bend of -512 at 0.5 s and
+# total_time 1.0
+KNOWN_RECORD = bytes.fromhex(
+    '4216' '083c' '1050' '19000000000000d03f' '21000000000000e03f'
+    '4216' '0840' '1050' '19000000000000e03f' '21000000000000f03f'
+    '4216' '0843' '1050' '19000000000000e03f' '21000000000000f03f'
+    '49000000000000f03f'
+    '5214' '09000000000000e03f' '1080fcffffffffffffff01')
+
+def frame(data):
+    """Wrap a payload in TFRecord framing: length, masked CRC of the length, data, masked CRC of the data"""
+    header = struct.pack('<Q', len(data))
+    return header + struct.pack('<I', masked_crc32c(header)) + data + struct.pack('<I', masked_crc32c(data))
+
+def unmask(crc):
+    rotated = (crc - 0xA282EAD8) & 0xFFFFFFFF
+    return ((rotated >> 17) | (rotated << 15)) & 0xFFFFFFFF
+
+def test_masked_crc32c():
+    # The CRC-32C check value of the standard test vector
+    assert unmask(masked_crc32c(b'123456789')) == 0xE3069283
+    assert unmask(masked_crc32c(b'')) == 0
+
+def test_parse_known_record():
+    sequence = parse_note_sequence(KNOWN_RECORD)
+    assert sequence['pitch'].tolist() == [60, 64, 67]
+    assert sequence['velocity'].tolist() == [80, 80, 80]
+    assert sequence['start_time'].tolist() == [0.25, 0.5, 0.5]
+    assert sequence['end_time'].tolist() == [0.5, 1.0, 1.0]
+    assert sequence['bend'].tolist() == [-512]
+    assert sequence['bend_time'].tolist() == [0.5]
+    assert sequence['total_time'] == 1.0
+
+def test_round_trip():
+    for compression in (None, 'GZIP', 'ZLIB'):
+        check_round_trip(compression)
+
+def check_round_trip(compression):
+    """Write the known record into a shard listed in index.json and read it back with CRC checks"""
+    data = frame(KNOWN_RECORD) * 3
+    if compression == 'GZIP':
+        data = gzip.compress(data)
+    elif compression == 'ZLIB':
+        data = zlib.compress(data)
+    with tempfile.TemporaryDirectory() as tfrecord_dir:
+        # No suffix hints at the compression; only index.json records it
+        with open(os.path.join(tfrecord_dir, 'shard.tfrecord'), 'wb') as f:
+            f.write(data)
+        with open(os.path.join(tfrecord_dir, 'index.json'), 'w') as f:
+            json.dump({'generation': 1, 'total_records': 3, 'shards': [
+                {'path': 'shard.tfrecord', 'num_records': 3, 'compression': compression,
+                 'content_hashes': ['a', 'b', 'c']}]}, f)
+        shard = os.path.join(tfrecord_dir, 'shard.tfrecord')
+        assert list(iter_records(shard, verify=True)) == [KNOWN_RECORD] * 3
+        assert [h for h, _ in iter_indexed_records(tfrecord_dir)] == ['a', 'b', 'c']
+        dataset = NoteSequenceDataset([shard], verify=True)
+        assert len(dataset) == 3
+        assert dataset[2]['pitch'].tolist() == [60, 64, 67]
+
+def test_sequence_note_ids():
+    processor = DataProcessor()
+    processor.update_vocab(['C4', '4.7', 'D4'])
+    ids = processor.sequence_note_ids(parse_note_sequence(KNOWN_RECORD))
+    assert ids.tolist() == [0, 1]
+
+def main():
+    test_masked_crc32c()
+    test_parse_known_record()
+    test_round_trip()
+    test_sequence_note_ids()
+    print("TFRecord reader checks passed")
+
+if __name__ == '__main__':
+    main()